@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+
+"""
+The end-to-end benchmark of the hive node with the local MongoDB and the in-memory IPFS stand-in (fake_ipfs.py).
+
+    python -m benchmarks.e2e_benchmark --workloads db_insert,db_find,files_upload --requests 200 --concurrency 8 \\
+        --output result.json
+    python -m benchmarks.e2e_benchmark --compare base.json result.json
+
+The hive node is started by gunicorn with a temporary data directory, the MongoDB of --mongodb-url
+or a temporary mongod started from the PATH, and the IPFS stand-in as both the node and the gateway.
+The other configure items (the service DID, etc.) are from the configure file of the hive node (HIVE_CONFIG or .env).
+
+Every workload runs the requests by the concurrent clients and reports the throughput, the latency percentiles
+and the MongoDB commands per request (from the header 'X-Hive-Mongo'). The result file contains the commit,
+so the results of the commits can be compared by --compare.
+
+The user and application DIDs of the tests are used. The DID documents are resolved by the hive node on the
+first sign in, so only the 'auth' workload and the first run need the DID resolver, others need no network.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import typing as t
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks import fake_ipfs
+from benchmarks.serving_benchmark import BASE_DIR, get_free_port, start_server, wait_ready, percentile
+
+COLLECTION = 'bench_collection'
+SCRIPT = 'bench_find'
+DOWNLOAD_FILES = 20
+
+
+class Context:
+    """ The clients of the workloads, which share the access token of the user. """
+
+    def __init__(self, base_url, file_size):
+        self.base_url = base_url
+        self.file_size = file_size
+        self.local = threading.local()
+
+        # the tests DIDs and the token cache, the port of the hive node is from the environment.
+        from tests.utils.http_client import HttpClient
+        self.http_client = HttpClient('/api/v2')
+        self.resolver = self.http_client.remote_resolver
+        self.headers = {'Authorization': 'token ' + self.resolver.get_token()}
+        self.content = os.urandom(file_size)
+
+    @property
+    def session(self) -> requests.Session:
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+            self.local.session.headers.update(self.headers)
+        return self.local.session
+
+    def request(self, method, path, **kwargs) -> requests.Response:
+        return self.session.request(method, self.base_url + '/api/v2' + path, timeout=600, **kwargs)
+
+
+def setup_vault(ctx: Context):
+    ctx.request('PUT', '/subscription/vault')
+
+
+def setup_collection(ctx: Context):
+    ctx.request('PUT', f'/vault/db/collections/{COLLECTION}')
+    docs = [{'author': f'author{i % 10}', 'title': f'title{i}', 'words_count': i} for i in range(100)]
+    ctx.request('POST', f'/vault/db/collection/{COLLECTION}', json={'document': docs})
+
+
+def run_auth(ctx: Context, i):
+    ctx.resolver.auth(ctx.resolver.sign_in(), ctx.resolver.get_current_user_did())
+
+
+def run_db_insert(ctx: Context, i):
+    return ctx.request('POST', f'/vault/db/collection/{COLLECTION}',
+                       json={'document': [{'author': f'author{i % 10}', 'title': f'insert{i}', 'words_count': i}]})
+
+
+def run_db_find(ctx: Context, i):
+    return ctx.request('GET', f'/vault/db/{COLLECTION}', params={'filter': json.dumps({'author': f'author{i % 10}'}), 'limit': 10})
+
+
+def run_files_upload(ctx: Context, i):
+    return ctx.request('PUT', f'/vault/files/bench/upload/{i}.bin', data=ctx.content)
+
+
+def setup_files_download(ctx: Context):
+    for i in range(DOWNLOAD_FILES):
+        ctx.request('PUT', f'/vault/files/bench/download/{i}.bin', data=ctx.content)
+
+
+def run_files_download(ctx: Context, i):
+    r = ctx.request('GET', f'/vault/files/bench/download/{i % DOWNLOAD_FILES}.bin')
+    if r.status_code == 200 and len(r.content) != ctx.file_size:
+        raise ValueError(f'Invalid size of the downloaded file: {len(r.content)}')
+    return r
+
+
+def run_files_list(ctx: Context, i):
+    return ctx.request('GET', '/vault/files/bench/download?comp=children')
+
+
+def setup_scripting(ctx: Context):
+    setup_collection(ctx)
+    ctx.request('PUT', f'/vault/scripting/{SCRIPT}', json={'executable': {
+        'name': SCRIPT, 'type': 'find',
+        'body': {'collection': COLLECTION, 'filter': {'author': '$params.author'}}}})
+
+
+def run_scripting(ctx: Context, i):
+    context = {'target_did': ctx.resolver.get_current_user_did_str(), 'target_app_did': ctx.resolver.app_did.get_did_string()}
+    return ctx.request('PATCH', f'/vault/scripting/{SCRIPT}', json={'context': context, 'params': {'author': f'author{i % 10}'}})
+
+
+def setup_backup(ctx: Context):
+    # the hive node backups to itself.
+    setup_files_download(ctx)
+    setup_collection(ctx)
+    ctx.request('PUT', '/subscription/backup')
+    ctx.credential = ctx.http_client.get_backup_credential()
+
+
+def run_backup(ctx: Context, i):
+    r = ctx.request('POST', '/vault/content?to=hive_node&is_force=true', json={'credential': ctx.credential})
+    if r.status_code != 201:
+        return r
+    while True:
+        time.sleep(0.2)
+        r = ctx.request('GET', '/vault/content')
+        result = r.json().get('result') if r.status_code == 200 else None
+        if result != 'process':
+            if result != 'success':
+                raise ValueError(f'Failed to backup: {r.text}')
+            return r
+
+
+# name: (setup, run, whether the requests of the workload run one by one)
+WORKLOADS = {
+    'auth': (None, run_auth, False),
+    'db_insert': (setup_collection, run_db_insert, False),
+    'db_find': (setup_collection, run_db_find, False),
+    'files_upload': (None, run_files_upload, False),
+    'files_download': (setup_files_download, run_files_download, False),
+    'files_list': (setup_files_download, run_files_list, False),
+    'scripting': (setup_scripting, run_scripting, False),
+    'backup': (setup_backup, run_backup, True),
+}
+
+
+def run_workload(ctx: Context, name, requests_count, concurrency) -> dict:
+    setup, run, is_serial = WORKLOADS[name]
+    if setup:
+        setup(ctx)
+
+    latencies, mongo_counts, errors, lock = list(), list(), [0], threading.Lock()
+
+    def run_once(i):
+        start = time.perf_counter()
+        try:
+            r = run(ctx, i)
+            ok = r is None or r.status_code < 400
+        except Exception:
+            r, ok = None, False
+        elapsed = time.perf_counter() - start
+        summary = r.headers.get('X-Hive-Mongo') if r is not None else None
+        with lock:
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors[0] += 1
+            if summary:
+                mongo_counts.append(int(summary.split(';')[0].split('=')[1]))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=1 if is_serial else concurrency) as pool:
+        list(pool.map(run_once, range(requests_count)))
+    duration = time.perf_counter() - start
+
+    return {'requests': requests_count,
+            'errors': errors[0],
+            'duration': round(duration, 3),
+            'rps': round(len(latencies) / duration, 2) if duration else 0,
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p90_ms': round(percentile(latencies, 90) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+            'mongo_per_request': round(sum(mongo_counts) / len(mongo_counts), 2) if mongo_counts else None}
+
+
+def start_mongod(data_dir) -> t.Tuple[str, t.Optional[subprocess.Popen]]:
+    mongod = shutil.which('mongod')
+    if not mongod:
+        raise SystemExit('mongod is not found in the PATH, please specify the MongoDB by --mongodb-url.')
+    port = get_free_port()
+    path = os.path.join(data_dir, 'mongodb')
+    os.makedirs(path)
+    process = subprocess.Popen([mongod, '--dbpath', path, '--port', str(port), '--bind_ip', '127.0.0.1', '--quiet'],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'mongodb://127.0.0.1:{port}'
+    from pymongo import MongoClient
+    MongoClient(url, serverSelectionTimeoutMS=30000).admin.command('ping')
+    return url, process
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR.as_posix()).decode().strip()
+    except Exception:
+        return None
+
+
+def run(args):
+    data_dir = tempfile.mkdtemp(prefix='hive-bench-')
+    processes = list()
+    try:
+        mongodb_url, mongod = (args.mongodb_url, None) if args.mongodb_url else start_mongod(data_dir)
+        if mongod:
+            processes.append(mongod)
+
+        ipfs_port = get_free_port()
+        ipfs = multiprocessing.Process(target=fake_ipfs.serve, args=(ipfs_port, ), daemon=True)
+        ipfs.start()
+
+        port = get_free_port()
+        env = {'MONGODB_URL': mongodb_url,
+               'IPFS_NODE_URL': f'http://127.0.0.1:{ipfs_port}',
+               'IPFS_GATEWAY_URL': f'http://127.0.0.1:{ipfs_port}',
+               'DATA_STORE_PATH': os.path.join(data_dir, 'data'),
+               'MONGO_TRACE_HEADER': 'True',
+               'LOG_REQUEST_SAMPLE_RATE': '0',
+               'LOG_LEVELS': 'root=WARNING'}
+        processes.append(start_server(port, args.workers, args.threads, env=env))
+        base_url = f'http://127.0.0.1:{port}'
+        wait_ready(base_url + '/api/v2/node/version')
+
+        os.environ['HIVE_PORT'] = str(port)
+        ctx = Context(base_url, args.file_size)
+        setup_vault(ctx)
+
+        results = dict()
+        for name in args.workloads.split(','):
+            results[name] = run_workload(ctx, name, args.requests if not WORKLOADS[name][2] else args.serial_requests, args.concurrency)
+            print(f'{name:>16}: {json.dumps(results[name])}')
+    finally:
+        for p in processes:
+            p.terminate()
+            p.wait(timeout=60)
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    return {'commit': get_commit(),
+            'time': int(time.time()),
+            'options': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+            'results': results}
+
+
+def compare(base_file, new_file):
+    with open(base_file) as f:
+        base = json.load(f)
+    with open(new_file) as f:
+        new = json.load(f)
+
+    def delta(a, b):
+        return f'{(b - a) / a * 100:+.1f}%' if a else 'n/a'
+
+    print(f'{base["commit"]} -> {new["commit"]}')
+    print(f'{"workload":>16} {"rps":>20} {"p50(ms)":>20} {"p99(ms)":>20} {"mongo/req":>12}')
+    for name, r in new['results'].items():
+        b = base['results'].get(name)
+        if not b:
+            continue
+        print(f'{name:>16} {r["rps"]:>10} {delta(b["rps"], r["rps"]):>9} {r["p50_ms"]:>10} {delta(b["p50_ms"], r["p50_ms"]):>9} '
+              f'{r["p99_ms"]:>10} {delta(b["p99_ms"], r["p99_ms"]):>9} {b["mongo_per_request"]}->{r["mongo_per_request"]}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='The end-to-end benchmark of the hive node.')
+    parser.add_argument('--workloads', default=','.join([n for n in WORKLOADS if n not in ('auth', 'backup')]),
+                        help=f'comma separated, all: {",".join(WORKLOADS.keys())}')
+    parser.add_argument('--requests', type=int, default=200, help='the requests of every workload')
+    parser.add_argument('--serial-requests', type=int, default=3, help='the requests of the serial workloads (backup)')
+    parser.add_argument('--concurrency', type=int, default=8, help='the concurrent clients')
+    parser.add_argument('--file-size', type=int, default=64 * 1024, help='the size of the uploaded files')
+    parser.add_argument('--workers', type=int, default=1, help='the worker processes of gunicorn')
+    parser.add_argument('--threads', type=int, default=8, help='the threads of every worker')
+    parser.add_argument('--mongodb-url', default=None, help='the MongoDB to use, default starts a temporary mongod')
+    parser.add_argument('--output', default=None, help='the file to write the result')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help='compare two result files')
+    args = parser.parse_args()
+
+    if args.compare:
+        return compare(*args.compare)
+
+    result = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
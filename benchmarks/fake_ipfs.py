@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+"""
+The in-memory stand-in of the IPFS HTTP API for the benchmarks, which serves as both the node and the gateway.
+
+    python -m benchmarks.fake_ipfs --port 5001
+
+Supported: add, cat, pin/add, pin/ls, pin/rm, block/stat and files/mkdir|cp|stat|rm of the MFS directories.
+The CID is the 'Qm' prefixed SHA256 of the content, so the same content always gets the same CID.
+"""
+import argparse
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+
+class Store:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.blocks = dict()  # cid: content
+        self.pins = set()
+        self.dirs = dict()  # mfs path: {name: cid}
+
+    def add(self, content: bytes) -> str:
+        cid = 'Qm' + hashlib.sha256(content).hexdigest()[:44]
+        with self.lock:
+            self.blocks[cid] = content
+            self.pins.add(cid)
+        return cid
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class IpfsHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    store = Store()
+
+    def log_message(self, format_, *args):
+        pass
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        args = parse_qs(url.query).get('arg', [])
+        body = self.__read_body()
+        command = url.path[len('/api/v0/'):] if url.path.startswith('/api/v0/') else ''
+        handler = getattr(self, 'api_' + command.replace('/', '_'), None)
+        if not handler:
+            return self.__send(404, {'Message': f'unknown command {command}'})
+        return handler(args, body)
+
+    def api_add(self, args, body):
+        content = self.__parse_multipart(body)
+        cid = self.store.add(content)
+        self.__send(200, {'Name': cid, 'Hash': cid, 'Size': str(len(content))})
+
+    def api_cat(self, args, body):
+        cid = args[0].replace('/ipfs/', '') if args else ''
+        content = self.store.blocks.get(cid)
+        if content is None:
+            return self.__send(500, {'Message': f'block {cid} not found'})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def api_pin_add(self, args, body):
+        cids = [a.replace('/ipfs/', '') for a in args]
+        missing = [c for c in cids if c not in self.store.blocks]
+        if missing:
+            return self.__send(500, {'Message': f'block {missing[0]} not found'})
+        with self.store.lock:
+            self.store.pins.update(cids)
+        self.__send(200, {'Pins': cids})
+
+    def api_pin_ls(self, args, body):
+        cids = [a.replace('/ipfs/', '') for a in args]
+        not_pinned = [c for c in cids if c not in self.store.pins]
+        if not_pinned:
+            return self.__send(500, {'Message': f'path \'{not_pinned[0]}\' is not pinned'})
+        self.__send(200, {'Keys': {c: {'Type': 'recursive'} for c in (cids or self.store.pins)}})
+
+    def api_pin_rm(self, args, body):
+        cids = [a.replace('/ipfs/', '') for a in args]
+        with self.store.lock:
+            if any([c not in self.store.pins for c in cids]):
+                return self.__send(500, {'Message': 'not pinned or pinned indirectly'})
+            self.store.pins.difference_update(cids)
+        self.__send(200, {'Pins': cids})
+
+    def api_block_stat(self, args, body):
+        cid = args[0].replace('/ipfs/', '') if args else ''
+        if cid not in self.store.blocks:
+            return self.__send(500, {'Message': f'block {cid} not found'})
+        self.__send(200, {'Key': cid, 'Size': len(self.store.blocks[cid])})
+
+    def api_files_mkdir(self, args, body):
+        with self.store.lock:
+            self.store.dirs.setdefault(args[0], dict())
+        self.__send(200, {})
+
+    def api_files_cp(self, args, body):
+        src, dst = args[0].replace('/ipfs/', ''), args[1]
+        parent, name = dst.rsplit('/', 1)
+        with self.store.lock:
+            self.store.dirs.setdefault(parent, dict())[name] = src
+        self.__send(200, {})
+
+    def api_files_stat(self, args, body):
+        children = self.store.dirs.get(args[0], dict())
+        cid = self.store.add(json.dumps(children, sort_keys=True).encode())
+        self.__send(200, {'Hash': cid, 'Type': 'directory'})
+
+    def api_files_rm(self, args, body):
+        with self.store.lock:
+            self.store.dirs.pop(args[0], None)
+        self.__send(200, {})
+
+    def __read_body(self) -> bytes:
+        if 'chunked' in self.headers.get('Transfer-Encoding', ''):
+            chunks = list()
+            while True:
+                size = int(self.rfile.readline().strip().split(b';')[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return b''.join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length) if length else b''
+
+    def __parse_multipart(self, body: bytes) -> bytes:
+        """ The content of the first part. """
+        content_type = self.headers.get('Content-Type', '')
+        if 'boundary=' not in content_type:
+            return body
+        boundary = content_type.split('boundary=', 1)[1].strip('"').encode()
+        part = body.split(b'--' + boundary)[1]
+        return part.split(b'\r\n\r\n', 1)[1][:-2]
+
+    def __send(self, status, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve(port, host='127.0.0.1'):
+    ThreadingHTTPServer((host, port), IpfsHandler).serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='The in-memory stand-in of the IPFS HTTP API.')
+    parser.add_argument('--port', type=int, default=5001)
+    serve(parser.parse_args().port)
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+
+"""
+The micro benchmarks of the pure python hot spots which run on every request or every byte.
+
+    python -m benchmarks.micro_benchmark --output base.json
+    python -m benchmarks.micro_benchmark --filter 'encrypt|sha256' --baseline base.json --threshold 0.2
+
+Every case runs with the representative sizes (documents or bytes) and reports the time of one call
+(the minimum and the median of the rounds) and the peak of the allocated memory of one call by tracemalloc.
+The input of every call is prepared out of the timing, so the cases which update the input in place are fair.
+
+With --baseline, the cases which are slower or allocate more than the threshold are reported as the regressions
+and the exit status is 1, so the optimization can be proven and kept by the result file of the base commit.
+The timing depends on the machine, so the base and the new result must be measured on the same one.
+"""
+import argparse
+import copy
+import datetime
+import gc
+import io
+import json
+import os
+import re
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+import typing as t
+
+from bson import ObjectId
+
+from benchmarks.e2e_benchmark import get_commit
+
+KB, MB = 1024, 1024 * 1024
+MEMORY_SLACK = 4 * KB  # the allocation differences less than it are not regressions
+
+# case name: (function(size, temp_dir) -> (setup, func), size)
+CASES = dict()
+
+
+def case(name, sizes):
+    """ Register the case with the sizes, the function returns the setup of the arguments and the function to run. """
+    def wrapper(f):
+        for size in sizes:
+            CASES[f'{name}[{format_size(size)}]'] = (f, size)
+        return f
+    return wrapper
+
+
+def format_size(size):
+    if size >= MB:
+        return f'{size // MB}MB'
+    if size >= KB:
+        return f'{size // KB}KB'
+    return str(size)
+
+
+def make_document(i) -> dict:
+    return {'_id': ObjectId(),
+            'author': f'author{i % 10}',
+            'title': f'The title of the document {i}',
+            'words_count': i * 10,
+            'ratio': i / 7,
+            'tags': ['hive', 'vault', f'tag{i % 3}'],
+            'created': datetime.datetime(2022, 1, 1) + datetime.timedelta(seconds=i),
+            'group_id': ObjectId(),
+            'meta': {'is_published': i % 2 == 0, 'history': [{'version': v, 'comment': 'update'} for v in range(3)]}}
+
+
+@case('convert_oid', (10, 1000))
+def bench_convert_oid(size, temp_dir):
+    from src.modules.database.mongodb_client import MongodbCollection
+
+    col = MongodbCollection(None, is_management=False)
+    template = {'$or': [{'group_id': {'$oid': str(ObjectId())}, 'author': f'author{i}', 'meta': {'views': {'$gt': i}}}
+                        for i in range(size)]}
+    return lambda: (copy.deepcopy(template), ), col.convert_oid
+
+
+@case('fix_dollar_keys', (1, 50))
+def bench_fix_dollar_keys(size, temp_dir):
+    from src.modules.scripting.scripting import fix_dollar_keys_recursively
+
+    template = {'condition': {'type': 'queryHasResults', 'name': 'verify',
+                              'body': {'collection': 'groups', 'filter': {'$or': [{'owner': '$caller_did'}, {'public': True}]}}},
+                'executable': {'type': 'aggregated', 'name': 'executables',
+                               'body': [{'type': 'find', 'name': f'find{i}',
+                                         'body': {'collection': 'messages',
+                                                  'filter': {'author': '$params.author', 'count': {'$gt': '$params.count'}},
+                                                  'options': {'sort': {'created': -1}, 'limit': 10}}} for i in range(size)]}}
+    return lambda: (copy.deepcopy(template), ), fix_dollar_keys_recursively
+
+
+@case('populate_params', (10, 1000))
+def bench_populate_params(size, temp_dir):
+    from src.modules.scripting.executable import get_populated_value_with_params
+
+    template = {'$or': [{'author': '$params.author', 'owner': '$caller_did', 'app': '$caller_app_did',
+                         'meta': {'tags': ['$params.tag', 'hive'], 'views': {'$gt': '$params.views'}}} for _ in range(size)]}
+    params = {'author': 'author1', 'tag': 'vault', 'views': 10}
+    return lambda: (copy.deepcopy(template), 'did:elastos:user', 'did:elastos:app', params), get_populated_value_with_params
+
+
+@case('sha256', (64 * KB, 16 * MB))
+def bench_sha256(size, temp_dir):
+    from src.modules.files.local_file import LocalFile
+
+    file_path = os.path.join(temp_dir, f'sha256-{size}')
+    with open(file_path, 'wb') as f:
+        f.write(os.urandom(size))
+    return lambda: (file_path, ), LocalFile.get_sha256
+
+
+def get_chunks(data: bytes, size=64 * KB) -> t.List[bytes]:
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def consume(items):
+    for _ in items:
+        pass
+
+
+@case('encrypt_stream', (64 * KB, 16 * MB))
+def bench_encrypt_stream(size, temp_dir):
+    from src.modules.backup.encryption import Encryption
+
+    encryption, chunks = Encryption(), get_chunks(os.urandom(size))
+    return lambda: (chunks, ), lambda c: consume(encryption.encrypt_stream(c))
+
+
+@case('encrypt_legacy', (64 * KB, 16 * MB))
+def bench_encrypt_legacy(size, temp_dir):
+    # the single SecretBox message before the stream format, for the comparison of the peak memory.
+    from src.modules.backup.encryption import Encryption
+
+    encryption, data = Encryption(), os.urandom(size)
+    return lambda: (data, ), lambda d: encryption.box.encrypt(d, encryption.nonce)
+
+
+@case('decrypt_stream', (64 * KB, 16 * MB))
+def bench_decrypt_stream(size, temp_dir):
+    from src.modules.backup.encryption import Encryption
+
+    encryption = Encryption()
+    chunks = get_chunks(b''.join(encryption.encrypt_stream(get_chunks(os.urandom(size)))))
+    return lambda: (chunks, ), lambda c: consume(encryption.decrypt_stream(c))
+
+
+@case('rsync_checksums', (64 * KB, 1 * MB))
+def bench_rsync_checksums(size, temp_dir):
+    from hive.util.pyrsync import gene_blockchecksums
+
+    data = os.urandom(size)
+    return lambda: (io.BytesIO(data), ), lambda s: consume(gene_blockchecksums(s))
+
+
+@case('rsync_delta', (64 * KB, 1 * MB))
+def bench_rsync_delta(size, temp_dir):
+    from hive.util.pyrsync import blockchecksums, rsyncdelta
+
+    data = os.urandom(size)
+    hashes = blockchecksums(io.BytesIO(data))
+    # the new content with some changed bytes in the middle.
+    new_data = data[:size // 2] + os.urandom(100) + data[size // 2 + 100:]
+    return lambda: (io.BytesIO(new_data), ), lambda s: rsyncdelta(s, zip(*hashes))
+
+
+@case('bson_to_json', (10, 1000))
+def bench_bson_to_json(size, temp_dir):
+    from bson import json_util
+
+    docs = [make_document(i) for i in range(size)]
+    return lambda: (docs, ), lambda d: json.loads(json_util.dumps(d))
+
+
+@case('bson_json_items', (10, 1000))
+def bench_bson_json_items(size, temp_dir):
+    from src.utils.bson_json import iter_json_items
+
+    docs = [make_document(i) for i in range(size)]
+    return lambda: (docs, ), lambda d: consume(iter_json_items(d))
+
+
+def measure(setup, func, rounds, min_time) -> dict:
+    """ Measure the time (microseconds) and the allocated memory of one call. """
+    args = setup()
+    start = time.perf_counter()
+    func(*args)
+    number = max(1, int(min_time / max(time.perf_counter() - start, 1e-9)))
+
+    times = list()
+    is_gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(rounds):
+            calls = [setup() for _ in range(number)]
+            start = time.perf_counter()
+            for args in calls:
+                func(*args)
+            times.append((time.perf_counter() - start) / number)
+    finally:
+        if is_gc_enabled:
+            gc.enable()
+
+    args = setup()
+    tracemalloc.start()
+    try:
+        func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {'min_us': round(min(times) * 1e6, 2),
+            'median_us': round(statistics.median(times) * 1e6, 2),
+            'calls': number * rounds,
+            'peak_kb': round(peak / KB, 1)}
+
+
+def run(args) -> dict:
+    temp_dir = tempfile.mkdtemp(prefix='hive-micro-')
+    results = dict()
+    try:
+        print(f'{"case":>28} {"min(us)":>14} {"median(us)":>14} {"calls":>8} {"peak(KB)":>12}')
+        for name, (f, size) in CASES.items():
+            if args.filter and not re.search(args.filter, name):
+                continue
+            setup, func = f(size, temp_dir)
+            r = results[name] = measure(setup, func, args.rounds, args.min_time)
+            print(f'{name:>28} {r["min_us"]:>14} {r["median_us"]:>14} {r["calls"]:>8} {r["peak_kb"]:>12}')
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    return {'commit': get_commit(),
+            'time': int(time.time()),
+            'results': results}
+
+
+def check(base: dict, new: dict, threshold) -> t.List[str]:
+    """ Compare the result with the base one, return the regressions. """
+    regressions = list()
+    print(f'{base["commit"]} -> {new["commit"]}')
+    for name, r in new['results'].items():
+        b = base['results'].get(name)
+        if not b:
+            continue
+        time_delta = (r['min_us'] - b['min_us']) / b['min_us'] if b['min_us'] else 0
+        memory_delta = r['peak_kb'] - b['peak_kb']
+        print(f'{name:>28} {b["min_us"]:>12} -> {r["min_us"]:<12} {time_delta * 100:+7.1f}%'
+              f' {b["peak_kb"]:>10} -> {r["peak_kb"]:<10}KB')
+        if time_delta > threshold:
+            regressions.append(f'{name}: the time {b["min_us"]} -> {r["min_us"]} us')
+        if memory_delta * KB > MEMORY_SLACK and memory_delta > b['peak_kb'] * threshold:
+            regressions.append(f'{name}: the peak memory {b["peak_kb"]} -> {r["peak_kb"]} KB')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='The micro benchmarks of the hot spots of the hive node.')
+    parser.add_argument('--filter', default=None, help='the regex to select the cases by the name')
+    parser.add_argument('--rounds', type=int, default=5, help='the rounds of every case')
+    parser.add_argument('--min-time', type=float, default=0.2, help='the minimum seconds of every round')
+    parser.add_argument('--output', default=None, help='the file to write the result')
+    parser.add_argument('--baseline', default=None, help='the result file of the base to check the regressions')
+    parser.add_argument('--threshold', type=float, default=0.2, help='the allowed ratio of the slower or more memory')
+    parser.add_argument('--list', action='store_true', help='only list the cases')
+    args = parser.parse_args()
+
+    if args.list:
+        print('\n'.join(CASES.keys()))
+        return
+
+    result = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = check(json.load(f), result, args.threshold)
+        if regressions:
+            print('Regressions:\n  ' + '\n  '.join(regressions))
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
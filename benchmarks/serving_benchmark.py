@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+"""
+Measure how the throughput of the prefork serving (gunicorn.conf.py) scales with the worker processes.
+
+    python -m benchmarks.serving_benchmark --workers 1,2,4 --threads 8 --clients 4 --concurrency 16 --duration 10
+
+Every round starts gunicorn with the worker count on a local port and waits until the node is ready,
+then the client processes request the path for the duration, and the requests per second,
+the latency percentiles and the speedup to the first round are reported.
+
+The configure of the hive node (.env or HIVE_CONFIG) and the dependent services (MongoDB) must be ready.
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import requests
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def get_free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(port, workers, threads, env: dict = None):
+    """ Start the hive node by gunicorn, the env overrides the configure items of the hive node. """
+    args = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}',
+            '--workers', str(workers), '--threads', str(threads), 'wsgi:application']
+    return subprocess.Popen(args, cwd=BASE_DIR.as_posix(), env=dict(os.environ, **env) if env else None,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_ready(url, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(url, timeout=5).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f'The server is not ready in {timeout} seconds: {url}')
+
+
+def run_client(url, concurrency, duration):
+    """ Request the url by the threads of one client process, return the latencies (seconds) and the errors. """
+    latencies, errors, lock = list(), [0], threading.Lock()
+    deadline = time.time() + duration
+
+    def worker():
+        session = requests.Session()
+        while time.time() < deadline:
+            start = time.perf_counter()
+            try:
+                ok = session.get(url, timeout=30).status_code == 200
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, errors[0]
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def run_round(args, workers):
+    port = get_free_port()
+    url = f'http://127.0.0.1:{port}{args.path}'
+    server = start_server(port, workers, args.threads)
+    try:
+        wait_ready(url)
+        with ProcessPoolExecutor(max_workers=args.clients) as pool:
+            # warm up the workers.
+            list(pool.map(run_client, [url] * args.clients, [args.concurrency] * args.clients, [1] * args.clients))
+            results = list(pool.map(run_client, [url] * args.clients, [args.concurrency] * args.clients, [args.duration] * args.clients))
+    finally:
+        server.terminate()
+        server.wait(timeout=60)
+
+    latencies = [v for r in results for v in r[0]]
+    return {'workers': workers,
+            'rps': len(latencies) / args.duration,
+            'p50': percentile(latencies, 50) * 1000,
+            'p99': percentile(latencies, 99) * 1000,
+            'errors': sum([r[1] for r in results])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='The throughput scaling of the prefork serving.')
+    parser.add_argument('--workers', default=f'1,2,{os.cpu_count()}', help='the worker counts of the rounds, comma separated')
+    parser.add_argument('--threads', type=int, default=8, help='the threads of every worker')
+    parser.add_argument('--clients', type=int, default=4, help='the client processes')
+    parser.add_argument('--concurrency', type=int, default=16, help='the request threads of every client process')
+    parser.add_argument('--duration', type=int, default=10, help='the seconds of every round')
+    parser.add_argument('--path', default='/api/v2/node/version', help='the path to request')
+    args = parser.parse_args()
+
+    print(f'{"workers":>8} {"req/s":>10} {"p50(ms)":>10} {"p99(ms)":>10} {"errors":>8} {"speedup":>8}')
+    base = None
+    for workers in [int(w) for w in args.workers.split(',')]:
+        r = run_round(args, workers)
+        base = base if base else r['rps']
+        print(f'{r["workers"]:>8} {r["rps"]:>10.1f} {r["p50"]:>10.2f} {r["p99"]:>10.2f} {r["errors"]:>8} '
+              f'{r["rps"] / base if base else 0:>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
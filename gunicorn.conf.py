@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+"""
+The configuration of gunicorn to serve the hive node by multiple processes:
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+The app is not preloaded in the master process. The DID store of the service DID (eladid), the MongoClient
+and the schedulers are not fork-safe, so every worker creates the app and initializes them after forked.
+Only the worker holding the scheduler lock runs the schedulers and the boot tasks (src/utils/scheduler.py).
+"""
+import multiprocessing
+import os
+import random
+from pathlib import Path
+
+from decouple import config, Config, RepositoryEnv
+
+# the same configure file as the hive node, the app is not imported here to keep the master process clean.
+_config_file = Path(os.environ.get('HIVE_CONFIG', '/etc/hive/.env'))
+env_config = Config(RepositoryEnv(_config_file.as_posix())) if _config_file.exists() else config
+
+bind = env_config('HIVE_BIND', default='0.0.0.0:5000', cast=str)
+workers = env_config('HIVE_WORKERS', default=multiprocessing.cpu_count(), cast=int)
+threads = env_config('HIVE_THREADS', default=8, cast=int)
+worker_class = 'gthread'
+preload_app = False
+
+# the gthread worker keeps the heartbeat while the large files are transferring in the request threads.
+timeout = env_config('HIVE_WORKER_TIMEOUT', default=120, cast=int)
+graceful_timeout = 30
+keepalive = 5
+
+
+def post_fork(server, worker):
+    # the random state is copied from the master process.
+    random.seed()
+    server.log.info(f'Worker {worker.pid} forked, initialize the app in the worker.')
+
+
+def post_worker_init(worker):
+    from src.utils.scheduler import is_scheduler_leader
+    worker.log.info(f'Worker {worker.pid} is ready, scheduler leader: {is_scheduler_leader()}.')
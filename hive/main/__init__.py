@@ -7,7 +7,7 @@ from hive.util.constants import HIVE_MODE_TEST
 logging.getLogger().level = logging.INFO
 
 
-def init_app(app, mode):
+def init_app(app, mode, is_scheduler=True):
     logging.getLogger('v1_init').info('enter init_app')
 
     interceptor.init_app(app)
@@ -22,7 +22,7 @@ def init_app(app, mode):
     view_backup.init_app(app, mode)
     view_pubsub.init_app(app, mode)
 
-    if mode == HIVE_MODE_TEST:
+    if mode == HIVE_MODE_TEST or not is_scheduler:
         scheduler.scheduler_init(app, paused=True)
     else:
         scheduler.scheduler_init(app, paused=False)
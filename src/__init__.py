@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 import os
+import random
+import time
 
 import yaml
 import traceback
@@ -20,6 +22,10 @@ from src.utils.auth_token import TokenParser
 from src.utils.did.did_init import init_did_backend
 from src.utils.consts import HIVE_MODE_PROD, HIVE_MODE_TEST
 from src.utils.payment_config import PaymentConfig
+from src.utils.metrics import REQUEST_DURATION
+from src.utils.mongo_tracer import RequestTrace, register_tracer, start_trace, get_trace, finish_trace
+from src.utils.profiler import profiler, register_profiler_signal
+from src.utils.log_queue import init_log_queue, stop_log_queue, set_log_levels, reset_log_time, get_log_time
 from src import view
 
 import hive.settings
@@ -37,6 +43,13 @@ api = HiveApi(app, prefix='/api/v2')
 
 @app.before_request
 def before_request():
+    g.request_start = time.perf_counter()
+    g.log_sampled = random.random() < hive_setting.LOG_REQUEST_SAMPLE_RATE
+    reset_log_time()
+    if hive_setting.MONGO_TRACE_ENABLED:
+        start_trace()
+    g.is_profiled = profiler.begin(f'{request.method} {request.path}')
+
     # CORS request, skip
     if request.method == "OPTIONS":
         # return None to let CORS handle OPTIONS
@@ -57,8 +70,9 @@ def before_request():
     # Only do access token checking for v2 APIs.
     try:
         TokenParser().parse()
-        logging.getLogger('BEFORE REQUEST').info(f'enter {request.full_path}, {request.method}, '
-                                                 f'user_did={g.usr_did}, app_did={g.app_did}, app_ins_did={g.app_ins_did}')
+        if g.log_sampled:
+            logging.getLogger('BEFORE REQUEST').info(f'enter {request.full_path}, {request.method}, '
+                                                     f'user_did={g.usr_did}, app_did={g.app_did}, app_ins_did={g.app_ins_did}')
     except UnauthorizedException as e:
         return e.get_error_response()
     except HiveException as e:
@@ -72,10 +86,15 @@ def before_request():
 
 @app.after_request
 def after_request(response):
-    # log response details
-    data_str = str(response.json)
-    data_str = data_str[:500] if data_str else ''
-    logging.getLogger('AFTER REQUEST').info(f'leave {request.full_path}, {request.method}, status={response.status_code}, data={data_str}')
+    if response.is_streamed:
+        # the body (such as the documents from the cursor) is generated after here, so the request is finished
+        # when the response is closed, the header only contains the MongoDB commands before the body.
+        trace = get_trace()
+        if trace and hive_setting.MONGO_TRACE_HEADER:
+            response.headers['X-Hive-Mongo'] = trace.get_summary()
+        g.streamed_response = response
+    else:
+        finish_request(response)
 
     # update vault database usage
     if hasattr(g, 'usr_did') and g.usr_did:
@@ -84,11 +103,53 @@ def after_request(response):
     return response
 
 
+@app.teardown_request
+def teardown_request(exc):
+    # the request context of the body generated by stream_with_context is torn down when the response is closed.
+    response = getattr(g, 'streamed_response', None)
+    if response is not None:
+        finish_request(response)
+    if getattr(g, 'is_profiled', False):
+        profiler.end()
+
+
+def finish_request(response):
+    """ Observe the duration and the MongoDB commands of the request, then log it. """
+    start = getattr(g, 'request_start', None)
+    duration = time.perf_counter() - start if start else 0
+    endpoint = request.endpoint or 'unknown'
+    REQUEST_DURATION.observe(duration, endpoint, request.method, response.status_code)
+    trace = finish_trace(endpoint)
+    if trace and hive_setting.MONGO_TRACE_HEADER and not response.is_streamed:
+        response.headers['X-Hive-Mongo'] = trace.get_summary()
+    log_request(response, duration, trace)
+
+
+def log_request(response, duration: float, trace: RequestTrace = None):
+    """ Log the sampled, the slow and the failed requests without deserializing the response body. """
+    duration = round(duration * 1000, 1)
+    is_failed, is_slow = response.status_code >= 400, duration >= hive_setting.LOG_SLOW_REQUEST
+    if not (is_failed or is_slow or getattr(g, 'log_sampled', False)):
+        return
+
+    msg = f'leave {request.full_path}, method={request.method}, status={response.status_code}, duration_ms={duration}, ' \
+          f'size={response.content_length}, user_did={getattr(g, "usr_did", None)}, ' \
+          f'log_us={round(get_log_time() * 1000000)}'
+    if trace:
+        msg += f', mongo_count={trace.count}, mongo_ms={round(trace.duration / 1000, 1)}'
+    if is_failed and not response.is_streamed:
+        # the body is already serialized, only the error responses are useful to log.
+        msg += f', data={response.get_data()[:500]}'
+    logging.getLogger('AFTER REQUEST').log(logging.WARNING if is_failed or is_slow else logging.INFO, msg)
+
+
 def init_log(mode):
     print("init log")
 
+    stop_log_queue()
     with open(CONFIG_FILE) as f:
         logging.config.dictConfig(yaml.load(f, Loader=yaml.FullLoader))
+    init_log_queue()
 
     if os.environ.get('TRAVIS') == 'True' or (mode == HIVE_MODE_TEST and os.environ.get('TEST_DEBUG') != 'True'):
         # for run all v1 test cases, single test case still needs logs
@@ -112,10 +173,21 @@ def create_app(mode=HIVE_MODE_PROD, hive_config='/etc/hive/.env'):
 
     # init v2 configure items
     hive_setting.init_config(hive_config)
+    set_log_levels(hive_setting.LOG_LEVELS)
+    if hive_setting.MONGO_TRACE_ENABLED:
+        register_tracer()
+    if mode != HIVE_MODE_TEST:
+        hive_setting.register_reload_signal()
+        register_profiler_signal()
     PaymentConfig.init_config()
 
+    # only one process runs the schedulers and the boot tasks when serving by multiple workers.
+    from src.utils.scheduler import scheduler_init, acquire_scheduler_leadership
+    is_leader = mode != HIVE_MODE_TEST and acquire_scheduler_leadership()
+    logging.getLogger("src_init").info(f'The process {os.getpid()} is the scheduler leader: {is_leader}.')
+
     # init v1 APIs
-    hive.main.init_app(app, mode)
+    hive.main.init_app(app, mode, is_scheduler=is_leader)
 
     if mode != HIVE_MODE_TEST:
         # init v2 APIs
@@ -128,10 +200,10 @@ def create_app(mode=HIVE_MODE_PROD, hive_config='/etc/hive/.env'):
         if hive_setting.ENABLE_CORS:
             CORS(app, supports_credentials=True)
 
-        from src.utils.scheduler import scheduler_init
-        scheduler_init(app)
+        if is_leader:
+            scheduler_init(app)
 
-    init_executor(app, mode)
+    init_executor(app, mode, is_leader=is_leader)
 
     return app
 
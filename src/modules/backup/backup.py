@@ -73,9 +73,9 @@ class BackupManager:
         self.mcli.get_management_collection(COL_IPFS_BACKUP_SERVER).update_one(filter_, update, contains_extra=True, upsert=True)
         return self.get_backup(user_did)
 
-    def update_backup(self, user_did, update):
+    def update_backup(self, user_did, update, contains_extra=True):
         filter_ = {USR_DID: user_did}
-        self.mcli.get_management_collection(COL_IPFS_BACKUP_SERVER).update_one(filter_, {'$set': update}, contains_extra=True)
+        self.mcli.get_management_collection(COL_IPFS_BACKUP_SERVER).update_one(filter_, {'$set': update}, contains_extra=contains_extra)
 
     def upgrade(self, user_did, plan: dict, backup=None):
         if not backup:
@@ -5,27 +5,35 @@ The entrance for ipfs-backup module on the vault side.
 """
 import json
 import logging
+import time
 import typing as t
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from flask import g
 
+from src import hive_setting
+
+from src.modules.backup.checkpoint import Checkpoint
 from src.modules.backup.encryption import Encryption
 from src.modules.files.ipfs_client import IpfsClient
 from src.utils.consts import BACKUP_TARGET_TYPE, BACKUP_TARGET_TYPE_HIVE_NODE, BACKUP_REQUEST_ACTION, \
     BACKUP_REQUEST_ACTION_BACKUP, BACKUP_REQUEST_ACTION_RESTORE, BACKUP_REQUEST_STATE, BACKUP_REQUEST_STATE_PROCESS, \
     BACKUP_REQUEST_STATE_MSG, BACKUP_REQUEST_TARGET_HOST, BACKUP_REQUEST_TARGET_DID, BACKUP_REQUEST_TARGET_TOKEN, \
-    BACKUP_REQUEST_STATE_STOP, BACKUP_REQUEST_STATE_SUCCESS, \
+    BACKUP_REQUEST_STATE_STOP, BACKUP_REQUEST_STATE_SUCCESS, BACKUP_REQUEST_DATABASE_TIMINGS, BACKUP_REQUEST_LAST_BACKUP, \
+    BACKUP_REQUEST_CHECKPOINT, BACKUP_REQUEST_THROUGHPUT, \
     URL_SERVER_INTERNAL_BACKUP, URL_SERVER_INTERNAL_RESTORE, \
     COL_IPFS_BACKUP_CLIENT, USR_DID, URL_V2
-from src.utils.http_exception import BadRequestException, InsufficientStorageException
+from src.utils.http_exception import BadRequestException, InsufficientStorageException, BackupIsInProcessingException
 from src.modules.files.local_file import LocalFile
 from src.utils.http_client import HttpClient
+from src.utils.throttle import Throttle
 from src.modules.auth.auth import Auth
 from src.modules.auth.user import UserManager
 from src.modules.subscription.vault import VaultManager
 from src.modules.database.mongodb_client import MongodbClient
 from src.modules.backup.backup_server_client import BackupServerClient
 from src.modules.backup.backup_executor import BackupClientExecutor, RestoreExecutor
+from src.modules.backup.backup_scheduler import backup_scheduler, JOB_SIDE_CLIENT
 
 
 class BackupClient:
@@ -38,6 +46,7 @@ class BackupClient:
         self.user_manager = UserManager()
         self.vault_manager = VaultManager()
         self.ipfs_client = IpfsClient()
+        backup_scheduler.register(JOB_SIDE_CLIENT, self.__create_executor)
 
     def get_state(self):
         """ :v2 API: """
@@ -56,6 +65,10 @@ class BackupClient:
             'state': doc[BACKUP_REQUEST_ACTION],
             'result': doc[BACKUP_REQUEST_STATE],
             'message': doc[BACKUP_REQUEST_STATE_MSG],
+            'queue_position': backup_scheduler.get_position(JOB_SIDE_CLIENT, g.usr_did),
+            'throughput': doc.get(BACKUP_REQUEST_THROUGHPUT) or 0,
+            'resumed_bytes': (doc.get(BACKUP_REQUEST_CHECKPOINT) or {}).get('resumed_bytes', 0),
+            'transferred_bytes': (doc.get(BACKUP_REQUEST_CHECKPOINT) or {}).get('transferred_bytes', 0),
         }
 
     def backup(self, credential: str, is_force):
@@ -75,8 +88,9 @@ class BackupClient:
 
         credential_info = self.auth.get_backup_credential_info(g.usr_did, credential)
         client = self.__validate_remote_state(credential_info['targetHost'], credential, is_force, is_restore=False)
-        req = self.__save_request_doc(g.usr_did, credential_info, client.get_token(), is_restore=False)
-        BackupClientExecutor(g.usr_did, self, req, is_force=is_force).start()
+        self.__save_request_doc(g.usr_did, credential_info, client.get_token(), is_restore=False)
+        self.update_request_state(g.usr_did, BACKUP_REQUEST_STATE_PROCESS, '0')
+        backup_scheduler.submit(JOB_SIDE_CLIENT, g.usr_did, BACKUP_REQUEST_ACTION_BACKUP, is_force=is_force)
 
     def restore(self, credential, is_force):
         """
@@ -95,15 +109,20 @@ class BackupClient:
         credential_info = self.auth.get_backup_credential_info(g.usr_did, credential)
         client = self.__validate_remote_state(credential_info['targetHost'], credential, is_force, is_restore=True)
         self.__save_request_doc(g.usr_did, credential_info, client.get_token(), is_restore=True)
-        RestoreExecutor(g.usr_did, self).start()
+        self.update_request_state(g.usr_did, BACKUP_REQUEST_STATE_PROCESS, '0')
+        backup_scheduler.submit(JOB_SIDE_CLIENT, g.usr_did, BACKUP_REQUEST_ACTION_RESTORE)
 
     def __validate_remote_state(self, target_host, credential, is_force, is_restore):
         """ also do connectivity check """
+        # the running job keeps using the request, so it can not be reset even forced.
+        if backup_scheduler.is_running(JOB_SIDE_CLIENT, g.usr_did):
+            raise BackupIsInProcessingException('The backup or restore of the vault is running.')
+
         client = BackupServerClient(target_host, credential)
 
         # if is_force, skip check.
         if not is_force:
-            remote_action, remote_state, _, _ = client.get_state()
+            remote_action, remote_state, _, _, _, _, _ = client.get_state()
 
             if is_restore and (remote_action != BACKUP_REQUEST_ACTION_BACKUP and remote_state != BACKUP_REQUEST_STATE_SUCCESS):
                 raise BadRequestException('No latest successful backup data on the backup server.')
@@ -135,58 +154,227 @@ class BackupClient:
             BACKUP_REQUEST_STATE_MSG: None,
             BACKUP_REQUEST_TARGET_HOST: target_host,
             BACKUP_REQUEST_TARGET_DID: target_did,
-            BACKUP_REQUEST_TARGET_TOKEN: access_token}}
+            BACKUP_REQUEST_TARGET_TOKEN: access_token,
+            BACKUP_REQUEST_CHECKPOINT: None}}
 
         self.mcli.get_management_collection(COL_IPFS_BACKUP_CLIENT).update_one(filter_, update, upsert=True)
+        if is_restore:
+            # the restored databases are not the ones which the change markers belong to.
+            self.reset_last_backup(user_did)
         return self.__get_request_doc(user_did)
 
     # the following is for the executors.
 
-    def update_request_state(self, user_did, state, msg=None):
+    def update_request_state(self, user_did, state, msg=None, throughput=None):
         filter_ = {USR_DID: user_did,
                    BACKUP_TARGET_TYPE: BACKUP_TARGET_TYPE_HIVE_NODE}
 
         update = {'$set': {
             BACKUP_REQUEST_STATE: state,
-            BACKUP_REQUEST_STATE_MSG: msg}}
+            BACKUP_REQUEST_STATE_MSG: msg,
+            BACKUP_REQUEST_THROUGHPUT: throughput}}
 
         self.mcli.get_management_collection(COL_IPFS_BACKUP_CLIENT).update_one(filter_, update)
 
-    def dump_database_data_to_backup_cids(self, user_did, encryption: Encryption, process_callback=t.Optional[t.Callable[[int, int], None]]):
+    def __update_request_doc(self, user_did, update: dict):
+        filter_ = {USR_DID: user_did,
+                   BACKUP_TARGET_TYPE: BACKUP_TARGET_TYPE_HIVE_NODE}
+        self.mcli.get_management_collection(COL_IPFS_BACKUP_CLIENT).update_one(filter_, {'$set': update})
+
+    def get_checkpoint(self, user_did):
+        doc = self.__get_request_doc(user_did)
+        return doc.get(BACKUP_REQUEST_CHECKPOINT) if doc else None
+
+    def save_checkpoint(self, user_did, checkpoint: dict):
+        self.__update_request_doc(user_did, {BACKUP_REQUEST_CHECKPOINT: checkpoint})
+
+    def dump_database_data_to_backup_cids(self, user_did, encryption: Encryption,
+                                          process_callback: t.Optional[t.Callable[[int, int], None]] = None,
+                                          last_markers: t.Optional[dict] = None,
+                                          checkpoint: t.Optional[Checkpoint] = None,
+                                          throttle: t.Optional[Throttle] = None):
         """ Each application holds its databases under the same user did.
         The steps to dump each database data to each application is under the specific user did and application did:
 
         - dump the specific database to a snapshot file;
         - upload this snapshot file into IPFS node
+
+        The databases are handled by BACKUP_DUMP_WORKERS threads, so the dumping, encrypting and uploading of
+        the different databases overlap. The time of every step is recorded into the request document.
+
+        For the incremental backup, the last_markers is the change markers of the collections of the last backup,
+        then only the changed collections are dumped and the unchanged databases are skipped.
+
+        The dumped databases are recorded in the checkpoint and skipped when resuming.
+
+        :return: the metadata list of the dumped databases, the change markers of all databases
+                 (None for the database which does not support the change markers).
         """
         names = self.user_manager.get_database_names(user_did)
-        metadata_list, length = list(), len(names)
-        for i in range(length):
-            if process_callback:
-                process_callback(i + 1, length)
-
-            d = {
-                'path': LocalFile.generate_tmp_file_path(),
-                'name': names[i]
-            }
-            # dump the database data to snapshot file.
-            LocalFile.dump_mongodb_to_full_path(d['name'], d['path'])
+        metadata_list, markers, length = list(), dict(), len(names)
+        if not length:
+            return metadata_list, markers
+
+        todo_names = list()
+        for name in names:
+            if not checkpoint or not checkpoint.is_item_done(name):
+                todo_names.append(name)
+                continue
+            item = checkpoint.get_item(name)
+            if item['metadata']:
+                metadata_list.append(item['metadata'])
+            markers[name] = item['markers']
+            checkpoint.skip_item(item['metadata']['size'] if item['metadata'] else 0)
+
+        dumped = length - len(todo_names)
+        if todo_names:
+            with ThreadPoolExecutor(max_workers=min(hive_setting.BACKUP_DUMP_WORKERS, len(todo_names))) as pool:
+                futures = {pool.submit(self.__dump_database_to_backup_cid, name, encryption,
+                                       last_markers.get(name) if last_markers is not None else None, throttle): name for name in todo_names}
+                for future in as_completed(futures):
+                    d, markers[futures[future]] = future.result()
+                    if d:
+                        metadata_list.append(d)
+                    if checkpoint:
+                        checkpoint.finish_item(futures[future], {'metadata': d, 'markers': markers[futures[future]]},
+                                               size=d['size'] if d else 0)
+                        checkpoint.flush()
+                    dumped += 1
+                    if process_callback:
+                        process_callback(dumped, length)
+
+        timings = {d['name']: d.pop('timings', {}) for d in metadata_list}
+        self.__update_request_doc(user_did, {BACKUP_REQUEST_DATABASE_TIMINGS: timings})
+        return metadata_list, markers
+
+    def __dump_database_to_backup_cid(self, name, encryption: Encryption, last_markers: t.Optional[dict], throttle: t.Optional[Throttle] = None):
+        """ :return: the metadata of the dump file (None if unchanged), the change markers of the database. """
+
+        # get the markers before dumping, then the changes during dumping are dumped again by the next backup.
+        hashes = self.mcli.get_database_collection_hashes(name)
+
+        # full dump when no markers to compare, then the dump file replaces all previous ones of the database.
+        is_full, exclude_collections, dropped_collections = not last_markers or hashes is None, list(), list()
+        if not is_full:
+            exclude_collections = [c for c, h in hashes.items() if last_markers.get(c) == h]
+            dropped_collections = [c for c in last_markers.keys() if c not in hashes]
+            if len(exclude_collections) == len(hashes) and not dropped_collections:
+                logging.info(f'[BackupClient] The database {name} is unchanged, skip.')
+                return None, hashes
+
+        d = {
+            'name': name,
+            'compression': 'gzip' if hive_setting.BACKUP_DUMP_GZIP else None,
+            'is_full': is_full,
+            'dropped_collections': dropped_collections,
+            'timings': dict()
+        }
 
-            # encrypt the dump file.
-            try:
-                encrypt_path = encryption.encrypt_file(d['path'])
-            except Exception as e:
-                raise BadRequestException(f'Can not encrypt the dump file for the database {names[i]}: {e}')
-            d['path'].unlink()
+        # dump the database data to snapshot file.
+        start, path = time.time(), LocalFile.generate_tmp_file_path()
+        LocalFile.dump_mongodb_to_full_path(name, path, is_gzip=hive_setting.BACKUP_DUMP_GZIP,
+                                            exclude_collections=exclude_collections, throttle=throttle)
+        d['timings']['dump'] = round(time.time() - start, 3)
+
+        # encrypt the dump file.
+        start = time.time()
+        try:
+            encrypt_path = encryption.encrypt_file(path)
+        except Exception as e:
+            raise BadRequestException(f'Can not encrypt the dump file for the database {name}: {e}')
+        finally:
+            path.unlink()
+        d['timings']['encrypt'] = round(time.time() - start, 3)
 
-            # upload this snapshot file onto IPFS node.
-            d['cid'] = self.ipfs_client.upload_file(encrypt_path)
+        # upload this snapshot file onto IPFS node.
+        start = time.time()
+        try:
+            d['cid'] = self.ipfs_client.upload_file(encrypt_path, throttle=throttle)
             d['sha256'] = LocalFile.get_sha256(encrypt_path.as_posix())
             d['size'] = encrypt_path.stat().st_size
+        finally:
             encrypt_path.unlink()
+        d['timings']['upload'] = round(time.time() - start, 3)
+
+        logging.info(f'[BackupClient] Success to dump the database {name}'
+                     f'{" (" + str(len(exclude_collections)) + " unchanged collections excluded)" if exclude_collections else ""}: {d["timings"]}.')
+        return d, hashes
 
-            metadata_list.append(d)
-        return metadata_list
+    @staticmethod
+    def get_last_backup(req, is_backup_chain) -> t.Optional[dict]:
+        """ Get the last successful backup which the incremental backup is based on.
+
+        None means a full backup is required: the incremental backup is disabled, no last backup,
+        the backup node is changed, or BACKUP_FULL_INTERVAL incremental backups have been done.
+        The CAR archives contain all databases and files, so they are not combined with the backup chain.
+
+        :param is_backup_chain: Whether the backup node keeps the backup chain, the old one takes
+                                the incremental backup as the whole backup.
+        """
+        last_backup = req.get(BACKUP_REQUEST_LAST_BACKUP)
+        if hive_setting.BACKUP_FULL_INTERVAL <= 0 or hive_setting.BACKUP_CAR_ENABLED or not is_backup_chain or not last_backup:
+            return None
+        if last_backup['target_did'] != req[BACKUP_REQUEST_TARGET_DID]:
+            return None
+        if last_backup['increment_index'] >= hive_setting.BACKUP_FULL_INTERVAL:
+            return None
+        return last_backup
+
+    def reset_last_backup(self, user_did):
+        """ Force the next backup to be a full one. """
+        filter_ = {USR_DID: user_did,
+                   BACKUP_TARGET_TYPE: BACKUP_TARGET_TYPE_HIVE_NODE}
+        self.mcli.get_management_collection(COL_IPFS_BACKUP_CLIENT).update_one(filter_, {'$unset': {BACKUP_REQUEST_LAST_BACKUP: ''}})
+
+    def save_last_backup(self, user_did, req, cid, sha256, size, request_metadata):
+        """ Keep the last successful backup for the next incremental backup. """
+        databases_size = sum([d['size'] for d in request_metadata['databases']])
+        if request_metadata['previous']:
+            databases_size += req[BACKUP_REQUEST_LAST_BACKUP]['databases_size']
+
+        self.__update_request_doc(user_did, {BACKUP_REQUEST_LAST_BACKUP: {
+            'target_did': req[BACKUP_REQUEST_TARGET_DID],
+            'cid': cid,
+            'sha256': sha256,
+            'size': size,
+            'increment_index': request_metadata['increment_index'],
+            'database_markers': request_metadata['database_markers'],
+            'databases_size': databases_size
+        }})
+
+    def export_cids_to_cars(self, database_cids: list, files: t.Iterable[dict], cars: list,
+                            throttle: t.Optional[Throttle] = None) -> t.Iterator[dict]:
+        """ Export the content of all database and file CIDs as CAR archives on the local IPFS node.
+
+        The CIDs are grouped by BACKUP_CAR_MAX_SIZE and every group is linked into one directory
+        which DAG is exported as one CAR archive. The backup node can import these archives in bulk.
+
+        The file entries are yielded back after they are grouped, then they are also written into the
+        manifest shards in the same pass. The archives are appended to the cars when every group is full,
+        and the last one after all file entries are consumed.
+        """
+        group = {'cids': list(), 'size': 0}
+
+        def export():
+            root = self.ipfs_client.make_directory(list(dict.fromkeys(group['cids'])))
+            cid, size = self.ipfs_client.car_export(root, throttle=throttle)
+            cars.append({'cid': cid, 'root': root, 'size': size})
+            logging.info(f'[BackupClient] Success to export {len(group["cids"])} CIDs to the CAR archive {cid}.')
+
+        def add(d):
+            if group['cids'] and group['size'] + d['size'] > hive_setting.BACKUP_CAR_MAX_SIZE:
+                export()
+                group['cids'], group['size'] = list(), 0
+            group['cids'].append(d['cid'])
+            group['size'] += d['size']
+
+        for d in database_cids:
+            add(d)
+        for f in files:
+            add(f)
+            yield f
+        if group['cids']:
+            export()
 
     def send_root_backup_cid_to_backup_node(self, user_did, cid, sha256, size, is_force):
         """
@@ -212,7 +400,7 @@ class BackupClient:
         """
         req = self.__get_request_doc(user_did)
         data = self.http.get(req[BACKUP_REQUEST_TARGET_HOST] + URL_V2 + URL_SERVER_INTERNAL_RESTORE
-                             + f'?public_key={Encryption.get_service_did_public_key(False)}',
+                             + f'?public_key={Encryption.get_service_did_public_key(False)}&is_curve25519_chunked=true',
                              req[BACKUP_REQUEST_TARGET_TOKEN])
 
         tmp_file = LocalFile.generate_tmp_file_path()
@@ -230,25 +418,57 @@ class BackupClient:
             raise InsufficientStorageException('No enough space to restore, please upgrade the vault and try again.')
         return request_metadata
 
-    def restore_database_by_dump_files(self, request_metadata):
-        databases, secret_key, nonce = request_metadata['databases'], request_metadata['encryption']['secret_key'], request_metadata['encryption']['nonce']
+    def restore_database_by_dump_files(self, request_metadata, checkpoint: t.Optional[Checkpoint] = None,
+                                       throttle: t.Optional[Throttle] = None):
+        """ Restore the dump files of the databases, BACKUP_RESTORE_WORKERS databases at the same time.
+
+        Every dump file is streamed from the IPFS gateway through the decryption to a temporary file,
+        and mongorestore (with --drop) runs only after the size and sha256 are verified.
+        For the incremental backup chain, one database may have several dump files which MUST be restored by order,
+        and every dump file has its own encryption key.
+        The restored dump files are recorded in the checkpoint and skipped when resuming.
+        """
+        databases = request_metadata['databases']
         if not databases:
             logging.info('[BackupClient] No user databases dump files, skip.')
             return
 
+        groups = dict()
         for d in databases:
-            temp_file = LocalFile.generate_tmp_file_path()
-            msg = self.ipfs_client.download_file(d['cid'], temp_file, is_proxy=True, sha256=d['sha256'], size=d['size'])
-            if msg:
-                logging.error(f'[BackupClient] Failed to download dump file for database {d["name"]}.')
-                temp_file.unlink()
-                raise BadRequestException(msg)
-
-            plain_path = Encryption(secret_key, nonce).decrypt_file(temp_file)
-            temp_file.unlink()
-
-            LocalFile.restore_mongodb_from_full_path(plain_path)
-            plain_path.unlink()
+            groups.setdefault(d['name'], list()).append(d)
+
+        with ThreadPoolExecutor(max_workers=min(hive_setting.BACKUP_RESTORE_WORKERS, len(groups))) as pool:
+            futures = [pool.submit(self.__restore_database_by_dump_files, dumps, request_metadata['encryption'], checkpoint, throttle)
+                       for dumps in groups.values()]
+            for future in as_completed(futures):
+                future.result()
+
+    def __restore_database_by_dump_files(self, dumps: list, encryption: dict, checkpoint: t.Optional[Checkpoint], throttle: t.Optional[Throttle]):
+        for d in dumps:
+            if checkpoint and checkpoint.is_item_done(d['cid']):
+                checkpoint.skip_item(d['size'])
+                continue
+
+            key, temp_file = d.get('encryption', encryption), LocalFile.generate_tmp_file_path()
+            try:
+                # the corrupted dump file raises at the end of the stream, so it is spooled before dropping the collections.
+                chunks = self.ipfs_client.download_stream(d['cid'], is_proxy=True, sha256=d['sha256'], size=d['size'], throttle=throttle)
+                with temp_file.open('wb') as f:
+                    for chunk in Encryption(key['secret_key'], key['nonce']).decrypt_stream(chunks):
+                        f.write(chunk)
+                LocalFile.restore_mongodb_from_full_path(temp_file, is_gzip=d.get('compression') == 'gzip', throttle=throttle)
+            except BadRequestException as e:
+                logging.error(f'[BackupClient] Failed to restore the dump file for database {d["name"]}: {e.msg}')
+                raise e
+            finally:
+                if temp_file.exists():
+                    temp_file.unlink()
+
+            for col_name in d.get('dropped_collections', []):
+                self.mcli.drop_database_collection(d['name'], col_name)
+            if checkpoint:
+                checkpoint.finish_item(d['cid'], size=d['size'])
+                checkpoint.flush()
             logging.info(f'[BackupClient] Success to restore the dump file for database {d["name"]}.')
 
     def retry_backup_request(self):
@@ -264,11 +484,17 @@ class BackupClient:
             # only handle the state BACKUP_REQUEST_STATE_INPROGRESS
 
             user_did = req[USR_DID]
-            logging.info(f"[BackupClient] Found unfinished request({user_did}), retry.")
+            logging.info(f"[BackupClient] Found unfinished request({user_did}), resume from the checkpoint.")
 
-            if req.get(BACKUP_REQUEST_ACTION) == BACKUP_REQUEST_ACTION_BACKUP:
-                BackupClientExecutor(user_did, self, req, start_delay=30).start()
-            elif req.get(BACKUP_REQUEST_ACTION) == BACKUP_REQUEST_ACTION_RESTORE:
-                RestoreExecutor(user_did, self, start_delay=30).start()
+            if req.get(BACKUP_REQUEST_ACTION) in [BACKUP_REQUEST_ACTION_BACKUP, BACKUP_REQUEST_ACTION_RESTORE]:
+                try:
+                    backup_scheduler.submit(JOB_SIDE_CLIENT, user_did, req.get(BACKUP_REQUEST_ACTION))
+                except BackupIsInProcessingException as e:
+                    logging.info(f'[BackupClient] {e.msg} Skip.')
             else:
                 logging.error(f'[BackupClient] Unknown action({req.get(BACKUP_REQUEST_ACTION)}), skip.')
+
+    def __create_executor(self, user_did, action, is_force):
+        if action == BACKUP_REQUEST_ACTION_BACKUP:
+            return BackupClientExecutor(user_did, self, self.__get_request_doc(user_did), is_force=is_force)
+        return RestoreExecutor(user_did, self)
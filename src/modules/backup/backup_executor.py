@@ -5,10 +5,16 @@ import logging
 import threading
 import time
 import traceback
+import typing as t
 from datetime import datetime
 
+from src import hive_setting
 from src.modules.backup.backup_server_client import BackupServerClient
+from src.modules.backup.checkpoint import Checkpoint
+from src.modules.backup.cid_pipeline import CidPipeline
 from src.modules.backup.encryption import Encryption
+from src.modules.backup.manifest import ManifestShardWriter, MANIFEST_VERSION, MANIFEST_VERSION_SHARDED, get_files_count, \
+    get_files_size, iterate_file_batches
 from src.modules.files.file_metadata import FileMetadataManager
 from src.modules.files.ipfs_cid_ref import IpfsCidRef
 from src.modules.files.ipfs_client import IpfsClient
@@ -17,9 +23,12 @@ from src.modules.subscription.vault import VaultManager
 from src.utils.consts import BACKUP_REQUEST_STATE_SUCCESS, BACKUP_REQUEST_STATE_FAILED, USR_DID, BACKUP_REQUEST_STATE_PROCESS, BACKUP_REQUEST_TARGET_HOST, \
     BACKUP_REQUEST_TARGET_TOKEN
 from src.utils.http_exception import HiveException, BadRequestException
+from src.utils.throttle import Throttle
 
 
 class ExecutorBase(threading.Thread):
+    THROUGHPUT_INTERVAL = 5  # seconds
+
     def __init__(self, user_did, owner, action, start_delay=0, is_force=False):
         super().__init__()
         self.user_did = user_did
@@ -28,13 +37,23 @@ class ExecutorBase(threading.Thread):
         self.start_delay = start_delay
         self.is_force = is_force
         self.vault_manager = VaultManager()
+        self.checkpoint: t.Optional[Checkpoint] = None
+        self.throttle = Throttle()
+        # called when the executor finished, set by the backup scheduler.
+        self.on_finished: t.Optional[t.Callable[[], None]] = None
 
     def run(self):
         try:
             if self.start_delay > 0:
                 time.sleep(self.start_delay)
             logging.info(f'[ExecutorBase] Enter execute the executor for {self.action}.')
+            self.checkpoint = Checkpoint(self.user_did, self.action, lambda data: self.owner.save_checkpoint(self.user_did, data),
+                                         self.owner.get_checkpoint(self.user_did))
+            if self.checkpoint.is_resumed():
+                logging.info(f'[ExecutorBase] Resume the executor for {self.action} from the checkpoint: {list(self.checkpoint.data["stages"].keys())}.')
             self.execute()
+            self.checkpoint.log_bytes(self.action)
+            self.checkpoint.clear()
             self.owner.update_request_state(self.user_did, BACKUP_REQUEST_STATE_SUCCESS, '')
             logging.info(f'[ExecutorBase] Leave execute the executor for {self.action} without error.')
         except HiveException as e:
@@ -45,35 +64,70 @@ class ExecutorBase(threading.Thread):
             msg = f'[ExecutorBase] Unexpected failed to {self.action}: {traceback.format_exc()}'
             logging.error(msg)
             self.owner.update_request_state(self.user_did, BACKUP_REQUEST_STATE_FAILED, msg)
+        finally:
+            if self.on_finished:
+                self.on_finished()
 
     def execute(self):
         # INFO: override this.
         pass
 
-    def generate_root_backup_cid(self, database_cids, files_cids, total_file_size, encryption: Encryption):
+    def generate_root_backup_cid(self, database_cids, files: t.Iterable[dict], encryption: Encryption, cars=None,
+                                 database_markers=None, last_backup=None, throttle: t.Optional[Throttle] = None):
         """ Create a json doc containing basic root informations:
 
         - database data DIDs;
         - files data DIDs;
+        - CAR archives which contain all database and files data (optional);
         - total amount of vault data;
         - total amount of backup data to sync.
         - create timestamp.
+
+        For the incremental backup, the databases only contain the changed ones and the previous
+        points to the root of the last backup, the backup node can materialize the whole chain.
+
+        The files are written into the encrypted shards one by one if the backup node supports, see manifest.py.
+        Only the backup node which does not support the shards takes all files in the json doc.
+
+        :param files: The file entries of FileMetadataManager.iterate_backup_file_metadatas().
         """
+        _, _, _, public_key, is_sharded_manifest, is_curve25519_chunked, _ = BackupServerClient.get_state_by_user_did(self.user_did)
+
+        writer = ManifestShardWriter(encryption, throttle=throttle) \
+            if is_sharded_manifest and hive_setting.BACKUP_MANIFEST_SHARD_SIZE > 0 else None
+        file_entries, total_file_size = list(), 0
+        for f in files:
+            entry = {'sha256': f['sha256'], 'cid': f['cid'], 'size': f['size'], 'count': f['count']}
+            if writer:
+                writer.add(entry)
+            else:
+                file_entries.append(entry)
+            total_file_size += f['total_size']
+        shards = {'file_shards': writer.close(), 'files_count': writer.files_count, 'files_size': writer.files_size} if writer else None
 
         secret_key, nonce = encryption.get_private_key()
+        databases_size = sum([d['size'] for d in database_cids]) + (last_backup['databases_size'] if last_backup else 0)
         data = {
-            'version': '1.0',
+            'version': MANIFEST_VERSION_SHARDED if shards else MANIFEST_VERSION,
+            'type': 'incremental' if last_backup else 'full',
+            'previous': {'cid': last_backup['cid'],
+                         'sha256': last_backup['sha256'],
+                         'size': last_backup['size']} if last_backup else None,
+            'increment_index': last_backup['increment_index'] + 1 if last_backup else 0,
+            'database_markers': database_markers if database_markers else {},
             'databases': [{'name': d['name'],
                            'sha256': d['sha256'],
                            'cid': d['cid'],
-                           'size': d['size']} for d in database_cids],
-            'files': [{'sha256': d['sha256'],
-                       'cid': d['cid'],
-                       'size': d['size'],
-                       'count': d['count']} for d in files_cids],
+                           'size': d['size'],
+                           'compression': d.get('compression'),
+                           'is_full': d.get('is_full', True),
+                           'dropped_collections': d.get('dropped_collections', [])} for d in database_cids],
+            'files': file_entries,
+            **(shards if shards else {}),
+            'cars': cars if cars else [],
             USR_DID: self.user_did,
             "vault_size": self.vault_manager.get_vault(self.user_did).get_storage_usage(),
-            "backup_size": sum([d['size'] for d in database_cids]) + total_file_size,
+            "backup_size": databases_size + total_file_size,
             "create_time": datetime.now().timestamp(),
             "encryption": {
                 "secret_key": secret_key,
@@ -85,8 +139,9 @@ class ExecutorBase(threading.Thread):
         with temp_file.open('w') as f:
             json.dump(data, f)
 
-        _, _, _, public_key = BackupServerClient.get_state_by_user_did(self.user_did)
-        encryption_path = Encryption.encrypt_file_with_curve25519(temp_file, public_key, False)
+        # the backup node which is not upgraded only decrypts the legacy format.
+        encryption_path = Encryption.encrypt_file_with_curve25519(temp_file, public_key, False,
+                                                                  chunk_size=None if is_curve25519_chunked else Encryption.TRUNK_SIZE)
         temp_file.unlink()
 
         sha256, size = LocalFile.get_sha256(encryption_path.as_posix()), encryption_path.stat().st_size
@@ -97,7 +152,7 @@ class ExecutorBase(threading.Thread):
     @staticmethod
     def get_vault_usage_by_metadata(request_metadata):
         total_size = request_metadata['vault_size']
-        files_size = sum([f['size'] for f in request_metadata['files']])
+        files_size = get_files_size(request_metadata)
         return files_size, total_size - files_size
 
     @staticmethod
@@ -113,7 +168,10 @@ class ExecutorBase(threading.Thread):
                                   contain_databases=True,
                                   contain_files=True,
                                   is_unpin=False,
-                                  only_files_ref=False):
+                                  only_files_ref=False,
+                                  process_callback: t.Optional[t.Callable[[int, int], None]] = None,
+                                  checkpoint: t.Optional[Checkpoint] = None,
+                                  throttle: t.Optional[Throttle] = None):
         """ Handle the CIDs of the backup metadata which defined in ipfs_backup_client.py
 
         default is pin&unpin all databases and files.
@@ -124,16 +182,16 @@ class ExecutorBase(threading.Thread):
         :param contain_files: Whether it needs pin/unpin files to IPFS node, only for files of request_metadata
         :param is_unpin: Pin or unpin the file on the IPFS node.
         :param only_files_ref: Only increase & decrease the cid ref count of the files.
+        :param process_callback: Report the progress with (finished count, total count).
+        :param checkpoint: Record the handled CIDs and skip them when resuming.
+        :param throttle: Limit the rate of the pinning traffic.
         """
 
-        client = IpfsClient()
-
-        def execute_pin_unpin(cid):
-            client.cid_pin(cid) if not is_unpin else client.cid_unpin(cid)
+        pipeline = CidPipeline(is_unpin=is_unpin, throttle=throttle)
 
         # pin or unpin the cid of request_metadata
         if root_cid:
-            execute_pin_unpin(root_cid)
+            pipeline.run([root_cid])
             logging.info('[ExecutorBase] Success to pin root cid.')
 
         # can not handle without request_metadata
@@ -141,25 +199,93 @@ class ExecutorBase(threading.Thread):
             logging.info('[ExecutorBase] Invalid request metadata, skip pin CIDs.')
             return
 
-        # pin or unpin database packages
-        if contain_databases and request_metadata.get('databases'):
-            for d in request_metadata.get('databases'):
-                execute_pin_unpin(d['cid'])
-            logging.info(f'[ExecutorBase] Success to {"pin" if not is_unpin else "unpin"} all databases CIDs.')
-
-        # pin or unpin files
-        if contain_files and request_metadata.get('files'):
-            for f in request_metadata.get('files'):
-                if not only_files_ref:
-                    execute_pin_unpin(f['cid'])
-
-                cid_ref = IpfsCidRef(f['cid'])
-                if not is_unpin:
-                    cid_ref.decrease(f['count'])
-                else:
-                    cid_ref.increase(f['count'])
+        # the CAR archives contain all databases and files, import them in bulk instead of every CID.
+        def is_done(cid, size):
+            if checkpoint and checkpoint.is_item_done(cid):
+                checkpoint.skip_item(size)
+                return True
+            return False
+
+        def finish(cid, size):
+            if checkpoint:
+                checkpoint.finish_item(cid, size=size)
+
+        # The roots of the archives of every layer of the backup chain are unpinned even without the files.
+        cars, is_car_imported = request_metadata.get('cars'), False
+        if cars and contain_databases and (contain_files or is_unpin) and not only_files_ref:
+            client = IpfsClient()
+            for i, car in enumerate(cars):
+                if not is_done(car['cid'], car['size']):
+                    client.car_import(car['cid'], throttle=throttle) if not is_unpin else client.cid_unpin(car['root'])
+                    finish(car['cid'], car['size'])
+                if process_callback:
+                    process_callback(i + 1, len(cars))
+            logging.info(f'[ExecutorBase] Success to {"import" if not is_unpin else "unpin"} all CAR archives.')
+
+            # the vault node pins the databases by themselves, so they are still unpinned.
+            only_files_ref, is_car_imported = True, not is_unpin
+
+        # the shards of the file entries belong to the backup metadata, so they are handled with the databases.
+        databases = list()
+        if contain_databases:
+            # the databases are only indirectly pinned by the roots of the CAR archives, so skip them
+            # instead of transferring them again. The shards are generated after the archives are exported.
+            if not is_car_imported:
+                databases.extend(request_metadata.get('databases', []))
+            databases.extend(request_metadata.get('file_shards', []))
+        progress = {'finished': 0, 'total': len(databases) + (get_files_count(request_metadata) if contain_files else 0)}
+
+        def handle_batch(items: list, is_files: bool):
+            """ Pin or unpin the CIDs of the batch, the reference counts of the files are also updated. """
+            files_count = {f['cid']: f['count'] for f in items} if is_files else dict()
+            sizes = {d['cid']: d['size'] for d in items}
+            base = progress['finished']
+
+            def update_cid_ref(cid):
+                if cid in files_count:
+                    cid_ref = IpfsCidRef(cid)
+                    if not is_unpin:
+                        cid_ref.decrease(files_count[cid])
+                    else:
+                        cid_ref.increase(files_count[cid])
+                finish(cid, 0 if only_files_ref else sizes.get(cid, 0))
+
+            def batch_callback(finished, _):
+                process_callback(base + finished, progress['total'])
+
+            cids = list() if is_files and only_files_ref else list(sizes.keys())
+            cids = [cid for cid in cids if not is_done(cid, sizes.get(cid, 0))]
+            pipeline.run(cids, on_finished=update_cid_ref, process_callback=batch_callback if process_callback else None)
+
+            if is_files and only_files_ref:
+                for cid in files_count.keys():
+                    if not is_done(cid, 0):
+                        update_cid_ref(cid)
+
+            progress['finished'] = base + len(items)
+
+        # pin or unpin database packages, then the files batch by batch to keep the memory bounded.
+        handle_batch(databases, False)
+        if contain_files:
+            for files in iterate_file_batches(request_metadata, throttle=throttle):
+                handle_batch(files, True)
+
+        logging.info(f'[ExecutorBase] Success to {"pin" if not is_unpin else "unpin"} all databases and files CIDs.')
+
+    def get_process_callback(self, start: int, end: int) -> t.Callable[[int, int], None]:
+        """ Map the progress of one step to the range [start, end] of the request state.
+
+        The current throughput is also reported when the percentage changes or every THROUGHPUT_INTERVAL seconds.
+        """
+        last = {'percent': None, 'time': 0}
 
-            logging.info('[ExecutorBase] Success to pin all files CIDs.')
+        def callback(index, total):
+            percent = str(int(start + (end - start) * index / total)) if total else str(end)
+            if percent != last['percent'] or time.time() - last['time'] >= ExecutorBase.THROUGHPUT_INTERVAL:
+                last['percent'], last['time'] = percent, time.time()
+                self.owner.update_request_state(self.user_did, BACKUP_REQUEST_STATE_PROCESS, percent,
+                                                throughput=self.throttle.get_throughput())
+        return callback
 
 
 class BackupClientExecutor(ExecutorBase):
@@ -169,35 +295,64 @@ class BackupClientExecutor(ExecutorBase):
         self.file_manager = FileMetadataManager()
 
     def execute(self):
-        def callback_dump_databases(index, total):
-            percent = str(int(15 * (index - 1) / total))
-            self.owner.update_request_state(self.user_did, BACKUP_REQUEST_STATE_PROCESS, percent)
-
-        encryption = Encryption()
+        """ Every stage is recorded in the checkpoint, the executor resumes from the last stage after rebooted. """
+        if not self.checkpoint.is_stage_done('encryption'):
+            secret_key, nonce = Encryption().get_private_key()
+            self.checkpoint.finish_stage('encryption', {'secret_key': secret_key, 'nonce': nonce})
+        key = self.checkpoint.get_stage('encryption')
+        encryption = Encryption(key['secret_key'], key['nonce'])
 
         self.owner.update_request_state(self.user_did, BACKUP_REQUEST_STATE_PROCESS, '0')  # 100-based
 
-        database_cids = self.owner.dump_database_data_to_backup_cids(self.user_did, encryption, callback_dump_databases)
+        # the decision is kept, then the resumed backup does not mix the incremental and the full dump files.
+        if not self.checkpoint.is_stage_done('last_backup'):
+            is_backup_chain = BackupServerClient.get_state_by_user_did(self.user_did)[6]
+            self.checkpoint.finish_stage('last_backup', self.owner.get_last_backup(self.req, is_backup_chain))
+        last_backup = self.checkpoint.get_stage('last_backup')
+        if not self.checkpoint.is_stage_done('databases'):
+            database_cids, database_markers = self.owner.dump_database_data_to_backup_cids(
+                self.user_did, encryption, self.get_process_callback(0, 15),
+                last_markers=last_backup['database_markers'] if last_backup else None, checkpoint=self.checkpoint, throttle=self.throttle)
+            self.checkpoint.finish_stage('databases', {'database_cids': database_cids, 'database_markers': database_markers})
+        databases = self.checkpoint.get_stage('databases')
+        database_cids, database_markers = databases['database_cids'], databases['database_markers']
         self.owner.update_request_state(self.user_did, BACKUP_REQUEST_STATE_PROCESS, '15')  # 100-based
         logging.info('[BackupExecutor] Dumped the database data to IPFS node and returned with array of CIDs')
 
-        filedata_size, file_cids = self.file_manager.get_backup_file_metadatas(self.user_did)
-        self.owner.update_request_state(self.user_did, BACKUP_REQUEST_STATE_PROCESS, '25')  # 100-based
-        logging.info('[BackupExecutor] Got an array of CIDs to file data')
-
-        cid, sha256, size, request_metadata = self.generate_root_backup_cid(database_cids, file_cids, filedata_size, encryption)
+        if not self.checkpoint.is_stage_done('root'):
+            # the file entries are streamed from the database to the CAR archives and the shards in one pass.
+            files, cars = self.file_manager.iterate_backup_file_metadatas(self.user_did), None
+            if hive_setting.BACKUP_CAR_ENABLED:
+                cars = list()
+                files = self.owner.export_cids_to_cars(database_cids, files, cars, throttle=self.throttle)
+
+            cid, sha256, size, request_metadata = self.generate_root_backup_cid(database_cids, files, encryption, cars=cars,
+                                                                                database_markers=database_markers, last_backup=last_backup,
+                                                                                throttle=self.throttle)
+            self.owner.update_request_state(self.user_did, BACKUP_REQUEST_STATE_PROCESS, '25')  # 100-based
+            if cars is not None:
+                logging.info('[BackupExecutor] Exported the database and file data to CAR archives')
+            logging.info(f'[BackupExecutor] Generated the root backup CID to vault data, request_metadata, {request_metadata}, cid, {cid}')
+
+            # the files are not required after the root backup CID generated, skip them to keep the checkpoint small.
+            self.checkpoint.finish_stage('root', {'cid': cid, 'sha256': sha256, 'size': size, 'cars': cars,
+                                                  'request_metadata': {k: v for k, v in request_metadata.items() if k != 'files'}})
+        root = self.checkpoint.get_stage('root')
+        cid, sha256, size, cars, request_metadata = root['cid'], root['sha256'], root['size'], root['cars'], root['request_metadata']
         self.owner.update_request_state(self.user_did, BACKUP_REQUEST_STATE_PROCESS, '35')  # 100-based
-        logging.info(f'[BackupExecutor] Generated the root backup CID to vault data, request_metadata, {request_metadata}, cid, {cid}')
 
-        self.owner.send_root_backup_cid_to_backup_node(self.user_did, cid, sha256, size, self.is_force)
+        if not self.checkpoint.is_stage_done('send'):
+            self.owner.send_root_backup_cid_to_backup_node(self.user_did, cid, sha256, size, self.is_force)
+            self.checkpoint.finish_stage('send')
         self.owner.update_request_state(self.user_did, BACKUP_REQUEST_STATE_PROCESS, '50')  # 100-based
         logging.info('[BackupExecutor] Send the root backup CID to the backup node.')
 
-        # wait until the server ends
+        # wait until the server ends, the long poll returns when the state changes.
         try:
             client = BackupServerClient(self.req[BACKUP_REQUEST_TARGET_HOST], token=self.req[BACKUP_REQUEST_TARGET_TOKEN])
+            remote_state, remote_msg = None, None
             while True:
-                remote_action, remote_state, remote_msg, _ = client.get_state()
+                remote_action, remote_state, remote_msg, is_long_poll = client.wait_state(remote_state, remote_msg, hive_setting.BACKUP_STATE_WAIT_MAX)
 
                 if remote_state == BACKUP_REQUEST_STATE_PROCESS:
                     self.owner.update_request_state(self.user_did, BACKUP_REQUEST_STATE_PROCESS, remote_msg)  # 100-based
@@ -206,13 +361,21 @@ class BackupClientExecutor(ExecutorBase):
                 else:
                     raise BadRequestException(f'server error: {remote_msg}')
 
-                time.sleep(2)
+                if not is_long_poll:
+                    # the old backup node returns the state directly.
+                    time.sleep(2)
+
+            self.owner.save_last_backup(self.user_did, self.req, cid, sha256, size, request_metadata)
         except Exception as e:
+            # the backup node may not keep the backup chain, so start with a full backup next time.
+            self.owner.reset_last_backup(self.user_did)
             raise e
         finally:
             if 'http://localhost' not in self.req[BACKUP_REQUEST_TARGET_HOST]:  # for local dev
                 # clean client side cids
                 super().handle_cids_in_local_ipfs(request_metadata, root_cid=cid, contain_databases=True, contain_files=False, is_unpin=True)
+                if cars:
+                    CidPipeline(is_unpin=True).run([c['cid'] for c in cars])
 
 
 class RestoreExecutor(ExecutorBase):
@@ -228,11 +391,17 @@ class RestoreExecutor(ExecutorBase):
         logging.info('[RestoreExecutor] Success to get request metadata from the backup node.')
 
         # direct download database packages and restore to mongodb
-        self.owner.restore_database_by_dump_files(request_metadata)
+        if not self.checkpoint.is_stage_done('databases'):
+            self.owner.restore_database_by_dump_files(request_metadata, checkpoint=self.checkpoint, throttle=self.throttle)
+            self.checkpoint.finish_stage('databases')
         self.owner.update_request_state(self.user_did, BACKUP_REQUEST_STATE_PROCESS, '60')  # 100-based
         logging.info("[RestoreExecutor] Success to restore the dump files of the user's database.")
 
-        self.__class__.handle_cids_in_local_ipfs(request_metadata, contain_databases=False)
+        if not self.checkpoint.is_stage_done('files'):
+            self.__class__.handle_cids_in_local_ipfs(request_metadata, contain_databases=False,
+                                                     process_callback=self.get_process_callback(60, 80), checkpoint=self.checkpoint,
+                                                     throttle=self.throttle)
+            self.checkpoint.finish_stage('files')
         self.owner.update_request_state(self.user_did, BACKUP_REQUEST_STATE_PROCESS, '80')  # 100-based
         logging.info('[RestoreExecutor] Success to pin files CIDs.')
 
@@ -255,9 +424,15 @@ class BackupServerExecutor(ExecutorBase):
         self.owner.update_request_state(self.user_did, BACKUP_REQUEST_STATE_PROCESS, '60')  # 100-based
         logging.info('[BackupServerExecutor] Success to get request metadata.')
 
-        self.__class__.handle_cids_in_local_ipfs(request_metadata)
+        if not self.checkpoint.is_stage_done('pin'):
+            self.__class__.handle_cids_in_local_ipfs(request_metadata, process_callback=self.get_process_callback(60, 80),
+                                                     checkpoint=self.checkpoint, throttle=self.throttle)
+            self.checkpoint.finish_stage('pin')
         self.owner.update_request_state(self.user_did, BACKUP_REQUEST_STATE_PROCESS, '80')  # 100-based
         logging.info('[BackupServerExecutor] Success to get pin all CIDs.')
 
         self.owner.update_storage_usage(self.user_did, request_metadata['backup_size'])
         logging.info('[BackupServerExecutor] Success to update storage size.')
+
+        self.owner.update_backup_chain(self.user_did, self.req, request_metadata)
+        logging.info(f'[BackupServerExecutor] Success to update the backup chain with the {request_metadata.get("type", "full")} backup.')
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+"""
+The scheduler of the backup & restore jobs to limit how many executors run at the same time.
+"""
+import logging
+import threading
+import time
+import typing as t
+import uuid
+from datetime import datetime
+
+from pymongo.errors import DuplicateKeyError
+
+from src import hive_setting
+from src.modules.database.mongodb_client import MongodbClient
+from src.utils.consts import COL_BACKUP_JOBS, USR_DID
+from src.utils.http_exception import BackupIsInProcessingException
+
+JOB_SIDE_CLIENT = 'client'  # the backup & restore on the vault node.
+JOB_SIDE_SERVER = 'server'  # the backup on the backup node.
+
+JOB_STATE_WAITING = 'waiting'
+JOB_STATE_RUNNING = 'running'
+
+
+class BackupScheduler:
+    """ Run the backup & restore executors by the jobs in a persistent queue.
+
+    - the jobs are kept in the management collection and survive the reboot of the node;
+    - every user has at most one job on each side, the new request replaces the waiting one;
+    - the jobs run by the order of the enqueued time, at most BACKUP_JOB_CONCURRENCY jobs at the same time;
+    - the running jobs keep the heartbeat, the job which heartbeat is out of date is put back to the queue.
+
+    The executor is created by the factory registered by the owner (BackupClient or BackupServer) of the side.
+    """
+
+    HEARTBEAT_INTERVAL = 30  # seconds
+    HEARTBEAT_TIMEOUT = 5 * 60
+
+    def __init__(self, collection_name=COL_BACKUP_JOBS):
+        self.instance_id = uuid.uuid4().hex
+        self.collection_name = collection_name
+        self.mcli = None  # created on the first use, after the settings are loaded by the app.
+        self.factories: t.Dict[str, t.Callable] = dict()
+        self.running: t.Dict[str, threading.Thread] = dict()
+        self.lock = threading.Lock()
+        self.heartbeat_thread = None
+        self.is_index_created = False
+
+    def register(self, side, factory: t.Callable[[str, str, bool], threading.Thread]):
+        """ :param factory: create the executor with (user_did, action, is_force). """
+        self.factories[side] = factory
+
+    def is_running(self, side, user_did) -> bool:
+        """ Check before resetting the request of the user, the running job is not replaced even forced. """
+        col = self.__get_collection()
+        # the job left running by the crashed process can be replaced after it is put back.
+        self.__put_back_dead_jobs(col, int(datetime.now().timestamp()))
+        return col.count({USR_DID: user_did, 'side': side, 'state': JOB_STATE_RUNNING}) > 0
+
+    def submit(self, side, user_did, action, is_force=False):
+        """ Put the job to the queue, then run it if possible.
+
+        :raise BackupIsInProcessingException: the job of the user on the side is running.
+        """
+        with self.lock:
+            self.__start_heartbeat()
+
+        col, now = self.__get_collection(), int(datetime.now().timestamp())
+        self.__put_back_dead_jobs(col, now)
+
+        filter_ = {USR_DID: user_did, 'side': side, 'state': {'$ne': JOB_STATE_RUNNING}}
+        update = {'$set': {'action': action, 'is_force': is_force, 'state': JOB_STATE_WAITING},
+                  '$setOnInsert': {'queued_at': now}}
+        try:
+            col.update_one(filter_, update, upsert=True)
+        except DuplicateKeyError:
+            raise BackupIsInProcessingException(f'The {side} job of the user {user_did} is running.')
+        self.dispatch()
+
+    def get_position(self, side, user_did) -> int:
+        """ The position of the waiting job in the queue (1-based), 0 means not waiting. """
+        col = self.__get_collection()
+        job = col.find_one({USR_DID: user_did, 'side': side, 'state': JOB_STATE_WAITING})
+        if not job:
+            return 0
+        return col.count({'state': JOB_STATE_WAITING, '$or': [{'queued_at': {'$lt': job['queued_at']}},
+                                                               {'queued_at': job['queued_at'], '_id': {'$lt': job['_id']}}]}) + 1
+
+    def dispatch(self):
+        """ Run the waiting jobs until reach the concurrency limit. """
+        with self.lock:
+            self.__start_heartbeat()
+
+            col = self.__get_collection()
+            while col.count({'state': JOB_STATE_RUNNING}) < hive_setting.BACKUP_JOB_CONCURRENCY:
+                job = col.find_one({'state': JOB_STATE_WAITING, 'side': {'$in': list(self.factories.keys())}},
+                                   sort=[('queued_at', 1), ('_id', 1)])
+                if not job:
+                    break
+
+                # claim the job, maybe already claimed by other process.
+                update = {'$set': {'state': JOB_STATE_RUNNING, 'instance_id': self.instance_id,
+                                   'heartbeat': int(datetime.now().timestamp())}}
+                if col.update_one({'_id': job['_id'], 'state': JOB_STATE_WAITING}, update)['modified_count'] != 1:
+                    continue
+
+                self.__run_job(job)
+
+    def __run_job(self, job):
+        job_id, user_did = str(job['_id']), job[USR_DID]
+        try:
+            executor = self.factories[job['side']](user_did, job['action'], job.get('is_force', False))
+        except Exception as e:
+            logging.error(f'[BackupScheduler] Failed to create the executor of the job {job_id}: {e}')
+            self.__get_collection().delete_one({'_id': job['_id']})
+            return
+
+        def on_finished():
+            with self.lock:
+                self.running.pop(job_id, None)
+                self.__get_collection().delete_one({'_id': job['_id'], 'instance_id': self.instance_id})
+            logging.info(f'[BackupScheduler] The job {job["side"]}.{job["action"]} of the user {user_did} finished.')
+            self.dispatch()
+
+        executor.on_finished = on_finished
+        self.running[job_id] = executor
+        executor.start()
+        logging.info(f'[BackupScheduler] Start the job {job["side"]}.{job["action"]} of the user {user_did}.')
+
+    def __start_heartbeat(self):
+        if self.heartbeat_thread:
+            return
+        self.heartbeat_thread = threading.Thread(target=self.__heartbeat, daemon=True)
+        self.heartbeat_thread.start()
+
+    def __heartbeat(self):
+        """ Keep the running jobs alive and put back the jobs of the dead processes,
+        also run the jobs submitted by the other processes. """
+        while True:
+            time.sleep(self.HEARTBEAT_INTERVAL)
+            try:
+                self.keep_heartbeat()
+            except Exception as e:
+                logging.error(f'[BackupScheduler] Failed to keep the heartbeat: {e}')
+
+    def keep_heartbeat(self):
+        col, now = self.__get_collection(), int(datetime.now().timestamp())
+        col.update_many({'state': JOB_STATE_RUNNING, 'instance_id': self.instance_id}, {'$set': {'heartbeat': now}})
+        self.__put_back_dead_jobs(col, now)
+        self.dispatch()
+
+    def __put_back_dead_jobs(self, col, now):
+        result = col.update_many({'state': JOB_STATE_RUNNING, 'heartbeat': {'$lt': now - self.HEARTBEAT_TIMEOUT}},
+                                 {'$set': {'state': JOB_STATE_WAITING}})
+        if result['modified_count']:
+            logging.info(f'[BackupScheduler] Put back {result["modified_count"]} jobs without heartbeat.')
+
+    def __get_collection(self):
+        if not self.mcli:
+            self.mcli = MongodbClient()
+        col = self.mcli.get_management_collection(self.collection_name)
+        if not self.is_index_created:
+            col.col.create_index([(USR_DID, 1), ('side', 1)], unique=True)
+            self.is_index_created = True
+        return col
+
+
+backup_scheduler = BackupScheduler()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+"""
+Scrub the backups on the backup node to find the lost or broken content before restoring.
+"""
+import logging
+import random
+import time
+from datetime import datetime
+
+from src import hive_setting
+from src.modules.backup.backup import BackupManager
+from src.modules.backup.backup_server import BackupServer
+from src.modules.backup.manifest import iterate_file_batches
+from src.modules.database.mongodb_client import MongodbClient
+from src.modules.files.ipfs_client import IpfsClient
+from src.utils.consts import COL_IPFS_BACKUP_SERVER, USR_DID, BKSERVER_REQ_CID, BKSERVER_REQ_STATE, \
+    BKSERVER_REQ_SCRUB, BACKUP_REQUEST_STATE_PROCESS
+from src.utils.job_lock import get_job_lease
+from src.utils.throttle import Throttle
+
+SCRUB_STATE_OK = 'ok'
+SCRUB_STATE_BROKEN = 'broken'  # some CIDs are not pinned or the content does not match.
+SCRUB_STATE_ERROR = 'error'  # failed to scrub, such as the metadata can not be got.
+
+# how many broken CIDs are kept in the result.
+MAX_RESULT_CIDS = 100
+
+
+class BackupScrubber:
+    """ Check the CIDs of the backup chains are still pinned on the local IPFS node.
+
+    Every round only scrubs at most BACKUP_SCRUB_MAX_BACKUPS backups which are not scrubbed in BACKUP_SCRUB_INTERVAL hours,
+    the oldest scrubbed first. The pins are checked by batches, and the content of a sample of the CIDs
+    is downloaded with the rate limit to verify the sha256 and the size.
+
+    The files are checked batch by batch (the shards of the request metadata) to keep the memory bounded.
+
+    The result is kept in the backup document:
+
+        {
+            "time": <the timestamp of the scrub>,
+            "duration": <seconds>,
+            "state": "ok" | "broken" | "error",
+            "cids": <the count of the checked pins>,
+            "not_pinned_count": <int>, "not_pinned": [<cid>, ...],
+            "sampled": <the count of the verified CIDs>,
+            "corrupted_count": <int>, "corrupted": [<cid>, ...],
+            "message": <error message>
+        }
+    """
+
+    def __init__(self):
+        self.mcli = MongodbClient()
+        self.backup_manager = BackupManager()
+        self.ipfs_client = IpfsClient()
+
+    def scrub(self):
+        interval = hive_setting.BACKUP_SCRUB_INTERVAL
+        if interval <= 0:
+            return
+
+        expired = int(datetime.now().timestamp()) - interval * 3600
+        filter_ = {BKSERVER_REQ_CID: {'$exists': True, '$ne': None},
+                   BKSERVER_REQ_STATE: {'$ne': BACKUP_REQUEST_STATE_PROCESS},
+                   '$or': [{f'{BKSERVER_REQ_SCRUB}.time': {'$exists': False}},
+                           {f'{BKSERVER_REQ_SCRUB}.time': {'$lt': expired}}]}
+        backups = self.mcli.get_management_collection(COL_IPFS_BACKUP_SERVER).find_many(
+            filter_, sort=[(f'{BKSERVER_REQ_SCRUB}.time', 1)], limit=hive_setting.BACKUP_SCRUB_MAX_BACKUPS)
+        if not backups:
+            return
+
+        server, throttle = BackupServer(), Throttle(job_rate=hive_setting.BACKUP_SCRUB_RATE_LIMIT)
+        for backup in backups:
+            lease = get_job_lease()
+            if lease and not lease.is_valid():
+                logging.info('[BackupScrubber] The job lease is lost, stop scrubbing.')
+                break
+            self.scrub_backup(server, backup, throttle)
+
+    def scrub_backup(self, server: BackupServer, backup, throttle: Throttle):
+        user_did, start = backup[USR_DID], time.time()
+        result = {'time': int(datetime.now().timestamp()), 'state': SCRUB_STATE_OK, 'cids': 0,
+                  'not_pinned_count': 0, 'not_pinned': [], 'sampled': 0, 'corrupted_count': 0, 'corrupted': [],
+                  'message': ''}
+
+        try:
+            not_pinned, corrupted = list(), list()
+            layers = server.get_backup_layers(user_did, backup)
+            for i, (layer, metadata) in enumerate(layers):
+                # the CAR archives pin the content CIDs by their roots.
+                cars = metadata.get('cars')
+                pins = [layer[BKSERVER_REQ_CID], *[s['cid'] for s in metadata.get('file_shards', [])]]
+                pins.extend([c['root'] for c in cars] if cars else [d['cid'] for d in metadata['databases']])
+                self.__check_pins(pins, result, not_pinned)
+                self.__verify_sample(metadata['databases'], result, not_pinned, corrupted, throttle)
+
+                # only the latest layer contains all files, which are checked batch by batch.
+                if i == len(layers) - 1:
+                    for files in iterate_file_batches(metadata, throttle=throttle):
+                        if not cars:
+                            self.__check_pins([f['cid'] for f in files], result, not_pinned)
+                        self.__verify_sample(files, result, not_pinned, corrupted, throttle)
+
+            result.update({'not_pinned_count': len(not_pinned), 'not_pinned': not_pinned[:MAX_RESULT_CIDS],
+                           'corrupted_count': len(corrupted), 'corrupted': corrupted[:MAX_RESULT_CIDS]})
+            if not_pinned or corrupted:
+                result['state'] = SCRUB_STATE_BROKEN
+                logging.error(f'[BackupScrubber] The backup of the user {user_did} is broken, '
+                              f'{len(not_pinned)} CIDs not pinned, {len(corrupted)} CIDs corrupted.')
+        except Exception as e:
+            result.update({'state': SCRUB_STATE_ERROR, 'message': str(e)})
+            logging.error(f'[BackupScrubber] Failed to scrub the backup of the user {user_did}: {str(e)}')
+
+        result['duration'] = round(time.time() - start, 3)
+        self.backup_manager.update_backup(user_did, {BKSERVER_REQ_SCRUB: result}, contains_extra=False)
+        logging.info(f'[BackupScrubber] Scrubbed the backup of the user {user_did}: {result["state"]}, '
+                     f'{result["cids"]} CIDs, {result["sampled"]} sampled, {result["duration"]}s.')
+
+    def __check_pins(self, cids: list, result: dict, not_pinned: list):
+        batch_size = max(hive_setting.BACKUP_SCRUB_BATCH_SIZE, 1)
+        for i in range(0, len(cids), batch_size):
+            not_pinned.extend(self.ipfs_client.cids_not_pinned(cids[i:i + batch_size]))
+        result['cids'] += len(cids)
+
+    def __verify_sample(self, items: list, result: dict, not_pinned: list, corrupted: list, throttle: Throttle):
+        """ Download the content of the sample of the items to verify the sha256 and the size. """
+        for item in items:
+            if random.random() >= hive_setting.BACKUP_SCRUB_SAMPLE_RATE or item['cid'] in not_pinned:
+                continue
+            result['sampled'] += 1
+            try:
+                for _ in self.ipfs_client.download_stream(item['cid'], sha256=item['sha256'], size=item['size'], throttle=throttle):
+                    pass
+            except Exception as e:
+                logging.info(f'[BackupScrubber] The content of the cid {item["cid"]} is broken: {str(e)}')
+                corrupted.append(item['cid'])
@@ -1,18 +1,23 @@
 # -*- coding: utf-8 -*-
 import json
 import logging
+import threading
+import time
+import typing as t
 
 from flask import g
 
+from src import hive_setting
 from src.modules.backup.encryption import Encryption
 from src.modules.files.local_file import LocalFile
 from src.utils.consts import BKSERVER_REQ_STATE, BACKUP_REQUEST_STATE_PROCESS, BKSERVER_REQ_ACTION, \
     BACKUP_REQUEST_ACTION_BACKUP, BKSERVER_REQ_CID, BKSERVER_REQ_SHA256, BKSERVER_REQ_SIZE, \
     BKSERVER_REQ_STATE_MSG, BACKUP_REQUEST_STATE_FAILED, COL_IPFS_BACKUP_SERVER, USR_DID, BACKUP_REQUEST_STATE_SUCCESS, \
     VAULT_BACKUP_SERVICE_MAX_STORAGE, VAULT_BACKUP_SERVICE_START_TIME, VAULT_BACKUP_SERVICE_END_TIME, \
-    VAULT_BACKUP_SERVICE_USING, VAULT_BACKUP_SERVICE_USE_STORAGE, VAULT_SERVICE_MAX_STORAGE, BKSERVER_REQ_PUBLIC_KEY
+    VAULT_BACKUP_SERVICE_USING, VAULT_BACKUP_SERVICE_USE_STORAGE, VAULT_SERVICE_MAX_STORAGE, BKSERVER_REQ_PUBLIC_KEY, \
+    BKSERVER_REQ_CHAIN, BKSERVER_REQ_CHECKPOINT, BKSERVER_REQ_THROUGHPUT
 from src.utils.http_exception import BackupNotFoundException, AlreadyExistsException, BadRequestException, \
-    InsufficientStorageException, NotImplementedException, VaultNotFoundException
+    InsufficientStorageException, NotImplementedException, VaultNotFoundException, BackupIsInProcessingException
 from src.utils.payment_config import PaymentConfig
 from src.modules.auth.auth import Auth
 from src.modules.auth.user import UserManager
@@ -20,11 +25,16 @@ from src.modules.backup.backup import BackupManager
 from src.modules.database.mongodb_client import MongodbClient
 from src.modules.backup.backup_client import BackupClient
 from src.modules.backup.backup_executor import ExecutorBase, BackupServerExecutor
+from src.modules.backup.backup_scheduler import backup_scheduler, JOB_SIDE_SERVER
 from src.modules.files.ipfs_client import IpfsClient
 from src.modules.subscription.subscription import VaultSubscription
 from src.modules.subscription.vault import VaultManager
 
 
+# notify the long polls of the state when the state of any backup changed.
+_state_changed = threading.Condition()
+
+
 class BackupServer:
     def __init__(self):
         self.vault = VaultSubscription()
@@ -35,6 +45,7 @@ class BackupServer:
         self.vault_manager = VaultManager()
         self.backup_manager = BackupManager()
         self.ipfs_client = IpfsClient()
+        backup_scheduler.register(JOB_SIDE_SERVER, self.__create_executor)
 
     def promotion(self):
         """ This processing is just like restore the vault:
@@ -65,6 +76,10 @@ class BackupServer:
         ExecutorBase.update_vault_usage_by_metadata(g.usr_did, request_metadata)
 
     def internal_backup(self, cid, sha256, size, is_force, public_key):
+        # the running job keeps using the request, so it can not be reset even forced.
+        if backup_scheduler.is_running(JOB_SIDE_SERVER, g.usr_did):
+            raise BackupIsInProcessingException('The backup is running on the backup node.')
+
         # check currently whether it is in progress.
         backup = self.backup_manager.get_backup(g.usr_did)
         if not is_force and backup.get(BKSERVER_REQ_STATE) == BACKUP_REQUEST_STATE_PROCESS:
@@ -81,21 +96,49 @@ class BackupServer:
             BKSERVER_REQ_CID: cid,
             BKSERVER_REQ_SHA256: sha256,
             BKSERVER_REQ_SIZE: size,
-            BKSERVER_REQ_PUBLIC_KEY: public_key
+            BKSERVER_REQ_PUBLIC_KEY: public_key,
+            BKSERVER_REQ_CHECKPOINT: None,
+            # keep the layer of the full backup without the chain which the new incremental one follows.
+            BKSERVER_REQ_CHAIN: self.__get_backup_chain(backup)
         }
         self.backup_manager.update_backup(g.usr_did, update)
-        BackupServerExecutor(g.usr_did, self, self.backup_manager.get_backup(g.usr_did)).start()
+        backup_scheduler.submit(JOB_SIDE_SERVER, g.usr_did, BACKUP_REQUEST_ACTION_BACKUP, is_force=is_force)
+
+    def internal_backup_state(self, wait=0, result='', message=''):
+        """ Get the state of the backup, the long poll is enabled by the wait seconds.
 
-    def internal_backup_state(self):
+        When long polling, return until the result or the message is different from the given ones,
+        or after the wait seconds which are limited by BACKUP_STATE_WAIT_MAX.
+        """
         backup = self.backup_manager.get_backup(g.usr_did)
+
+        deadline = time.time() + min(wait, hive_setting.BACKUP_STATE_WAIT_MAX)
+        while (backup.get(BKSERVER_REQ_STATE) or '') == result and (backup.get(BKSERVER_REQ_STATE_MSG) or '') == message:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            # the change by other processes is checked every second.
+            with _state_changed:
+                _state_changed.wait(timeout=min(timeout, 1))
+            backup = self.backup_manager.get_backup(g.usr_did)
+
         return {
             'state': backup.get(BKSERVER_REQ_ACTION),  # None or backup
             'result': backup.get(BKSERVER_REQ_STATE),
             'message': backup.get(BKSERVER_REQ_STATE_MSG),
-            'public_key': Encryption.get_service_did_public_key(True)
+            'public_key': Encryption.get_service_did_public_key(True),
+            'queue_position': backup_scheduler.get_position(JOB_SIDE_SERVER, g.usr_did),
+            'throughput': backup.get(BKSERVER_REQ_THROUGHPUT) or 0,
+            'resumed_bytes': (backup.get(BKSERVER_REQ_CHECKPOINT) or {}).get('resumed_bytes', 0),
+            'transferred_bytes': (backup.get(BKSERVER_REQ_CHECKPOINT) or {}).get('transferred_bytes', 0),
+            'is_long_poll': True,
+            'is_sharded_manifest': True,
+            'is_curve25519_chunked': True,
+            'is_backup_chain': True
         }
 
-    def internal_restore(self, public_key):
+    def internal_restore(self, public_key, is_curve25519_chunked=False):
+        """ :param is_curve25519_chunked: whether the vault node can decrypt the metadata with the bigger chunk size. """
         backup = self.backup_manager.get_backup(g.usr_did)
 
         # BKSERVER_REQ_ACTION: None, means not backup called; 'backup', backup called, and can be three states.
@@ -115,42 +158,59 @@ class BackupServer:
         if not backup.get(BKSERVER_REQ_CID):
             raise BadRequestException(f'Cannot execute restore because invalid data cid "{backup.get(BKSERVER_REQ_CID)}".')
 
-        # decrypt and encrypt the metadata.
+        # materialize the backup chain and encrypt the metadata for the vault.
         try:
-            tmp_file = LocalFile.generate_tmp_file_path()
-            self.ipfs_client.download_file(backup.get(BKSERVER_REQ_CID), tmp_file)
+            request_metadata = self.__get_materialized_request_metadata(g.usr_did, backup)
 
-            plain_path = Encryption.decrypt_file_with_curve25519(tmp_file, backup.get(BKSERVER_REQ_PUBLIC_KEY), True)
-            cipher_path = Encryption.encrypt_file_with_curve25519(plain_path, public_key, True)
-            self.ipfs_client.upload_file(cipher_path)
-            cipher_path.unlink()
+            plain_path = LocalFile.generate_tmp_file_path()
+            with plain_path.open('w') as f:
+                json.dump(request_metadata, f)
+            cipher_path = Encryption.encrypt_file_with_curve25519(plain_path, public_key, True,
+                                                                  chunk_size=None if is_curve25519_chunked else Encryption.TRUNK_SIZE)
             plain_path.unlink()
-            tmp_file.unlink()
+
+            sha256, size = LocalFile.get_sha256(cipher_path.as_posix()), cipher_path.stat().st_size
+            cid = self.ipfs_client.upload_file(cipher_path)
+            cipher_path.unlink()
         except Exception as e:
             raise BadRequestException(f'Failed to prepare restore metadata on the backup node: {e}')
 
         # backup data is valid, go on
         return {
-            'cid': backup.get(BKSERVER_REQ_CID),
-            'sha256': backup.get(BKSERVER_REQ_SHA256),
-            'size': backup.get(BKSERVER_REQ_SIZE),
+            'cid': cid,
+            'sha256': sha256,
+            'size': size,
             'public_key': Encryption.get_service_did_public_key(True)
         }
 
     # the flowing is for the executors.
 
-    def update_request_state(self, user_did, state, msg=None):
-        self.backup_manager.update_backup(user_did, {BKSERVER_REQ_STATE: state, BKSERVER_REQ_STATE_MSG: msg})
+    def update_request_state(self, user_did, state, msg=None, throughput=None):
+        self.backup_manager.update_backup(user_did, {BKSERVER_REQ_STATE: state, BKSERVER_REQ_STATE_MSG: msg, BKSERVER_REQ_THROUGHPUT: throughput})
+        with _state_changed:
+            _state_changed.notify_all()
+
+    def get_checkpoint(self, user_did):
+        return self.backup_manager.get_backup(user_did).get(BKSERVER_REQ_CHECKPOINT)
+
+    def save_checkpoint(self, user_did, checkpoint: dict):
+        self.backup_manager.update_backup(user_did, {BKSERVER_REQ_CHECKPOINT: checkpoint})
 
     def get_server_request_metadata(self, user_did, req, is_promotion=False, vault_max_size=0):
         """ Get the request metadata for promotion or backup.
 
+        For promotion, the metadata is materialized from the whole backup chain.
+        For backup, the metadata is the new one which MUST follow the last of the backup chain if incremental.
+
         :param user_did
         :param req
         :param is_promotion
         :param vault_max_size Only for promotion.
         """
-        request_metadata = self.__get_verified_request_metadata(user_did, req)
+        if is_promotion:
+            request_metadata = self.__get_materialized_request_metadata(user_did, req)
+        else:
+            request_metadata = self.__get_verified_request_metadata(user_did, req)
         logging.info('[IpfsBackupServer] Success to get verified request metadata.')
 
         if is_promotion:
@@ -158,12 +218,63 @@ class BackupServer:
                 raise InsufficientStorageException('No enough space for promotion.')
         else:
             # for backup
+            if request_metadata.get('previous'):
+                chain = self.__get_backup_chain(req)
+                if not chain or chain[-1][BKSERVER_REQ_CID] != request_metadata['previous']['cid']:
+                    raise BadRequestException('The previous backup of the incremental backup does not match, please do a full backup.')
             if request_metadata['backup_size'] > req[VAULT_BACKUP_SERVICE_MAX_STORAGE]:
                 raise InsufficientStorageException('No enough space for backup on the backup node.')
         logging.info('[IpfsBackupServer] Success to check the verified request metadata.')
 
         return request_metadata
 
+    def update_backup_chain(self, user_did, req, request_metadata):
+        """ Append the new backup to the backup chain, a full backup starts a new chain. """
+        layer = {k: req.get(k) for k in [BKSERVER_REQ_CID, BKSERVER_REQ_SHA256, BKSERVER_REQ_SIZE, BKSERVER_REQ_PUBLIC_KEY]}
+        chain = self.__get_backup_chain(req) if request_metadata.get('previous') else list()
+        if not chain or chain[-1][BKSERVER_REQ_CID] != layer[BKSERVER_REQ_CID]:
+            chain.append(layer)
+        self.backup_manager.update_backup(user_did, {BKSERVER_REQ_CHAIN: chain})
+
+    @staticmethod
+    def __get_backup_chain(backup) -> list:
+        """ The layers of the backup chain from the full backup to the latest incremental one.
+
+        The backup without the chain is the full backup before supporting the incremental backup.
+        """
+        chain = backup.get(BKSERVER_REQ_CHAIN)
+        if chain:
+            return chain
+        if not backup.get(BKSERVER_REQ_CID):
+            return list()
+        return [{k: backup.get(k) for k in [BKSERVER_REQ_CID, BKSERVER_REQ_SHA256, BKSERVER_REQ_SIZE, BKSERVER_REQ_PUBLIC_KEY]}]
+
+    def __get_materialized_request_metadata(self, user_did, backup):
+        """ Merge the metadata of all layers of the backup chain to the one of the full backup.
+
+        The dump files of every database are kept by order from its last full dump,
+        and the databases removed from the vault are skipped.
+        """
+        layers = [self.__get_verified_request_metadata(user_did, r) for r in self.__get_backup_chain(backup)]
+        if not layers:
+            raise BadRequestException('No backup data on the backup node.')
+
+        latest = layers[-1]
+        if len(layers) == 1:
+            return latest
+
+        databases = dict()
+        for layer in layers:
+            for d in layer['databases']:
+                if d.get('is_full', True):
+                    databases[d['name']] = list()
+                databases.setdefault(d['name'], list()).append({**d, 'encryption': layer['encryption']})
+
+        return {**latest,
+                'type': 'full',
+                'previous': None,
+                'databases': [d for name in latest['database_markers'].keys() for d in databases.get(name, [])]}
+
     def __get_verified_request_metadata(self, user_did, req):
         cid, sha256, size, public_key = req.get(BKSERVER_REQ_CID), req.get(BKSERVER_REQ_SHA256), req.get(BKSERVER_REQ_SIZE), req.get(BKSERVER_REQ_PUBLIC_KEY)
 
@@ -178,6 +289,10 @@ class BackupServer:
         plain_path.unlink()
         return metadata
 
+    def get_backup_layers(self, user_did, backup) -> t.List[t.Tuple[dict, dict]]:
+        """ The layers of the backup chain with the decrypted metadata of every layer. """
+        return [(layer, self.__get_verified_request_metadata(user_did, layer)) for layer in self.__get_backup_chain(backup)]
+
     # ipfs-subscription
 
     def subscribe(self):
@@ -203,9 +318,15 @@ class BackupServer:
     def remove_backup_by_did(self, user_did, doc):
         """ Remove all data belongs to the backup of the user. """
         logging.debug(f'start remove the backup of the user {user_did}, _id, {str(doc["_id"])}')
-        if doc.get(BKSERVER_REQ_CID):
-            request_metadata = self.__get_verified_request_metadata(user_did, doc)
-            ExecutorBase.handle_cids_in_local_ipfs(request_metadata, root_cid=doc.get(BKSERVER_REQ_CID), is_unpin=True)
+        chain = self.__get_backup_chain(doc)
+        if doc.get(BKSERVER_REQ_CID) and doc.get(BKSERVER_REQ_CID) not in [c[BKSERVER_REQ_CID] for c in chain]:
+            # the latest backup which is failed.
+            chain.append({k: doc.get(k) for k in [BKSERVER_REQ_CID, BKSERVER_REQ_SHA256, BKSERVER_REQ_SIZE, BKSERVER_REQ_PUBLIC_KEY]})
+        for i, layer in enumerate(chain):
+            # only the latest layer contains all files.
+            request_metadata = self.__get_verified_request_metadata(user_did, layer)
+            ExecutorBase.handle_cids_in_local_ipfs(request_metadata, root_cid=layer[BKSERVER_REQ_CID],
+                                                   contain_files=i == len(chain) - 1, is_unpin=True)
 
         self.backup_manager.remove_backup(user_did)
 
@@ -240,9 +361,15 @@ class BackupServer:
 
         for req in requests:
             if req.get(BKSERVER_REQ_STATE) != BACKUP_REQUEST_STATE_PROCESS:
-                return
+                continue
 
             # only handle BACKUP_REQUEST_STATE_INPROGRESS ones.
             user_did = req[USR_DID]
-            logging.info(f"[IpfsBackupServer] Found uncompleted request({user_did}), retry.")
-            BackupServerExecutor(user_did, self, req, start_delay=30).start()
+            logging.info(f"[IpfsBackupServer] Found uncompleted request({user_did}), resume from the checkpoint.")
+            try:
+                backup_scheduler.submit(JOB_SIDE_SERVER, user_did, BACKUP_REQUEST_ACTION_BACKUP)
+            except BackupIsInProcessingException as e:
+                logging.info(f'[IpfsBackupServer] {e.msg} Skip.')
+
+    def __create_executor(self, user_did, action, is_force):
+        return BackupServerExecutor(user_did, self, self.backup_manager.get_backup(user_did), is_force=is_force)
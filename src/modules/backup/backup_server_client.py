@@ -30,12 +30,28 @@ class BackupServerClient:
     def get_state(self):
         try:
             body = self.http.get(self.target_host + URL_V2 + URL_SERVER_INTERNAL_STATE, self.get_token())
-            # action (None or 'backup'), state, message, public key for curve25519
-            return body['state'], body['result'], body['message'], body['public_key']
+            # action (None or 'backup'), state, message, public key for curve25519, whether supports the sharded metadata,
+            # whether supports the curve25519 cipher stream with the customized chunk size,
+            # whether keeps the chain of the incremental backups.
+            return body['state'], body['result'], body['message'], body['public_key'], body.get('is_sharded_manifest', False), \
+                body.get('is_curve25519_chunked', False), body.get('is_backup_chain', False)
         except Exception as e:
             # backup service not exists
             raise BadRequestException(f'Failed to get the status from the backup server: {str(e)}')
 
+    def wait_state(self, result, message, wait):
+        """ Long poll the state: the backup node returns when the result or the message is different
+        from the given ones, or after the wait seconds.
+
+        :return: action, state, message, whether the backup node supports the long poll.
+        """
+        try:
+            body = self.http.get(self.target_host + URL_V2 + URL_SERVER_INTERNAL_STATE, self.get_token(),
+                                 params={'wait': wait, 'result': result or '', 'message': message or ''}, timeout=wait + 30)
+            return body['state'], body['result'], body['message'], body.get('is_long_poll', False)
+        except Exception as e:
+            raise BadRequestException(f'Failed to wait the status from the backup server: {str(e)}')
+
     @staticmethod
     def __get_request_doc(user_did):
         mcli = MongodbClient()
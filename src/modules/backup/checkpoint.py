@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+"""
+The checkpoint of the backup & restore request to resume the executor after the node rebooted.
+"""
+import logging
+import threading
+import time
+import typing as t
+
+from pymongo import UpdateOne
+
+from src.modules.database.mongodb_client import MongodbClient
+from src.utils.consts import COL_BACKUP_CHECKPOINT_ITEMS, USR_DID
+
+
+class Checkpoint:
+    """ Record the completed stages and the completed items (CIDs or databases) of the current stage.
+
+    The stages and the bytes are saved into the request document by the owner of the executor:
+
+        {
+            "stages": {"<stage name>": <result of the stage>},
+            "resumed_bytes": <the size of the items skipped by the checkpoint>,
+            "transferred_bytes": <the size of the items handled by the request>
+        }
+
+    The items are too many for the request document, so every item is one document of the collection
+    COL_BACKUP_CHECKPOINT_ITEMS keyed by (user_did, name, key), the name is the action of the executor.
+    The completed items are saved in batch to avoid updating for every CID.
+    """
+
+    SAVE_COUNT = 100
+    SAVE_INTERVAL = 5  # seconds
+
+    def __init__(self, user_did, name, save: t.Callable[[dict], None], data: t.Optional[dict] = None):
+        self.user_did, self.name = user_did, name
+        self.__save = save
+        self.__lock = threading.Lock()
+        self.__mcli, self.__col = MongodbClient(), None
+        self.__pending, self.__last_save = dict(), time.time()
+        self.resumed_bytes = 0
+
+        if not data:
+            # the items of the last request are useless.
+            self.data = {'stages': {}, 'resumed_bytes': 0, 'transferred_bytes': 0}
+            self.__clear_items()
+            self.__is_items_saved = False
+            return
+
+        self.data = data
+        if 'items' in data:
+            # the checkpoint of the old version keeps the items in the request document.
+            self.__pending.update(data.pop('items'))
+            self.__flush()
+        self.__is_items_saved = self.__get_collection().count(self.__get_filter(), limit=1) > 0
+
+    def is_resumed(self):
+        return bool(self.data['stages'] or self.__is_items_saved)
+
+    def is_stage_done(self, name):
+        return name in self.data['stages']
+
+    def get_stage(self, name):
+        return self.data['stages'].get(name)
+
+    def finish_stage(self, name, result=None):
+        """ The items belong to the current stage, so they are cleared when the stage is done. """
+        with self.__lock:
+            self.data['stages'][name] = result
+            self.__pending, self.__is_items_saved = dict(), False
+            self.__clear_items()
+            self.__flush()
+
+    def is_item_done(self, key):
+        return key in self.__pending or self.__find_item(key) is not None
+
+    def get_item(self, key):
+        if key in self.__pending:
+            return self.__pending[key]
+        doc = self.__find_item(key)
+        return doc['result'] if doc else None
+
+    def skip_item(self, size=0):
+        """ The item is done before resuming. """
+        with self.__lock:
+            self.resumed_bytes += size
+            self.data['resumed_bytes'] += size
+
+    def finish_item(self, key, result=None, size=0):
+        with self.__lock:
+            self.__pending[key] = result
+            self.data['transferred_bytes'] += size
+            if len(self.__pending) >= Checkpoint.SAVE_COUNT or time.time() - self.__last_save >= Checkpoint.SAVE_INTERVAL:
+                self.__flush()
+
+    def flush(self):
+        with self.__lock:
+            self.__flush()
+
+    def clear(self):
+        """ Remove the items when the request finished, the stages and the bytes are kept in the request document. """
+        with self.__lock:
+            self.__pending, self.__is_items_saved = dict(), False
+            self.__clear_items()
+
+    def __flush(self):
+        if self.__pending:
+            # the item may be handled again after the node rebooted, so upsert it.
+            self.__get_collection().col.bulk_write([UpdateOne({**self.__get_filter(), 'key': k}, {'$set': {'result': v}}, upsert=True)
+                                                    for k, v in self.__pending.items()], ordered=False)
+        self.__save(self.data)
+        self.__pending, self.__last_save = dict(), time.time()
+
+    def __find_item(self, key):
+        """ Only the items saved before resuming are searched, every item is handled once in one run. """
+        if not self.__is_items_saved:
+            return None
+        return self.__get_collection().find_one({**self.__get_filter(), 'key': key})
+
+    def __clear_items(self):
+        self.__get_collection().delete_many(self.__get_filter())
+
+    def __get_filter(self):
+        return {USR_DID: self.user_did, 'name': self.name}
+
+    def __get_collection(self):
+        if not self.__col:
+            self.__col = self.__mcli.get_management_collection(COL_BACKUP_CHECKPOINT_ITEMS)
+            self.__col.col.create_index([(USR_DID, 1), ('name', 1), ('key', 1)], unique=True)
+        return self.__col
+
+    def log_bytes(self, action):
+        logging.info(f'[Checkpoint] The {action} transferred {self.data["transferred_bytes"]} bytes, '
+                     f'resumed {self.data["resumed_bytes"]} bytes.')
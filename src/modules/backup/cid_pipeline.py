@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+"""
+Pin & unpin the CIDs of the backup metadata on the local IPFS node concurrently.
+"""
+import logging
+import time
+import typing as t
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from src import hive_setting
+from src.modules.files.ipfs_client import IpfsClient
+from src.utils.http_exception import BadRequestException
+from src.utils.throttle import Throttle
+
+
+class CidPipeline:
+    """ Pin or unpin a batch of CIDs with a bounded worker pool.
+
+    Every CID is retried several times before the whole pipeline fails. The already pinned CIDs are skipped when pinning.
+    """
+
+    def __init__(self, is_unpin=False, workers: int = None, retry_times: int = None, throttle: Throttle = None):
+        self.is_unpin = is_unpin
+        self.throttle = throttle
+        self.workers = workers if workers else hive_setting.BACKUP_PIN_WORKERS
+        self.retry_times = retry_times if retry_times else hive_setting.BACKUP_PIN_RETRY_TIMES
+        self.ipfs_client = IpfsClient()
+
+    def run(self, cids: list,
+            on_finished: t.Optional[t.Callable[[str], None]] = None,
+            process_callback: t.Optional[t.Callable[[int, int], None]] = None):
+        """ Handle all CIDs and return the count of the skipped ones.
+
+        :param cids: The CIDs to pin or unpin, the duplicated ones only be handled once.
+        :param on_finished: Called on the worker thread after one CID is handled successfully.
+        :param process_callback: Called on the caller thread with (finished count, total count).
+        """
+        cids = list(dict.fromkeys(cids))
+        total, finished, skipped = len(cids), 0, 0
+        if not total:
+            return 0
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, total)) as pool:
+            futures = {pool.submit(self.__handle_cid, cid, on_finished): cid for cid in cids}
+            try:
+                for future in as_completed(futures):
+                    if future.result():
+                        skipped += 1
+                    finished += 1
+                    if process_callback:
+                        process_callback(finished, total)
+            except Exception as e:
+                for f in futures:
+                    f.cancel()
+                raise e
+
+        logging.info(f'[CidPipeline] Success to {"unpin" if self.is_unpin else "pin"} {total} CIDs, {skipped} skipped.')
+        return skipped
+
+    def __handle_cid(self, cid, on_finished):
+        """ return True if the cid is skipped. """
+        skipped = False
+        for i in range(1, self.retry_times + 1):
+            try:
+                if self.is_unpin:
+                    self.ipfs_client.cid_unpin(cid)
+                elif self.ipfs_client.cid_pinned(cid):
+                    skipped = True
+                else:
+                    self.ipfs_client.cid_pin(cid, throttle=self.throttle)
+                break
+            except Exception as e:
+                if i >= self.retry_times:
+                    raise BadRequestException(f'Failed to {"unpin" if self.is_unpin else "pin"} the cid {cid}: {str(e)}')
+                logging.info(f'[CidPipeline] Failed to handle the cid {cid} ({i} times), retry: {str(e)}')
+                time.sleep(i)
+
+        if on_finished:
+            on_finished(cid)
+        return skipped
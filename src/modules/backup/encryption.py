@@ -1,8 +1,14 @@
+import struct
+import typing as t
 from pathlib import Path
 
 import base58
 import nacl.secret
 import nacl.utils
+from nacl.exceptions import CryptoError
+from nacl.bindings import crypto_secretstream_xchacha20poly1305_state, crypto_secretstream_xchacha20poly1305_init_push, \
+    crypto_secretstream_xchacha20poly1305_push, crypto_secretstream_xchacha20poly1305_init_pull, crypto_secretstream_xchacha20poly1305_pull, \
+    crypto_secretstream_xchacha20poly1305_TAG_FINAL, crypto_secretstream_xchacha20poly1305_HEADERBYTES, crypto_secretstream_xchacha20poly1305_ABYTES
 
 from src import hive_setting
 from src.modules.auth import auth
@@ -13,6 +19,15 @@ from src.utils.http_exception import BadRequestException
 class Encryption:
     TRUNK_SIZE = 4096
 
+    # for the stream encryption of the backup files.
+    MAGIC = b'HIVESS01'
+    # for the curve25519 cipher stream with the customized chunk size.
+    CURVE25519_MAGIC = b'HIVECS01'
+    STREAM_CHUNK_SIZE = 64 * 1024
+
+    # the curve25519 public keys of the service DID, key is 'is_server'.
+    PUBLIC_KEYS = dict()
+
     def __init__(self, pk: str = None, nonce: str = None):
         self.private_key = base58.b58decode(bytes(pk, 'utf8')) \
             if pk is not None else nacl.utils.random(nacl.secret.SecretBox.KEY_SIZE)
@@ -25,23 +40,107 @@ class Encryption:
         return base58.b58encode(self.private_key).decode('utf8'), base58.b58encode(self.nonce).decode('utf8')
 
     def encrypt_file(self, src_full_path: Path) -> Path:
+        """ Encrypt the file with the stream format in constant memory. """
         dst_full_path = Path(src_full_path.as_posix() + '.encryption')
-        with open(src_full_path.as_posix(), 'rb') as f:
-            data = f.read()
-        cipher_msg = self.box.encrypt(data, self.nonce)
-        with open(dst_full_path.as_posix(), 'wb') as f:
-            f.write(cipher_msg.ciphertext)
+        with open(src_full_path.as_posix(), 'rb') as sf:
+            with open(dst_full_path.as_posix(), 'wb') as df:
+                for data in self.encrypt_stream(Encryption.__read_chunks(sf)):
+                    df.write(data)
         return dst_full_path
 
     def decrypt_file(self, src_full_path: Path):
+        """ Decrypt the file which is encrypted with the stream format or the legacy single SecretBox message. """
         dst_full_path = Path(src_full_path.as_posix() + '.decryption')
-        with open(src_full_path.as_posix(), 'rb') as f:
-            data = f.read()
-        plain_data = self.box.decrypt(data, self.nonce)
-        with open(dst_full_path.as_posix(), 'wb') as f:
-            f.write(plain_data)
+        with open(src_full_path.as_posix(), 'rb') as sf:
+            with open(dst_full_path.as_posix(), 'wb') as df:
+                for data in self.decrypt_stream(Encryption.__read_chunks(sf)):
+                    df.write(data)
         return dst_full_path
 
+    def encrypt_stream(self, chunks: t.Iterable[bytes]) -> t.Iterator[bytes]:
+        """ Encrypt the data chunks with xchacha20poly1305 secret stream.
+
+        Format: MAGIC + plain chunk size (4 bytes, big endian) + stream header + encrypted chunks.
+        Every encrypted chunk has the fixed size (chunk size + ABYTES) except the last one which is tagged as final.
+        """
+        state = crypto_secretstream_xchacha20poly1305_state()
+        header = crypto_secretstream_xchacha20poly1305_init_push(state, self.private_key)
+        yield Encryption.MAGIC + struct.pack('>I', Encryption.STREAM_CHUNK_SIZE) + header
+
+        pending = None
+        for data in Encryption.__fixed_size_chunks(chunks, Encryption.STREAM_CHUNK_SIZE):
+            if pending is not None:
+                yield crypto_secretstream_xchacha20poly1305_push(state, pending)
+            pending = data
+        yield crypto_secretstream_xchacha20poly1305_push(state, pending if pending is not None else b'',
+                                                         tag=crypto_secretstream_xchacha20poly1305_TAG_FINAL)
+
+    def decrypt_stream(self, chunks: t.Iterable[bytes]) -> t.Iterator[bytes]:
+        """ Decrypt the data chunks encrypted by the stream format or the legacy single SecretBox message.
+
+        The legacy message can only be decrypted after the whole data is received.
+        """
+        chunks = iter(chunks)
+        prefix_size = len(Encryption.MAGIC) + 4 + crypto_secretstream_xchacha20poly1305_HEADERBYTES
+        prefix = bytearray()
+        for data in chunks:
+            prefix.extend(data)
+            if len(prefix) >= prefix_size:
+                break
+
+        if not prefix.startswith(Encryption.MAGIC):
+            # legacy format: one SecretBox message with the fixed nonce.
+            for data in chunks:
+                prefix.extend(data)
+            yield self.box.decrypt(bytes(prefix), self.nonce)
+            return
+
+        if len(prefix) < prefix_size:
+            raise BadRequestException('Too short data for the stream decryption.')
+
+        chunk_size, = struct.unpack('>I', prefix[len(Encryption.MAGIC):len(Encryption.MAGIC) + 4])
+        header = bytes(prefix[len(Encryption.MAGIC) + 4:prefix_size])
+        state = crypto_secretstream_xchacha20poly1305_state()
+        crypto_secretstream_xchacha20poly1305_init_pull(state, header, self.private_key)
+
+        def remain_chunks():
+            yield bytes(prefix[prefix_size:])
+            yield from chunks
+
+        is_final = False
+        for data in Encryption.__fixed_size_chunks(remain_chunks(), chunk_size + crypto_secretstream_xchacha20poly1305_ABYTES):
+            if is_final:
+                raise BadRequestException('Unexpected data after the final chunk of the stream decryption.')
+            try:
+                plain_data, tag = crypto_secretstream_xchacha20poly1305_pull(state, data)
+            except CryptoError as e:
+                raise BadRequestException(f'Failed to decrypt the chunk of the stream decryption: {e}')
+            is_final = tag == crypto_secretstream_xchacha20poly1305_TAG_FINAL
+            yield plain_data
+
+        if not is_final:
+            raise BadRequestException('The encrypted data of the stream decryption is truncated.')
+
+    @staticmethod
+    def __read_chunks(f, size=None) -> t.Iterator[bytes]:
+        while True:
+            data = f.read(size if size else Encryption.STREAM_CHUNK_SIZE)
+            if not data:
+                break
+            yield data
+
+    @staticmethod
+    def __fixed_size_chunks(chunks: t.Iterable[bytes], size: int) -> t.Iterator[bytes]:
+        """ Re-split the data chunks into the chunks with fixed size, the last one maybe smaller. """
+        buffer = bytearray()
+        for data in chunks:
+            buffer.extend(data)
+            while len(buffer) >= size:
+                yield bytes(buffer[:size])
+                del buffer[:size]
+        if buffer:
+            yield bytes(buffer)
+
     @staticmethod
     def __get_cipher(is_server: bool, other_side_public_key: str = None):
         auth_ = auth.Auth()
@@ -53,53 +152,73 @@ class Encryption:
 
     @staticmethod
     def get_service_did_public_key(is_server: bool):
-        public_key = Encryption.__get_cipher(is_server).get_curve25519_public_key()
-        return base58.b58encode(bytes(public_key)).decode('utf8')
+        """ The public key is only computed once because the service DID does not change. """
+        if is_server not in Encryption.PUBLIC_KEYS:
+            public_key = Encryption.__get_cipher(is_server).get_curve25519_public_key()
+            Encryption.PUBLIC_KEYS[is_server] = base58.b58encode(bytes(public_key)).decode('utf8')
+        return Encryption.PUBLIC_KEYS[is_server]
 
     @staticmethod
-    def encrypt_file_with_curve25519(src_full_path: Path, other_side_public_key: str, is_server: bool) -> Path:
+    def encrypt_file_with_curve25519(src_full_path: Path, other_side_public_key: str, is_server: bool, chunk_size: int = None) -> Path:
+        """ Encrypt the file with the curve25519 cipher stream.
+
+        The chunk size is written before the stream header with CURVE25519_MAGIC, so the other side can decrypt with it.
+        If the chunk size is TRUNK_SIZE, the legacy format (stream header + encrypted data) is used for the old nodes.
+
+        :param chunk_size: The size of the plain data of every chunk, default BACKUP_CURVE25519_CHUNK_SIZE.
+        """
+        chunk_size = chunk_size if chunk_size else hive_setting.BACKUP_CURVE25519_CHUNK_SIZE
         dst_full_path = Path(src_full_path.as_posix() + '.encryption.curve25519')
         stream = Encryption.__get_cipher(is_server, other_side_public_key).create_encryption_stream()
-        total_size = src_full_path.stat().st_size
-        remain = total_size
+        remain = src_full_path.stat().st_size
+
+        # the buffer is reused for every chunk and directly passed to the cipher stream without copying.
+        buffer = memoryview(bytearray(chunk_size))
 
         with open(src_full_path, 'rb') as sf:
-            with open(dst_full_path, 'wb') as df:  # header + encrypted data
-                df.write(bytes(stream.header()))
+            with open(dst_full_path, 'wb') as df:  # [magic + chunk size] + header + encrypted data
+                if chunk_size != Encryption.TRUNK_SIZE:
+                    df.write(Encryption.CURVE25519_MAGIC + struct.pack('>I', chunk_size))
+                df.write(stream.header())
                 while remain > 0:
-                    data = sf.read(min(remain, Encryption.TRUNK_SIZE))
-                    if not data:
+                    length = sf.readinto(buffer[:min(remain, chunk_size)])
+                    if not length:
                         break
 
-                    cipher_data = stream.push(data, remain - len(data) <= 0)
-                    df.write(bytes(cipher_data))
-
-                    remain -= len(data)
+                    remain -= length
+                    df.write(stream.push(buffer[:length], remain <= 0))
 
         return dst_full_path
 
     @staticmethod
     def decrypt_file_with_curve25519(src_full_path: Path, other_side_public_key: str, is_server: bool) -> Path:
+        """ Decrypt the file encrypted by encrypt_file_with_curve25519 with any chunk size or the legacy format. """
         dst_full_path = Path(src_full_path.as_posix() + '.decryption.curve25519')
         total_size = src_full_path.stat().st_size
-        remain = total_size
 
-        if remain <= CipherDecryptionStream.header_len():
+        if total_size <= CipherDecryptionStream.header_len():
             raise BadRequestException('Too short data for curve25519 decryption.')
 
         with open(src_full_path, 'rb') as sf:
+            prefix = sf.read(len(Encryption.CURVE25519_MAGIC) + 4)
+            if prefix.startswith(Encryption.CURVE25519_MAGIC) and len(prefix) == len(Encryption.CURVE25519_MAGIC) + 4:
+                chunk_size, = struct.unpack('>I', prefix[len(Encryption.CURVE25519_MAGIC):])
+            else:
+                chunk_size = Encryption.TRUNK_SIZE
+                sf.seek(0)
+
             header = sf.read(CipherDecryptionStream.header_len())
+            if len(header) < CipherDecryptionStream.header_len():
+                raise BadRequestException('Too short data for curve25519 decryption.')
             stream = Encryption.__get_cipher(is_server, other_side_public_key).create_decryption_stream(header)
 
+            buffer = memoryview(bytearray(chunk_size + CipherDecryptionStream.extra_encryption_size()))
             with open(dst_full_path, 'wb') as df:
-                while remain > 0:
-                    data = sf.read(min(remain, Encryption.TRUNK_SIZE + CipherDecryptionStream.extra_encryption_size()))
-                    if not data:
+                while True:
+                    length = sf.readinto(buffer)
+                    if not length:
                         break
 
-                    plain_data = stream.pull(data)
-                    df.write(bytes(plain_data))
-
-                    remain -= len(data)
+                    df.write(stream.pull(buffer[:length]))
 
         return dst_full_path
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+"""
+The file entries of the backup request metadata, which can be split into the encrypted shards for the large vault.
+"""
+import json
+import typing as t
+
+from src import hive_setting
+from src.modules.backup.encryption import Encryption
+from src.modules.files.ipfs_client import IpfsClient
+from src.modules.files.local_file import LocalFile
+from src.utils.throttle import Throttle
+
+MANIFEST_VERSION = '1.0'  # all file entries are in the 'files' of the request metadata.
+MANIFEST_VERSION_SHARDED = '2.0'  # the file entries are in the shards of the 'file_shards'.
+
+
+class ManifestShardWriter:
+    """ Write the file entries into the shards of BACKUP_MANIFEST_SHARD_SIZE entries.
+
+    Every shard is the JSON lines of the entries encrypted by the secret key of the backup
+    with the secret stream, and uploaded to the local IPFS node as one CID.
+    Only one shard is kept in memory while writing.
+    """
+
+    def __init__(self, encryption: Encryption, shard_size: int = None, throttle: Throttle = None):
+        self.encryption = encryption
+        self.shard_size = shard_size if shard_size else hive_setting.BACKUP_MANIFEST_SHARD_SIZE
+        self.throttle = throttle
+        self.ipfs_client = IpfsClient()
+        self.entries = list()
+        self.shards = list()
+        self.files_count, self.files_size = 0, 0
+
+    def add(self, entry: dict):
+        self.entries.append(entry)
+        self.files_count += 1
+        self.files_size += entry['size']
+        if len(self.entries) >= self.shard_size:
+            self.__write_shard()
+
+    def close(self) -> list:
+        """ Write the remain entries and return the shards: [{cid, sha256, size, count}] """
+        if self.entries:
+            self.__write_shard()
+        return self.shards
+
+    def __write_shard(self):
+        lines = (json.dumps(e).encode() + b'\n' for e in self.entries)
+        temp_file = LocalFile.generate_tmp_file_path()
+        try:
+            with temp_file.open('wb') as f:
+                for data in self.encryption.encrypt_stream(lines):
+                    f.write(data)
+            sha256, size = LocalFile.get_sha256(temp_file.as_posix()), temp_file.stat().st_size
+            cid = self.ipfs_client.upload_file(temp_file, throttle=self.throttle)
+        finally:
+            temp_file.unlink()
+        self.shards.append({'cid': cid, 'sha256': sha256, 'size': size, 'count': len(self.entries)})
+        self.entries = list()
+
+
+def is_sharded(request_metadata) -> bool:
+    return 'file_shards' in request_metadata
+
+
+def get_files_count(request_metadata) -> int:
+    if is_sharded(request_metadata):
+        return request_metadata['files_count']
+    return len(request_metadata['files'])
+
+
+def get_files_size(request_metadata) -> int:
+    if is_sharded(request_metadata):
+        return request_metadata['files_size']
+    return sum([f['size'] for f in request_metadata['files']])
+
+
+def iterate_file_batches(request_metadata, batch_size: int = None, throttle: Throttle = None) -> t.Iterator[t.List[dict]]:
+    """ Get the file entries batch by batch, the sharded ones are downloaded and decrypted one shard after another.
+
+    :param batch_size: Only for the entries in the request metadata, every shard is one batch.
+    """
+    if not is_sharded(request_metadata):
+        files = request_metadata['files']
+        batch_size = max(batch_size if batch_size else hive_setting.BACKUP_MANIFEST_SHARD_SIZE, 1)
+        for i in range(0, len(files), batch_size):
+            yield files[i:i + batch_size]
+        return
+
+    encryption = Encryption(request_metadata['encryption']['secret_key'], request_metadata['encryption']['nonce'])
+    ipfs_client = IpfsClient()
+    for shard in request_metadata['file_shards']:
+        chunks = ipfs_client.download_stream(shard['cid'], is_proxy=True, sha256=shard['sha256'], size=shard['size'], throttle=throttle)
+        yield list(_iterate_json_lines(encryption.decrypt_stream(chunks)))
+
+
+def iterate_files(request_metadata, throttle: Throttle = None) -> t.Iterator[dict]:
+    for files in iterate_file_batches(request_metadata, throttle=throttle):
+        yield from files
+
+
+def _iterate_json_lines(chunks: t.Iterable[bytes]) -> t.Iterator[dict]:
+    remain = b''
+    for data in chunks:
+        lines = (remain + data).split(b'\n')
+        remain = lines.pop()
+        for line in lines:
+            if line:
+                yield json.loads(line)
+    if remain:
+        yield json.loads(remain)
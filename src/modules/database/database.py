@@ -3,12 +3,11 @@
 """
 The entrance for database module.
 """
-import json
-from bson import json_util
-
 from flask import g
 
+from src.utils.bson_json import iter_json_items
 from src.utils.http_request import RequestData
+from src.utils.http_response import response_json_stream
 from src.modules.database.mongodb_client import MongodbClient
 from src.modules.subscription.vault import VaultManager
 
@@ -94,5 +93,5 @@ class Database:
 
     def __do_internal_find(self, collection_name, filter_, options):
         col = self.__get_collection(collection_name)
-        docs = col.find_many(filter_, **options)
-        return {"items": [c for c in json.loads(json_util.dumps(docs))]}
+        # the documents are encoded and sent batch by batch from the cursor.
+        return response_json_stream(iter_json_items(col.find_cursor(filter_, **options)))
@@ -1,5 +1,6 @@
 import hashlib
 import logging
+import time
 import typing
 from datetime import datetime
 
@@ -10,6 +11,7 @@ from pymongo.errors import CollectionInvalid
 from src import hive_setting
 from src.utils.consts import DID_INFO_DB_NAME
 from src.utils.http_exception import CollectionNotFoundException, AlreadyExistsException, BadRequestException
+from src.utils.metrics import MONGO_DURATION
 
 _T = typing.TypeVar('_T', dict, list, tuple)
 
@@ -55,6 +57,7 @@ class MongodbCollection:
         # management means internal collection which do not support extra features
         self.is_management = is_management
 
+    @MONGO_DURATION.time('insert_one')
     def insert_one(self, doc, contains_extra=True, **kwargs):
         if contains_extra:
             doc['created'] = doc['modified'] = int(datetime.now().timestamp())
@@ -71,6 +74,7 @@ class MongodbCollection:
             "inserted_id": str(result.inserted_id)  # ObjectId -> str
         }
 
+    @MONGO_DURATION.time('insert_many')
     def insert_many(self, docs, contains_extra=True, **kwargs):
         if contains_extra:
             for doc in docs:
@@ -91,6 +95,7 @@ class MongodbCollection:
     def update_one(self, filter_, update, contains_extra=True, **kwargs):
         return self.update_many(filter_, update, contains_extra=contains_extra, only_one=True, **kwargs)
 
+    @MONGO_DURATION.time('update')
     def update_many(self, filter_, update, contains_extra=True, only_one=False, **kwargs):
         if contains_extra:
             now_timestamp = int(datetime.now().timestamp())
@@ -122,6 +127,7 @@ class MongodbCollection:
             "upserted_id": str(result.upserted_id) if result.upserted_id else None
         }
 
+    @MONGO_DURATION.time('replace_one')
     def replace_one(self, filter_, document, upsert=True):
         # default 'bypass_document_validation': False
         result = self.col.replace_one(self.convert_oid(filter_) if filter_ else None, self.convert_oid(document), upsert=upsert)
@@ -138,10 +144,42 @@ class MongodbCollection:
         result = self.find_many(filter_, only_one=True, **kwargs)
         return result[0] if result else None
 
+    @MONGO_DURATION.time('find')
     def find_many(self, filter_: dict, only_one=False, **kwargs) -> list:
         """ Note: the result documents contain ObjectId or other types
                 which can not directly take as response body. """
 
+        # BUGBUG: Getting all documents out maybe not well.
+        if only_one:
+            result = self.col.find_one(self.convert_oid(filter_) if filter_ else None, **kwargs)
+            return [] if result is None else [result]
+
+        return list(self.col.find(self.convert_oid(filter_) if filter_ else None, **self.__get_find_options(kwargs)))
+
+    def find_cursor(self, filter_: dict, **kwargs) -> typing.Iterator[dict]:
+        """ Note: return the documents from the cursor, so they are fetched batch by batch when iterating.
+
+        The time of fetching the documents is observed as 'find' when the iteration finishes or is closed.
+        """
+        cursor = self.col.find(self.convert_oid(filter_) if filter_ else None, **self.__get_find_options(kwargs))
+
+        duration = 0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    doc = next(cursor)
+                except StopIteration:
+                    return
+                finally:
+                    duration += time.perf_counter() - start
+                yield doc
+        finally:
+            cursor.close()
+            MONGO_DURATION.observe(duration, 'find')
+
+    @staticmethod
+    def __get_find_options(kwargs: dict) -> dict:
         # kwargs are the options
         options = {k: v for k, v in kwargs.items() if k in ("projection",
                                                             "skip",
@@ -157,14 +195,9 @@ class MongodbCollection:
             if isinstance(options['sort'], dict):
                 # value example: {'author', -1} => [('author', -1)]
                 options['sort'] = [(k, v) for k, v in options['sort'].items()]
+        return options
 
-        # BUGBUG: Getting all documents out maybe not well.
-        if only_one:
-            result = self.col.find_one(self.convert_oid(filter_) if filter_ else None, **kwargs)
-            return [] if result is None else [result]
-
-        return list(self.col.find(self.convert_oid(filter_) if filter_ else None, **options))
-
+    @MONGO_DURATION.time('count')
     def count(self, filter_, **kwargs):
         options = {k: v for k, v in kwargs.items() if k in ("skip", "limit", "maxTimeMS")}
 
@@ -173,6 +206,7 @@ class MongodbCollection:
     def delete_one(self, filter_):
         return self.delete_many(filter_, only_one=True)
 
+    @MONGO_DURATION.time('delete')
     def delete_many(self, filter_, only_one=False):
         if only_one:
             result = self.col.delete_one(self.convert_oid(filter_) if filter_ else None)
@@ -183,9 +217,19 @@ class MongodbCollection:
             "deleted_count": result.deleted_count
         }
 
+    @MONGO_DURATION.time('distinct')
     def distinct(self, field: str) -> list:
         return self.col.distinct(field)
 
+    @MONGO_DURATION.time('aggregate')
+    def aggregate(self, pipeline: list, **kwargs):
+        """ Note: return the cursor, so the result documents are fetched batch by batch. """
+
+        # kwargs are the options
+        options = {k: v for k, v in kwargs.items() if k in ("allowDiskUse", "batchSize", "maxTimeMS")}
+
+        return self.col.aggregate(self.convert_oid(pipeline), **options)
+
     def convert_oid(self, value: _T):
         """ try to convert the following dict recursively.
 
@@ -307,6 +351,21 @@ class MongodbClient:
         if self.exists_database(name):
             self.__get_connection().drop_database(name)
 
+    def drop_database_collection(self, database_name, col_name):
+        self.__get_database(database_name).drop_collection(col_name)
+
+    def get_database_collection_hashes(self, name) -> typing.Optional[dict]:
+        """ Get the hash of every collection of the database which is used as the change marker.
+
+        refer to command: https://www.mongodb.com/docs/v4.4/reference/command/dbHash/
+        None means the command is not supported, such as on some Atlas clusters.
+        """
+        try:
+            return dict(self.__get_database(name).command('dbHash')['collections'])
+        except Exception as e:
+            logging.info(f'Failed to get the hashes of the collections of the database {name}: {e}')
+            return None
+
     def get_user_database_size(self, user_did, app_did) -> int:
         """ Get the size of the user database, if not exist, return 0 """
         name = self.get_user_database_name(user_did, app_did)
@@ -1,4 +1,6 @@
+import heapq
 import logging
+import typing as t
 
 from src.utils.consts import USR_DID, APP_DID, COL_IPFS_FILES_PATH, COL_IPFS_FILES, COL_IPFS_FILES_SHA256, COL_IPFS_FILES_IS_FILE, SIZE, \
     COL_IPFS_FILES_IPFS_CID, COL_IPFS_FILES_IS_ENCRYPT, COL_IPFS_FILES_ENCRYPT_METHOD
@@ -76,36 +78,49 @@ class FileMetadataManager:
         if result['deleted_count'] > 0 and cid:
             IpfsCidRef(cid).decrease()
 
-    def get_backup_file_metadatas(self, user_did):
-        """ get all cid infos from user's vault for backup
+    def iterate_backup_file_metadatas(self, user_did) -> t.Iterator[dict]:
+        """ Get all cid infos from user's vault for backup one by one:
 
-        The result shows the files content (cid) information.
+            {"cid": <cid>, "sha256": <sha256>, "size": <size>, "count": <files count>, "total_size": <total size of the files>}
+
+        The CIDs are grouped by the database of every application and sorted by the CID, then the cursors
+        of all applications are merged by the CID, so only one group of every application is in memory.
         """
+        cursors = [self.get_app_cid_metadatas(user_did, app_did) for app_did in self.user_manager.get_apps(user_did)]
 
-        app_dids, total_size, cids = self.user_manager.get_apps(user_did), 0, list()
-
-        def get_cid_metadata_from_list(cid_mts, file_mt):
-            if not cid_mts:
-                return None
-            for mt in cid_mts:
-                if mt['cid'] == file_mt[COL_IPFS_FILES_IPFS_CID]:
-                    if mt['sha256'] != file_mt[COL_IPFS_FILES_SHA256] or mt['size'] != int(file_mt[SIZE]):
-                        logging.error(f'Found an unexpected file {file_mt[COL_IPFS_FILES_PATH]} with same CID, '
-                                      f'but different sha256 or size.')
-                    return mt
-            return None
-
-        for app_did in app_dids:
-            metadatas = self.get_all_metadatas(user_did, app_did)
-            for doc in metadatas:
-                mt = get_cid_metadata_from_list(cids, doc)
+        mt = None
+        for group in heapq.merge(*cursors, key=lambda g: g['_id']):
+            cid, sha256s, sizes = group['_id'], group['sha256s'], list(set([int(s) for s in group['sizes']]))
+            if not mt or mt['cid'] != cid:
                 if mt:
-                    mt['count'] += 1
-                else:
-                    cids.append({'cid': doc[COL_IPFS_FILES_IPFS_CID],
-                                 'sha256': doc[COL_IPFS_FILES_SHA256],
-                                 'size': int(doc[SIZE]),
-                                 'count': 1})
-            total_size += sum([doc[SIZE] for doc in metadatas])
-
-        return total_size, cids
+                    yield mt
+                mt = {'cid': cid, 'sha256': sha256s[0], 'size': sizes[0], 'count': 0, 'total_size': 0}
+            if len(sha256s) > 1 or len(sizes) > 1 or mt['sha256'] != sha256s[0] or mt['size'] != sizes[0]:
+                logging.error(f'Found an unexpected file {group["path"]} with same CID {cid}, '
+                              f'but different sha256 {sha256s} or size {sizes}.')
+            mt['count'] += group['count']
+            mt['total_size'] += group['total_size']
+        if mt:
+            yield mt
+
+    def get_app_cid_metadatas(self, user_did, app_did):
+        """ Group the files of the application by the CID on the database side, the groups are returned as cursor:
+
+            {"_id": <cid>, "sha256s": [<sha256>], "sizes": [<size>], "count": <files count>,
+             "total_size": <total size of the files>, "path": <the path of one file>}
+
+        The CID with more than one sha256 or size means the inconsistent files. The groups are sorted by the CID.
+        """
+        pipeline = [
+            {'$match': {USR_DID: user_did, APP_DID: app_did}},
+            {'$group': {
+                '_id': f'${COL_IPFS_FILES_IPFS_CID}',
+                'sha256s': {'$addToSet': f'${COL_IPFS_FILES_SHA256}'},
+                'sizes': {'$addToSet': f'${SIZE}'},
+                'count': {'$sum': 1},
+                'total_size': {'$sum': f'${SIZE}'},
+                'path': {'$first': f'${COL_IPFS_FILES_PATH}'}
+            }},
+            {'$sort': {'_id': 1}}
+        ]
+        return self.__get_col(user_did, app_did).aggregate(pipeline, allowDiskUse=True)
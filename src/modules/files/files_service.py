@@ -15,6 +15,7 @@ from src.modules.files.local_file import LocalFile
 from src.utils.consts import COL_IPFS_FILES_PATH, COL_IPFS_FILES_SHA256, COL_IPFS_FILES_IS_FILE, SIZE, COL_IPFS_FILES_IPFS_CID, COL_IPFS_FILES_IS_ENCRYPT, \
     COL_IPFS_FILES_ENCRYPT_METHOD
 from src.utils.http_exception import FileNotFoundException, AlreadyExistsException
+from src.utils.metrics import CACHE_REQUESTS
 from src.modules.files.ipfs_cid_ref import IpfsCidRef
 from src.modules.subscription.vault import VaultManager
 
@@ -247,7 +248,10 @@ class IpfsFiles:
         metadata = self.get_file_metadata(user_did, app_did, path)
         cached_file = LocalFile.get_cid_cache_dir(user_did) / metadata[COL_IPFS_FILES_IPFS_CID]
         if not cached_file.exists():
+            CACHE_REQUESTS.inc('files', 'miss')
             self.ipfs_client.download_file(metadata[COL_IPFS_FILES_IPFS_CID], cached_file)
+        else:
+            CACHE_REQUESTS.inc('files', 'hit')
         return LocalFile.get_download_response(cached_file)
 
     def move_copy_file(self, user_did, app_did, src_path: str, dst_path: str, is_copy=False):
@@ -1,11 +1,16 @@
+import hashlib
 import json
 import logging
+import time
 import typing as t
+import uuid
 from pathlib import Path
 
 from src import hive_setting
 from src.utils.http_exception import BadRequestException
 from src.modules.files.local_file import LocalFile
+from src.utils.metrics import IPFS_DURATION, IPFS_BYTES
+from src.utils.throttle import Throttle, THROTTLE_DOWNLOAD, THROTTLE_UPLOAD
 
 
 def try_three_times(f: t.Callable[..., t.Any]) -> t.Callable[..., t.Any]:
@@ -21,6 +26,9 @@ def try_three_times(f: t.Callable[..., t.Any]) -> t.Callable[..., t.Any]:
 
 
 class IpfsClient:
+    STREAM_CHUNK_SIZE = 64 * 1024
+    CAR_TIMEOUT = 10 * 60
+
     def __init__(self):
         self._http = None
         self.ipfs_url = hive_setting.IPFS_NODE_URL
@@ -33,16 +41,26 @@ class IpfsClient:
             self._http = HttpClient()
         return self._http
 
-    def upload_file(self, file_path: Path):
+    @IPFS_DURATION.time('upload_file')
+    def upload_file(self, file_path: Path, throttle: Throttle = None):
+        IPFS_BYTES.inc('upload_file', 'out', value=file_path.stat().st_size)
+        if throttle:
+            with file_path.open('rb') as f:
+                chunks = throttle.iterate(THROTTLE_UPLOAD, iter(lambda: f.read(IpfsClient.STREAM_CHUNK_SIZE), b''))
+                r, _ = self.__post_stream(self.ipfs_url + '/api/v0/add', chunks, file_path.name)
+            return r.json()['Hash']
+
         files = {'file': open(file_path.as_posix(), 'rb')}
         json_data = self.http.post(self.ipfs_url + '/api/v0/add', None, None, is_json=False, files=files, success_code=200)
         return json_data['Hash']
 
     @try_three_times
-    def download_file(self, cid, file_path: Path, is_proxy=False, sha256=None, size=None):
+    @IPFS_DURATION.time('download_file')
+    def download_file(self, cid, file_path: Path, is_proxy=False, sha256=None, size=None, throttle: Throttle = None):
         url = self.ipfs_gateway_url if is_proxy else self.ipfs_url
-        response = self.http.post(f'{url}/api/v0/cat?arg={cid}', None, None, is_body=False, success_code=200)
-        LocalFile.write_file_by_response(response, file_path)
+        response = self.http.post(f'{url}/api/v0/cat?arg={cid}', None, None, is_body=False, success_code=200, stream=throttle is not None)
+        LocalFile.write_file_by_response(response, file_path, throttle=throttle)
+        IPFS_BYTES.inc('download_file', 'in', value=file_path.stat().st_size)
 
         if size is not None:
             cid_size = file_path.stat().st_size
@@ -54,6 +72,32 @@ class IpfsClient:
             if sha256 != cid_sha256:
                 return f'Failed to get file content with cid {cid}, sha256 {sha256, cid_sha256}'
 
+    def download_stream(self, cid, is_proxy=False, sha256=None, size=None, throttle: Throttle = None) -> t.Iterator[bytes]:
+        """ Get the content of the cid as chunks without any temporary file.
+
+        The size and sha256 are verified while the chunks are in flight, and the error raises at the end of the stream.
+        """
+        url = self.ipfs_gateway_url if is_proxy else self.ipfs_url
+        start = time.perf_counter()
+        response = self.http.post(f'{url}/api/v0/cat?arg={cid}', None, None, is_body=False, success_code=200, stream=True)
+        sha, cid_size = hashlib.sha256(), 0
+        try:
+            chunks = response.iter_content(chunk_size=IpfsClient.STREAM_CHUNK_SIZE)
+            for chunk in throttle.iterate(THROTTLE_DOWNLOAD, chunks) if throttle else chunks:
+                if chunk:
+                    sha.update(chunk)
+                    cid_size += len(chunk)
+                    yield chunk
+        finally:
+            response.close()
+            IPFS_DURATION.observe(time.perf_counter() - start, 'download_stream')
+            IPFS_BYTES.inc('download_stream', 'in', value=cid_size)
+
+        if size is not None and size != cid_size:
+            raise BadRequestException(f'Failed to get file content with cid {cid}, size {size, cid_size}')
+        if sha256 and sha256 != sha.hexdigest():
+            raise BadRequestException(f'Failed to get file content with cid {cid}, sha256 {sha256, sha.hexdigest()}')
+
     def download_file_json_content(self, cid, is_proxy=False, sha256=None, size=None) -> dict:
         temp_file = LocalFile.generate_tmp_file_path()
         msg = self.download_file(cid, temp_file, is_proxy=is_proxy, sha256=sha256, size=size)
@@ -65,41 +109,142 @@ class IpfsClient:
         temp_file.unlink()
         return metadata
 
-    def cid_pin(self, cid):
-        """ Pin file from ipfs proxy to the local node. """
+    def __post_stream(self, url, chunks: t.Iterable[bytes], name, timeout=None):
+        """ Post the content chunks to the local IPFS node as a chunked multipart body.
+
+        :return: the response of the local IPFS node and the size of the posted content.
+        """
+        boundary, counter = uuid.uuid4().hex, {'size': 0}
+
+        def multipart_body():
+            yield (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{name}"\r\n'
+                   f'Content-Type: application/octet-stream\r\n\r\n').encode()
+            for chunk in chunks:
+                if chunk:
+                    counter['size'] += len(chunk)
+                    yield chunk
+            yield f'\r\n--{boundary}--\r\n'.encode()
+
+        headers = {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+        r = self.http.post(url, None, multipart_body(), is_json=False, is_body=False, success_code=200, headers=headers, timeout=timeout)
+        return r, counter['size']
+
+    def __post_response_stream(self, url, response, name, direction, throttle: Throttle = None, timeout=None):
+        """ Post the content of the response to the local IPFS node, the response is closed at last. """
+        try:
+            chunks = response.iter_content(chunk_size=IpfsClient.STREAM_CHUNK_SIZE)
+            return self.__post_stream(url, throttle.iterate(direction, chunks) if throttle else chunks, name, timeout=timeout)
+        finally:
+            response.close()
+
+    @IPFS_DURATION.time('cid_pin')
+    def cid_pin(self, cid, throttle: Throttle = None):
+        """ Pin file from ipfs proxy to the local node.
+
+        The content is streamed from the proxy to the local node directly without any temporary file.
+        """
 
         # INFO: IPFS does not support that one node directly pin file from other node.
         logging.info(f'[IpfsClient.cid_pin] Try to pin {cid} to the local IPFS node.')
 
-        # download the file to local
-        temp_file = LocalFile.generate_tmp_file_path()
-        self.download_file(cid, temp_file, is_proxy=True)
+        response = self.http.post(f'{self.ipfs_gateway_url}/api/v0/cat?arg={cid}', None, None, is_body=False, success_code=200, stream=True)
+        r, size = self.__post_response_stream(self.ipfs_url + '/api/v0/add', response, cid, THROTTLE_DOWNLOAD, throttle=throttle)
 
-        logging.info(f'[IpfsClient.cid_pin] Download file OK.')
+        local_cid = r.json()['Hash']
+        if local_cid != cid:
+            logging.warning(f'[IpfsClient.cid_pin] The local cid {local_cid} is different from the source cid {cid}.')
 
-        # then upload the file to local IPFS node.
-        self.upload_file(temp_file)
+        logging.info(f'[IpfsClient.cid_pin] Pin file OK.')
+        IPFS_BYTES.inc('cid_pin', 'in', value=size)
+        return size
 
-        logging.info(f'[IpfsClient.cid_pin] Upload file OK.')
+    @IPFS_DURATION.time('make_directory')
+    def make_directory(self, cids: list) -> str:
+        """ Link all CIDs as the children of one directory on the local node and return the CID of the directory.
 
-        # clean the local file.
-        size = temp_file.stat().st_size
-        temp_file.unlink()
+        The content of the CIDs is not copied, and the directory is not pinned.
+        """
+        mfs_path = f'/hive-backup-{uuid.uuid4().hex}'
+        self.http.post(f'{self.ipfs_url}/api/v0/files/mkdir?arg={mfs_path}&parents=true', None, None, is_body=False, success_code=200)
+        try:
+            for cid in cids:
+                self.http.post(f'{self.ipfs_url}/api/v0/files/cp?arg=/ipfs/{cid}&arg={mfs_path}/{cid}', None, None, is_body=False, success_code=200)
+            return self.http.post(f'{self.ipfs_url}/api/v0/files/stat?arg={mfs_path}&hash=true', None, None, success_code=200)['Hash']
+        finally:
+            self.http.post(f'{self.ipfs_url}/api/v0/files/rm?arg={mfs_path}&recursive=true', None, None, is_body=False, success_code=200)
+
+    @IPFS_DURATION.time('car_export')
+    def car_export(self, root_cid, throttle: Throttle = None):
+        """ Export the DAG of the root CID as a CAR archive and add the archive to the local node.
+
+        :return: the CID and the size of the CAR archive.
+        """
+        response = self.http.post(f'{self.ipfs_url}/api/v0/dag/export?arg={root_cid}', None, None,
+                                  is_body=False, success_code=200, stream=True, timeout=IpfsClient.CAR_TIMEOUT)
+        r, size = self.__post_response_stream(self.ipfs_url + '/api/v0/add', response, f'{root_cid}.car', THROTTLE_UPLOAD,
+                                              throttle=throttle, timeout=IpfsClient.CAR_TIMEOUT)
+        IPFS_BYTES.inc('car_export', 'out', value=size)
+        return r.json()['Hash'], size
+
+    @IPFS_DURATION.time('car_import')
+    def car_import(self, car_cid, throttle: Throttle = None):
+        """ Import the CAR archive from ipfs proxy to the local node, the roots of the archive will be pinned.
+
+        :return: the size of the CAR archive.
+        """
+        logging.info(f'[IpfsClient.car_import] Try to import the CAR archive {car_cid} to the local IPFS node.')
+
+        response = self.http.post(f'{self.ipfs_gateway_url}/api/v0/cat?arg={car_cid}', None, None,
+                                  is_body=False, success_code=200, stream=True, timeout=IpfsClient.CAR_TIMEOUT)
+        r, size = self.__post_response_stream(self.ipfs_url + '/api/v0/dag/import?pin-roots=true', response, car_cid, THROTTLE_DOWNLOAD,
+                                              throttle=throttle, timeout=IpfsClient.CAR_TIMEOUT)
+
+        # the body is the json lines of the imported roots.
+        for line in r.text.splitlines():
+            root = json.loads(line).get('Root') if line.strip() else None
+            if root and root.get('PinErrorMsg'):
+                raise BadRequestException(f'Failed to pin the root {root["Cid"]["/"]} of the CAR archive {car_cid}: {root["PinErrorMsg"]}')
+
+        logging.info(f'[IpfsClient.car_import] Import the CAR archive OK.')
+        IPFS_BYTES.inc('car_import', 'in', value=size)
         return size
 
+    @IPFS_DURATION.time('cid_pinned')
+    def cid_pinned(self, cid):
+        """ Check whether the cid is already pinned on the local IPFS node. """
+        try:
+            self.http.post(f'{self.ipfs_url}/api/v0/pin/ls?arg=/ipfs/{cid}&type=recursive', None, None, is_body=False, success_code=200)
+            return True
+        except BadRequestException as e:
+            return False
+
+    @IPFS_DURATION.time('cids_not_pinned')
+    def cids_not_pinned(self, cids: list) -> list:
+        """ Check the pins of a batch of CIDs by one request, and return the ones which are not pinned.
+
+        The IPFS node fails the whole request if any cid is not pinned, then every cid is checked one by one.
+        """
+        if not cids:
+            return []
+        args = '&'.join([f'arg=/ipfs/{cid}' for cid in cids])
+        try:
+            self.http.post(f'{self.ipfs_url}/api/v0/pin/ls?{args}&type=recursive', None, None, is_body=False, success_code=200)
+            return []
+        except BadRequestException as e:
+            return [cid for cid in cids if not self.cid_pinned(cid)]
+
+    @IPFS_DURATION.time('cid_unpin')
     def cid_unpin(self, cid):
         logging.info(f'[IpfsClient.cid_unpin] Try to unpin {cid} in backup node.')
 
-        if not self.cid_exists(cid):
-            return
-
         try:
-            response = self.http.post(self.ipfs_url + f'/api/v0/pin/rm?arg=/ipfs/{cid}&recursive=true', None, None, is_body=False, success_code=200)
+            self.http.post(self.ipfs_url + f'/api/v0/pin/rm?arg=/ipfs/{cid}&recursive=true', None, None, is_body=False, success_code=200)
         except BadRequestException as e:
             # skip this error
             if 'not pinned or pinned indirectly' not in e.msg:
                 raise e
 
+    @IPFS_DURATION.time('cid_exists')
     def cid_exists(self, cid):
         try:
             response = self.http.post(f'{self.ipfs_url}/api/v0/cat?arg={cid}', None, None, is_body=False, success_code=200)
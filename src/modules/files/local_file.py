@@ -4,6 +4,7 @@ import platform
 import random
 import shutil
 import subprocess
+import tempfile
 import typing
 from datetime import datetime
 from pathlib import Path
@@ -14,6 +15,7 @@ from flask_rangerequest import RangeRequest
 from src import hive_setting
 from src.utils.http_exception import BadRequestException
 from src.utils.consts import CHUNK_SIZE
+from src.utils.throttle import Throttle, THROTTLE_DATABASE, THROTTLE_DOWNLOAD
 
 
 class LocalFile:
@@ -84,13 +86,14 @@ class LocalFile:
         LocalFile.__write_to_file(file_path, receiving_data, use_temp=use_temp)
 
     @staticmethod
-    def write_file_by_response(response, file_path: Path, use_temp=False):
+    def write_file_by_response(response, file_path: Path, use_temp=False, throttle: Throttle = None):
         """ used when download file by url """
 
         def receiving_data(path: Path):
             with open(path.as_posix(), 'bw') as f:
                 f.seek(0)
-                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                chunks = response.iter_content(chunk_size=CHUNK_SIZE)
+                for chunk in throttle.iterate(THROTTLE_DOWNLOAD, chunks) if throttle else chunks:
                     if chunk:
                         f.write(chunk)
 
@@ -123,25 +126,92 @@ class LocalFile:
                             size=size).make_response()
 
     @staticmethod
-    def dump_mongodb_to_full_path(db_name, full_path: Path):
-        try:
-            line2 = f'mongodump --uri="{hive_setting.MONGODB_URL}" -d {db_name} --archive="{full_path.as_posix()}"'
-            subprocess.check_output(line2, shell=True, stderr=subprocess.STDOUT)
-        except subprocess.CalledProcessError as e:
-            raise BadRequestException(f'Failed to dump database {db_name}: {e.output}')
+    def dump_mongodb_to_full_path(db_name, full_path: Path, is_gzip=False, exclude_collections: list = None, throttle: Throttle = None):
+        """ The archive is written by mongodump directly, or through the throttle if specified. """
+        args = ['mongodump', f'--uri={hive_setting.MONGODB_URL}', '-d', db_name]
+        if is_gzip:
+            args.append('--gzip')
+        if exclude_collections:
+            args.extend([f'--excludeCollection={c}' for c in exclude_collections])
+
+        if not throttle:
+            LocalFile.__run_mongodb_tool([*args, f'--archive={full_path.as_posix()}'], f'Failed to dump database {db_name}')
+            return
+
+        # mongodump writes the archive to the standard output when without the file path.
+        with full_path.open('wb') as f:
+            def on_process(p: subprocess.Popen):
+                for chunk in throttle.iterate(THROTTLE_DATABASE, iter(lambda: p.stdout.read(CHUNK_SIZE), b'')):
+                    f.write(chunk)
+            LocalFile.__run_mongodb_tool([*args, '--archive'], f'Failed to dump database {db_name}',
+                                         on_process=on_process, stdout=subprocess.PIPE)
 
     @staticmethod
-    def restore_mongodb_from_full_path(full_path: Path):
+    def restore_mongodb_from_full_path(full_path: Path, is_gzip=False, throttle: Throttle = None):
+        """ The archive is read by mongorestore directly, or through the throttle if specified. """
         if not full_path.exists():
             raise BadRequestException(f'Failed to import mongo db by invalid full dir {full_path.as_posix()}')
 
-        try:
-            # https://www.mongodb.com/docs/database-tools/mongorestore/#cmdoption--drop
-            # --drop: drop collections before restore, but does not drop collections that are not in the backup.
-            line2 = f'mongorestore --uri="{hive_setting.MONGODB_URL}" --drop --archive="{full_path.as_posix()}"'
-            subprocess.check_output(line2, shell=True, stderr=subprocess.STDOUT)
-        except subprocess.CalledProcessError as e:
-            raise BadRequestException(f'Failed to load database by {full_path.as_posix()}: {e.output}')
+        # https://www.mongodb.com/docs/database-tools/mongorestore/#cmdoption--drop
+        # --drop: drop collections before restore, but does not drop collections that are not in the backup.
+        args = ['mongorestore', f'--uri={hive_setting.MONGODB_URL}', '--drop']
+        if is_gzip:
+            args.append('--gzip')
+
+        if not throttle:
+            LocalFile.__run_mongodb_tool([*args, f'--archive={full_path.as_posix()}'], f'Failed to load database by {full_path.as_posix()}')
+            return
+
+        with full_path.open('rb') as f:
+            LocalFile.restore_mongodb_from_stream(iter(lambda: f.read(CHUNK_SIZE), b''), is_gzip=is_gzip, throttle=throttle)
+
+    @staticmethod
+    def restore_mongodb_from_stream(chunks: typing.Iterable[bytes], is_gzip=False, throttle: Throttle = None):
+        """ mongorestore reads the archive from the standard input when without the file path.
+
+        The error raised by the chunks stops mongorestore and fails the restoring.
+        """
+        args = ['mongorestore', f'--uri={hive_setting.MONGODB_URL}', '--drop', '--archive']
+        if is_gzip:
+            args.append('--gzip')
+
+        def on_process(p: subprocess.Popen):
+            try:
+                for chunk in throttle.iterate(THROTTLE_DATABASE, chunks) if throttle else chunks:
+                    p.stdin.write(chunk)
+            finally:
+                p.stdin.close()
+        LocalFile.__run_mongodb_tool(args, 'Failed to load database by the archive stream', on_process=on_process, stdin=subprocess.PIPE)
+
+    @staticmethod
+    def __run_mongodb_tool(args: list, error_msg, on_process: typing.Callable[[subprocess.Popen], None] = None, **kwargs):
+        """ Run the mongodb tool with the lowered CPU and IO priority when BACKUP_PROCESS_LOW_PRIORITY.
+
+        The output of the tool is kept in a temporary file to avoid blocking the process by the full pipe.
+        """
+        if hive_setting.BACKUP_PROCESS_LOW_PRIORITY and platform.system() != 'Windows':
+            # by the commands instead of preexec_fn which is not safe with the threads.
+            if shutil.which('nice'):
+                args = ['nice', '-n', '10', *args]
+            if shutil.which('ionice'):
+                # best-effort class with the lowest priority.
+                args = ['ionice', '-c', '2', '-n', '7', *args]
+
+        with tempfile.TemporaryFile() as output:
+            try:
+                p = subprocess.Popen(args, stderr=output, **kwargs)
+            except OSError as e:
+                raise BadRequestException(f'{error_msg}: {e}')
+            try:
+                if on_process:
+                    on_process(p)
+            except Exception as e:
+                p.kill()
+                p.wait()
+                raise e if isinstance(e, BadRequestException) else BadRequestException(f'{error_msg}: {e}')
+            if p.wait() != 0:
+                output.seek(0)
+                raise BadRequestException(f'{error_msg}: {output.read()}')
 
     @staticmethod
     def get_files_recursively(root_dir: Path):
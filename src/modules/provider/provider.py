@@ -5,11 +5,12 @@ The node management for the node owner.
 """
 import json
 import logging
+import re
 import typing as t
 from datetime import datetime
 
 import base58
-from flask import g
+from flask import g, Response
 
 from src import hive_setting
 from src.modules.backup.backup import BackupManager
@@ -18,7 +19,9 @@ from src.utils.did.did_wrapper import Credential
 from src.utils.consts import USR_DID, VAULT_SERVICE_DID, VAULT_SERVICE_PRICING_USING, \
     VAULT_SERVICE_MAX_STORAGE, VAULT_SERVICE_FILE_USE_STORAGE, VAULT_SERVICE_DB_USE_STORAGE, VAULT_BACKUP_SERVICE_USING, \
     VAULT_BACKUP_SERVICE_MAX_STORAGE, VAULT_BACKUP_SERVICE_USE_STORAGE
-from src.utils.http_exception import ForbiddenException, ReceiptNotFoundException
+from src.utils.http_exception import ForbiddenException, ReceiptNotFoundException, InvalidParameterException
+from src.utils.metrics import render_metrics
+from src.utils.profiler import profiler
 from src.modules.payment.order import OrderManager
 
 
@@ -87,6 +90,36 @@ class Provider:
             'orders': [o.to_get_receipts() for o in receipts]
         }
 
+    def get_metrics(self):
+        self.__check_auth_owner_id()
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+    def get_profiler(self):
+        self.__check_auth_owner_id()
+        return profiler.get_state()
+
+    def start_profiler(self, pattern: str, rate, max_samples: int, interval):
+        self.__check_auth_owner_id()
+        if pattern is not None and type(pattern) is not str:
+            raise InvalidParameterException('The pattern MUST be a string.')
+        if pattern:
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                raise InvalidParameterException(f'Invalid pattern: {e}')
+        if type(rate) not in (int, float) or not 0 < rate <= 1:
+            raise InvalidParameterException('The rate MUST be in (0, 1].')
+        if type(interval) not in (int, float) or not 0.001 <= interval <= 1:
+            raise InvalidParameterException('The interval MUST be in [0.001, 1] seconds.')
+        if type(max_samples) is not int or max_samples <= 0:
+            raise InvalidParameterException('The max_samples MUST be positive.')
+        profiler.start(pattern, rate, max_samples, interval)
+        return profiler.get_state()
+
+    def stop_profiler(self):
+        self.__check_auth_owner_id()
+        profiler.stop()
+
     def __check_auth_owner_id(self):
         if g.usr_did != self.owner_did:
             raise ForbiddenException('No permission for accessing node information.')
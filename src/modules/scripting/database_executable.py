@@ -1,7 +1,4 @@
-import json
-
-from bson import json_util
-
+from src.utils.bson_json import to_json_value
 from src.modules.scripting.executable import Executable, get_populated_value_with_params
 from src.modules.scripting.scripting import Script
 
@@ -44,8 +41,8 @@ class FindExecutable(DatabaseExecutable):
         items = col.find_many(filter_, **options)
         total = col.count(filter_)
 
-        # json decode&encode is used for ObjectId or other mongo data types.
-        return self.get_result_data({'total': total, 'items': json.loads(json_util.dumps(items))})
+        # convert ObjectId or other mongo data types.
+        return self.get_result_data({'total': total, 'items': to_json_value(items)})
 
 
 class CountExecutable(DatabaseExecutable):
@@ -275,8 +275,10 @@ class VaultManager:
 
         try:
             col = self.mcli.get_user_collection(user_did, app_did, COL_IPFS_FILES)
-            files = col.find_many({"user_did": user_did, "app_did": app_did})
-            # get total size of all user's application files
-            return int(sum(map(lambda o: o["size"], files)))
+            # get total size of all user's application files on the database side
+            pipeline = [{'$match': {"user_did": user_did, "app_did": app_did}},
+                        {'$group': {'_id': None, 'total_size': {'$sum': '$size'}}}]
+            result = list(col.aggregate(pipeline))
+            return int(result[0]['total_size']) if result else 0
         except CollectionNotFoundException as e:
             return 0
@@ -1,172 +1,351 @@
 from pathlib import Path
 from decouple import config, Config, RepositoryEnv
 import logging
+import signal
+import threading
 
 import os
 
 BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
 
 
+class setting:
+    """ The configure item which is evaluated once and kept in the snapshot of the settings.
+
+    It is not a data descriptor, so after evaluated, the value in the instance dict is got
+    by the attribute read directly.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.name = func.__name__
+        self.__doc__ = func.__doc__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = self.func(instance)
+        instance.__dict__[self.name] = value
+        return value
+
+
 class HiveSetting:
-    def __init__(self):
-        self.env_config = config
+    """ The snapshot of the configure items.
+
+    All items are evaluated by init_config() and read-only after that. reload() evaluates them
+    from the configure file again and replaces the snapshot at once, it is done on SIGHUP too.
+    The changes of the items which are used on startup (such as MONGODB_URL) need restart the node.
+    """
+
+    def __init__(self, env_config=config):
+        object.__setattr__(self, 'env_config', env_config)
+        object.__setattr__(self, 'hive_config', '/etc/hive/.env')
+
+    def __setattr__(self, key, value):
+        if isinstance(getattr(type(self), key, None), setting):
+            raise AttributeError(f'The configure item {key} is read-only.')
+        object.__setattr__(self, key, value)
 
     def init_config(self, hive_config='/etc/hive/.env'):
-        hive_config = os.environ.get('HIVE_CONFIG', hive_config)
-        config_file = Path(hive_config).resolve()
+        self.hive_config = os.environ.get('HIVE_CONFIG', hive_config)
+        self.reload()
+
+    def reload(self):
+        env_config = config
+        config_file = Path(self.hive_config).resolve()
         if config_file.exists():
-            self.env_config = Config(RepositoryEnv(config_file.as_posix()))
+            env_config = Config(RepositoryEnv(config_file.as_posix()))
             logging.info(f'User defined config file: {config_file.as_posix()}')
 
-    @property
-    def EID_RESOLVER_URL(self):
+        # evaluate all items on a new instance, then replace the current ones at once.
+        snapshot = HiveSetting(env_config)
+        values = {name: getattr(snapshot, name) for name in self.get_names()}
+        self.__dict__.update(values)
+        self.env_config = env_config
+
+    def register_reload_signal(self):
+        """ Reload the configure items by: kill -HUP <pid> """
+        if not hasattr(signal, 'SIGHUP') or threading.current_thread() is not threading.main_thread():
+            return
+
+        def on_sighup(signum, frame):
+            logging.info('Reload the configure items on SIGHUP.')
+            try:
+                self.reload()
+            except Exception as e:
+                logging.error(f'Failed to reload the configure items: {e}')
+
+        signal.signal(signal.SIGHUP, on_sighup)
+
+    @classmethod
+    def get_names(cls):
+        return [name for name, v in vars(cls).items() if isinstance(v, setting)]
+
+    @setting
+    def EID_RESOLVER_URL(self) -> str:
         return self.env_config('EID_RESOLVER_URL', default='https://api.elastos.io/eid', cast=str)
 
-    @property
-    def ESC_RESOLVER_URL(self):
+    @setting
+    def ESC_RESOLVER_URL(self) -> str:
         return self.env_config('ESC_RESOLVER_URL', default='https://api.elastos.io/eth', cast=str)
 
-    @property
-    def SERVICE_DID_PRIVATE_KEY(self):
+    @setting
+    def SERVICE_DID_PRIVATE_KEY(self) -> str:
         return self.env_config('SERVICE_DID_PRIVATE_KEY', default='', cast=str)
 
-    @property
-    def PASSPHRASE(self):
+    @setting
+    def PASSPHRASE(self) -> str:
         return self.env_config('PASSPHRASE', default='', cast=str)
 
-    @property
-    def PASSWORD(self):
+    @setting
+    def PASSWORD(self) -> str:
         return self.env_config('PASSWORD', default='password', cast=str)
 
-    @property
-    def NODE_CREDENTIAL(self):
+    @setting
+    def NODE_CREDENTIAL(self) -> str:
         return self.env_config('NODE_CREDENTIAL', default='', cast=str)
 
-    @property
-    def DATA_STORE_PATH(self):
+    @setting
+    def DATA_STORE_PATH(self) -> str:
         path = self.env_config('DATA_STORE_PATH', default='./data', cast=str)
         if path.startswith('/'):
             return path
         return os.path.join(BASE_DIR, path)
 
-    def get_temp_dir(self):
+    @setting
+    def TEMP_DIR(self) -> str:
         return self.DATA_STORE_PATH + '/.temp'
 
+    def get_temp_dir(self):
+        return self.TEMP_DIR
+
     def get_user_did_path(self, user_did) -> Path:
         """ get the path of the user did """
-        path = Path(self.VAULTS_BASE_DIR)
-
-        def did_tail_part(did):
-            return did.split(":")[2]
+        return self.VAULTS_BASE_PATH / user_did.split(":")[2]
 
-        return (path if path.is_absolute() else path.resolve()) / did_tail_part(user_did)
-
-    @property
-    def VAULTS_BASE_DIR(self):
+    @setting
+    def VAULTS_BASE_DIR(self) -> str:
         return self.DATA_STORE_PATH + '/vaults'
 
+    @setting
+    def VAULTS_BASE_PATH(self) -> Path:
+        path = Path(self.VAULTS_BASE_DIR)
+        return path if path.is_absolute() else path.resolve()
+
     def get_user_vault_path(self, user_did: str) -> Path:
         """ get the user's vault local path which contains cache files etc. """
-        return Path(self.VAULTS_BASE_DIR) / user_did.split(":")[2]
+        return self.VAULTS_BASE_PATH / user_did.split(":")[2]
 
-    @property
-    def BACKUP_VAULTS_BASE_DIR(self):
+    @setting
+    def BACKUP_VAULTS_BASE_DIR(self) -> str:
         return self.DATA_STORE_PATH + '/backup_vaults'
 
-    @property
-    def DID_DATA_BASE_DIR(self):
+    @setting
+    def DID_DATA_BASE_DIR(self) -> str:
         return self.DATA_STORE_PATH + '/did'
 
-    @property
-    def DID_DATA_LOCAL_DIDS(self):
+    @setting
+    def DID_DATA_LOCAL_DIDS(self) -> str:
         return self.DID_DATA_BASE_DIR + '/localdids'
 
-    @property
-    def DID_DATA_STORE_PATH(self):
+    @setting
+    def DID_DATA_STORE_PATH(self) -> str:
         return self.DID_DATA_BASE_DIR + '/store'
 
-    @property
-    def DID_DATA_CACHE_PATH(self):
+    @setting
+    def DID_DATA_CACHE_PATH(self) -> str:
         return self.DID_DATA_BASE_DIR + '/cache'
 
-    @property
-    def SENTRY_ENABLED(self):
+    @setting
+    def SENTRY_ENABLED(self) -> bool:
         return self.env_config('SENTRY_ENABLED', default='False', cast=bool)
 
-    @property
-    def SENTRY_DSN(self):
+    @setting
+    def SENTRY_DSN(self) -> str:
         return self.env_config('SENTRY_DSN', default='', cast=str)
 
-    @property
-    def PAYMENT_ENABLED(self):
+    @setting
+    def PAYMENT_ENABLED(self) -> bool:
         return self.env_config('PAYMENT_ENABLED', default='True', cast=bool)
 
-    @property
-    def PAYMENT_CONFIG_PATH(self):
+    @setting
+    def PAYMENT_CONFIG_PATH(self) -> str:
         path = self.env_config('PAYMENT_CONFIG_PATH', default='./payment_config.json', cast=str)
         if path.startswith('/'):
             return path
         return os.path.join(BASE_DIR, path)
 
-    @property
-    def PAYMENT_CONTRACT_ADDRESS(self):
+    @setting
+    def PAYMENT_CONTRACT_ADDRESS(self) -> str:
         return self.env_config('PAYMENT_CONTRACT_ADDRESS', default='', cast=str)
 
-    @property
-    def PAYMENT_RECEIVING_ADDRESS(self):
+    @setting
+    def PAYMENT_RECEIVING_ADDRESS(self) -> str:
         return self.env_config('PAYMENT_RECEIVING_ADDRESS', default='EN9YK69ScA6WFgVQW3UZcmSRLSCStaU2pQ', cast=str)
 
-    @property
-    def ATLAS_ENABLED(self):
+    @setting
+    def ATLAS_ENABLED(self) -> bool:
         return self.env_config('ATLAS_ENABLED', default='False', cast=bool)
 
-    @property
-    def MONGODB_URL(self):
+    @setting
+    def MONGODB_URL(self) -> str:
         return self.env_config('MONGODB_URL', default='mongodb://hive-mongo:27017', cast=str)
 
-    @property
-    def IPFS_NODE_URL(self):
+    @setting
+    def IPFS_NODE_URL(self) -> str:
         return self.env_config('IPFS_NODE_URL', default='http://hive-ipfs:5001', cast=str)
 
-    @property
-    def IPFS_GATEWAY_URL(self):
+    @setting
+    def IPFS_GATEWAY_URL(self) -> str:
         return self.env_config('IPFS_GATEWAY_URL', default='http://hive-ipfs:8080', cast=str)
 
-    @property
-    def ENABLE_CORS(self):
+    @setting
+    def ENABLE_CORS(self) -> bool:
         return self.env_config('ENABLE_CORS', default='True', cast=bool)
 
-    @property
-    def VERSION(self):
+    @setting
+    def VERSION(self) -> str:
         return self.env_config('VERSION', default='2.4.1', cast=str)
 
-    @property
-    def LAST_COMMIT(self):
+    @setting
+    def LAST_COMMIT(self) -> str:
         return self.env_config('LAST_COMMIT', default='1dcc9178c12efefc786bc653bacec50a1f79161b', cast=str)
 
-    @property
-    def NODE_NAME(self):
+    @setting
+    def NODE_NAME(self) -> str:
         return self.env_config('NODE_NAME', default='', cast=str)
 
-    @property
-    def NODE_EMAIL(self):
+    @setting
+    def NODE_EMAIL(self) -> str:
         return self.env_config('NODE_EMAIL', default='', cast=str)
 
-    @property
-    def NODE_DESCRIPTION(self):
+    @setting
+    def NODE_DESCRIPTION(self) -> str:
         return self.env_config('NODE_DESCRIPTION', default='', cast=str)
 
-    @property
-    def AUTH_CHALLENGE_EXPIRED(self):
+    @setting
+    def LOG_LEVELS(self) -> str:
+        return self.env_config('LOG_LEVELS', default='', cast=str)
+
+    @setting
+    def LOG_REQUEST_SAMPLE_RATE(self) -> float:
+        return self.env_config('LOG_REQUEST_SAMPLE_RATE', default=0.1, cast=float)
+
+    @setting
+    def LOG_SLOW_REQUEST(self) -> int:
+        return self.env_config('LOG_SLOW_REQUEST', default=1000, cast=int)
+
+    @setting
+    def MONGO_TRACE_ENABLED(self) -> bool:
+        return self.env_config('MONGO_TRACE_ENABLED', default='True', cast=bool)
+
+    @setting
+    def MONGO_TRACE_HEADER(self) -> bool:
+        return self.env_config('MONGO_TRACE_HEADER', default='False', cast=bool)
+
+    @setting
+    def AUTH_CHALLENGE_EXPIRED(self) -> int:
         return 3 * 60
 
-    @property
-    def ACCESS_TOKEN_EXPIRED(self):
+    @setting
+    def ACCESS_TOKEN_EXPIRED(self) -> int:
         return 7 * 24 * 60 * 60
 
-    @property
-    def BACKUP_IS_SYNC(self):
+    @setting
+    def VAULT_STORAGE_COUNT_WORKERS(self) -> int:
+        return self.env_config('VAULT_STORAGE_COUNT_WORKERS', default=4, cast=int)
+
+    @setting
+    def BACKUP_IS_SYNC(self) -> bool:
         return self.env_config('BACKUP_IS_SYNC', default='False', cast=bool)
 
+    @setting
+    def BACKUP_STATE_WAIT_MAX(self) -> int:
+        return self.env_config('BACKUP_STATE_WAIT_MAX', default=25, cast=int)
+
+    @setting
+    def BACKUP_PIN_WORKERS(self) -> int:
+        return self.env_config('BACKUP_PIN_WORKERS', default=8, cast=int)
+
+    @setting
+    def BACKUP_PIN_RETRY_TIMES(self) -> int:
+        return self.env_config('BACKUP_PIN_RETRY_TIMES', default=3, cast=int)
+
+    @setting
+    def BACKUP_DUMP_WORKERS(self) -> int:
+        return self.env_config('BACKUP_DUMP_WORKERS', default=2, cast=int)
+
+    @setting
+    def BACKUP_DUMP_GZIP(self) -> bool:
+        return self.env_config('BACKUP_DUMP_GZIP', default='True', cast=bool)
+
+    @setting
+    def BACKUP_RESTORE_WORKERS(self) -> int:
+        return self.env_config('BACKUP_RESTORE_WORKERS', default=2, cast=int)
+
+    @setting
+    def BACKUP_CURVE25519_CHUNK_SIZE(self) -> int:
+        return self.env_config('BACKUP_CURVE25519_CHUNK_SIZE', default=256 * 1024, cast=int)
+
+    @setting
+    def BACKUP_CAR_ENABLED(self) -> bool:
+        return self.env_config('BACKUP_CAR_ENABLED', default='False', cast=bool)
+
+    @setting
+    def BACKUP_CAR_MAX_SIZE(self) -> int:
+        return self.env_config('BACKUP_CAR_MAX_SIZE', default=512 * 1024 * 1024, cast=int)
+
+    @setting
+    def BACKUP_JOB_CONCURRENCY(self) -> int:
+        return self.env_config('BACKUP_JOB_CONCURRENCY', default=2, cast=int)
+
+    @setting
+    def BACKUP_RATE_LIMIT_DOWNLOAD(self) -> int:
+        return self.env_config('BACKUP_RATE_LIMIT_DOWNLOAD', default=0, cast=int)
+
+    @setting
+    def BACKUP_RATE_LIMIT_UPLOAD(self) -> int:
+        return self.env_config('BACKUP_RATE_LIMIT_UPLOAD', default=0, cast=int)
+
+    @setting
+    def BACKUP_RATE_LIMIT_DATABASE(self) -> int:
+        return self.env_config('BACKUP_RATE_LIMIT_DATABASE', default=0, cast=int)
+
+    @setting
+    def BACKUP_RATE_LIMIT_JOB(self) -> int:
+        return self.env_config('BACKUP_RATE_LIMIT_JOB', default=0, cast=int)
+
+    @setting
+    def BACKUP_PROCESS_LOW_PRIORITY(self) -> bool:
+        return self.env_config('BACKUP_PROCESS_LOW_PRIORITY', default='True', cast=bool)
+
+    @setting
+    def BACKUP_FULL_INTERVAL(self) -> int:
+        return self.env_config('BACKUP_FULL_INTERVAL', default=0, cast=int)
+
+    @setting
+    def BACKUP_MANIFEST_SHARD_SIZE(self) -> int:
+        return self.env_config('BACKUP_MANIFEST_SHARD_SIZE', default=10000, cast=int)
+
+    @setting
+    def BACKUP_SCRUB_INTERVAL(self) -> int:
+        return self.env_config('BACKUP_SCRUB_INTERVAL', default=24, cast=int)
+
+    @setting
+    def BACKUP_SCRUB_MAX_BACKUPS(self) -> int:
+        return self.env_config('BACKUP_SCRUB_MAX_BACKUPS', default=10, cast=int)
+
+    @setting
+    def BACKUP_SCRUB_BATCH_SIZE(self) -> int:
+        return self.env_config('BACKUP_SCRUB_BATCH_SIZE', default=50, cast=int)
+
+    @setting
+    def BACKUP_SCRUB_SAMPLE_RATE(self) -> float:
+        return self.env_config('BACKUP_SCRUB_SAMPLE_RATE', default=0.01, cast=float)
+
+    @setting
+    def BACKUP_SCRUB_RATE_LIMIT(self) -> int:
+        return self.env_config('BACKUP_SCRUB_RATE_LIMIT', default=1048576, cast=int)
+
 
 hive_setting = HiveSetting()
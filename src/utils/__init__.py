@@ -7,9 +7,12 @@ from datetime import datetime
 from sentry_sdk import capture_exception
 
 
-def hive_job(name, tag='scheduler'):
+def hive_job(name, tag='scheduler', exclusive=False, min_interval=0):
     """ A decorator for any jobs, tasks which normally run on thread
 
+    The exclusive job only runs in one process of the deployment by the lease lock in the management database,
+    the other processes skip it when it is running or finished in the min_interval seconds. Please check job_lock.py.
+
     example:
 
         @hive_job('sync_app_dids')
@@ -25,18 +28,46 @@ def hive_job(name, tag='scheduler'):
         def update_vault_databases_usage(user_did: str, full_url: str):  # executor task
             ...
 
+        @scheduler.task(trigger='interval', id='daily_routine_job', days=1)
+        @hive_job('count_vault_storage_job', exclusive=True, min_interval=12 * 3600)
+        def count_vault_storage_job():  # only run once a day in the deployment
+            ...
+
     """
 
     def job_decorator(f: typing.Callable[..., None]) -> typing.Callable[..., None]:
         def wrapper(*args, **kwargs):
+            lease, error = None, None
+            if exclusive or min_interval > 0:
+                from src.utils.job_lock import JobLease
+                try:
+                    lease = JobLease.acquire(name, min_interval)
+                except Exception as e:
+                    logging.getLogger(tag).error(f'{name}: failed to acquire the lease: {str(e)}')
+                    return
+                if not lease:
+                    logging.getLogger(tag).debug(f"{name} skipped, it is running or just finished by other process.")
+                    return
+
             logging.getLogger(tag).debug(f"{name} start: {str(datetime.now())}")
 
+            from src.utils.profiler import profiler
+            is_profiled = profiler.begin(f'job:{name}')
             try:
                 f(*args, **kwargs)
             except Exception as e:
+                error = str(e)
                 msg = f'{name}: {str(e)}, {traceback.format_exc()}'
                 logging.getLogger(tag).error(msg)
                 capture_exception(error=Exception(f'{tag} UNEXPECTED: {msg}'))
+            finally:
+                if is_profiled:
+                    profiler.end()
+                if lease:
+                    try:
+                        lease.release(error)
+                    except Exception as e:
+                        logging.getLogger(tag).error(f'{name}: failed to release the lease: {str(e)}')
 
             logging.getLogger(tag).debug(f"{name} end: {str(datetime.now())}")
         return wrapper
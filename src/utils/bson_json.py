@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+"""
+The fast encoder of the MongoDB documents to the relaxed extended JSON, the output is the same as json_util.dumps.
+
+json_util.dumps converts every value of the documents to a new SON by python before json.dumps,
+here the C encoder of json walks the documents and only calls back for the BSON types (ObjectId, datetime, etc.).
+The only difference is that the JavaScript code without the scope (Code is a subclass of str) is a plain string.
+"""
+import json
+import logging
+import typing as t
+from collections.abc import Mapping
+
+from bson import json_util
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def _default(obj):
+    if isinstance(obj, Mapping):
+        # RawBSONDocument, etc.
+        return dict(obj)
+    return json_util.default(obj)
+
+
+# NaN and Infinity are not allowed, so the float values are the same as json_util ones after falling back.
+_encoder = json.JSONEncoder(separators=(',', ':'), allow_nan=False, default=_default)
+
+
+def dumps(value) -> str:
+    """ Encode the documents or the values of them to the relaxed extended JSON. """
+    try:
+        return _encoder.encode(value)
+    except ValueError:
+        # the float of NaN or Infinity which is '{"$numberDouble": "NaN"}'.
+        return json_util.dumps(value, separators=(',', ':'))
+
+
+def to_json_value(value):
+    """ Convert the documents to the value which can be directly taken as the response body. """
+    return json.loads(dumps(value))
+
+
+def iter_json_items(documents: t.Iterable, name='items') -> t.Iterator[bytes]:
+    """ Encode the documents to the JSON object {name: [documents]} by the chunks in constant memory.
+
+    The first document is fetched here, which fetches the first batch of the cursor,
+    so the errors of the query are raised before the response starts and handled as the error response.
+    The later errors (getMore fails, the cursor times out) are raised from the chunks to abort the response,
+    then the client gets an unterminated body instead of a truncated JSON with the success status.
+    """
+    documents = iter(documents)
+    first = next(documents, None)
+
+    def generate():
+        if first is None:
+            yield f'{{"{name}":[]}}'.encode()
+            return
+
+        chunk, size = [f'{{"{name}":[', dumps(first)], 0
+        try:
+            for doc in documents:
+                data = dumps(doc)
+                chunk.append(',')
+                chunk.append(data)
+                size += len(data)
+                if size >= STREAM_CHUNK_SIZE:
+                    yield ''.join(chunk).encode()
+                    chunk, size = list(), 0
+        except Exception as e:
+            logging.getLogger('bson_json').error(f'Failed to get the documents after the response started: {e}')
+            raise
+        chunk.append(']}')
+        yield ''.join(chunk).encode()
+
+    return generate()
@@ -35,6 +35,8 @@ VAULT_SERVICE_STATE_RUNNING = "running"  # read and write
 VAULT_SERVICE_STATE_FREEZE = "freeze"  # read, but not write
 
 VAULT_SERVICE_LATEST_ACCESS_TIME = "latest_access_time"  # for access checking on database, files, scripting.
+VAULT_SERVICE_STORAGE_COUNT_TIME = "storage_count_time"  # the start time of the last recount of the storage usage.
+VAULT_SERVICE_STORAGE_DRIFT = "storage_drift"  # the difference between the recounted usage and the recorded one.
 # constants of db end
 
 # for backup server collection
@@ -156,6 +158,9 @@ COL_IPFS_CID_REF = 'ipfs_cid_ref'
 
 COL_IPFS_BACKUP_CLIENT = 'ipfs_backup_client'
 COL_IPFS_BACKUP_SERVER = 'ipfs_backup_server'
+COL_BACKUP_JOBS = 'backup_jobs'
+COL_BACKUP_CHECKPOINT_ITEMS = 'backup_checkpoint_items'
+COL_HIVE_JOBS = 'hive_jobs'
 
 BACKUP_TARGET_TYPE = 'type'
 BACKUP_TARGET_TYPE_HIVE_NODE = 'hive_node'
@@ -175,6 +180,10 @@ BACKUP_REQUEST_STATE_MSG = 'state_msg'
 BACKUP_REQUEST_TARGET_HOST = 'target_host'
 BACKUP_REQUEST_TARGET_DID = 'target_did'
 BACKUP_REQUEST_TARGET_TOKEN = 'target_token'
+BACKUP_REQUEST_DATABASE_TIMINGS = 'database_timings'
+BACKUP_REQUEST_LAST_BACKUP = 'last_backup'
+BACKUP_REQUEST_CHECKPOINT = 'checkpoint'
+BACKUP_REQUEST_THROUGHPUT = 'throughput'
 
 # For backup subscription.
 BKSERVER_REQ_ACTION = 'req_action'
@@ -184,6 +193,10 @@ BKSERVER_REQ_CID = 'req_cid'
 BKSERVER_REQ_SHA256 = 'req_sha256'
 BKSERVER_REQ_SIZE = 'req_size'
 BKSERVER_REQ_PUBLIC_KEY = 'public_key'
+BKSERVER_REQ_CHAIN = 'req_chain'
+BKSERVER_REQ_CHECKPOINT = 'req_checkpoint'
+BKSERVER_REQ_THROUGHPUT = 'req_throughput'
+BKSERVER_REQ_SCRUB = 'req_scrub'
 
 # @deprecated
 URL_BACKUP_SERVICE = '/api/v2/internal_backup/service'
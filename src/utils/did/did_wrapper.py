@@ -393,6 +393,8 @@ class Cipher:
 class CipherEncryptionStream:
     def __init__(self, stream):
         self.stream = stream
+        # reused by every push
+        self.length = ffi.new("unsigned int *")
 
     def header(self):
         length = ffi.new("unsigned int *")
@@ -403,17 +405,19 @@ class CipherEncryptionStream:
         return ffi.buffer(header, length[0])
 
     def push(self, data, is_final):
-        length = ffi.new("unsigned int *")
-        cipher_data = lib.Cipher_EncryptionStream_Push(self.stream, ffi.from_buffer(data), len(data), is_final, length)
+        """ :param data: bytes or any buffer object, such as the memoryview of a preallocated bytearray. """
+        cipher_data = lib.Cipher_EncryptionStream_Push(self.stream, ffi.from_buffer(data), len(data), is_final, self.length)
         if not cipher_data:
             raise ElaDIDException(ElaError.get_from_method('Can not push the data.'))
 
-        return ffi.buffer(ffi.gc(cipher_data, lib.DID_FreeMemory), length[0])
+        return ffi.buffer(ffi.gc(cipher_data, lib.DID_FreeMemory), self.length[0])
 
 
 class CipherDecryptionStream:
     def __init__(self, stream):
         self.stream = stream
+        # reused by every pull
+        self.length = ffi.new("unsigned int *")
 
     @staticmethod
     def header_len():
@@ -424,12 +428,12 @@ class CipherDecryptionStream:
         return lib.Cipher_DecryptionStream_GetExtraEncryptSize()
 
     def pull(self, data):
-        length = ffi.new("unsigned int *")
-        clear_data = lib.Cipher_DecryptionStream_Pull(self.stream, ffi.from_buffer(data), len(data), length)
+        """ :param data: bytes or any buffer object, such as the memoryview of a preallocated bytearray. """
+        clear_data = lib.Cipher_DecryptionStream_Pull(self.stream, ffi.from_buffer(data), len(data), self.length)
         if not clear_data:
             raise ElaDIDException(ElaError.get_from_method('Can not decrypt the data.'))
 
-        return ffi.buffer(ffi.gc(clear_data, lib.DID_FreeMemory), length[0])
+        return ffi.buffer(ffi.gc(clear_data, lib.DID_FreeMemory), self.length[0])
 
     def is_complete(self):
         return lib.Cipher_DecryptionStream_IsComplete(self.stream)
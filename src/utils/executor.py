@@ -10,6 +10,7 @@ from src.modules.backup.backup_server import BackupServer
 from src.modules.subscription.vault import VaultManager
 from src.utils import hive_job
 from src.utils.scheduler import count_vault_storage_really
+from src.utils.metrics import Gauge
 from src.utils.consts import VAULT_SERVICE_COL, VAULT_SERVICE_DID, HIVE_MODE_TEST
 
 executor = Executor()
@@ -17,6 +18,16 @@ executor = Executor()
 pool = ThreadPoolExecutor(1)
 
 
+def get_executor_queue_depth() -> dict:
+    depths = {('boot', ): pool._work_queue.qsize()}
+    if getattr(executor, '_self', None):
+        depths[('tasks', )] = executor._self._work_queue.qsize()
+    return depths
+
+
+Gauge('hive_executor_queue_depth', 'The tasks waiting in the queues of the executors.', ('executor', ), callback=get_executor_queue_depth)
+
+
 @executor.job
 @hive_job('update_vault_databases_usage', 'executor')
 def update_vault_databases_usage_task(user_did: str, full_url: str):
@@ -56,19 +67,21 @@ def update_vault_databases_usage_task(user_did: str, full_url: str):
         logging.getLogger('AFTER REQUEST').info(f'Succeeded to update_vault_databases_usage({user_did}), {full_url}')
 
 
-@hive_job('retry_backup_when_reboot', 'executor')
+@hive_job('retry_backup_when_reboot', 'executor', exclusive=True)
 def retry_backup_when_reboot_task():
     """ retry maybe because interrupt by reboot
 
     1. handle all backup request in the vault node.
     2. handle all backup request in the backup node.
+
+    No min_interval: the node restarted shortly after the last boot (crash loop) must still resume the backups.
     """
     client, server = BackupClient(), BackupServer()
     client.retry_backup_request()
     server.retry_backup_request()
 
 
-@hive_job('sync_app_dids', tag='executor')
+@hive_job('sync_app_dids', tag='executor', exclusive=True, min_interval=10 * 60)
 def sync_app_dids_task():
     """ Used for syncing exist user_did's app_dids to the 'application' collection
 
@@ -88,19 +101,23 @@ def sync_app_dids_task():
             user_manager.add_app_if_not_exists(user_did, app_did)
 
 
-@hive_job('count_vault_storage_executor', tag='executor')
+@hive_job('count_vault_storage_executor', tag='executor', exclusive=True, min_interval=10 * 60)
 def count_vault_storage_task():
     count_vault_storage_really()
 
 
-def init_executor(app, mode):
-    """ executor for executing thread tasks """
+def init_executor(app, mode, is_leader=True):
+    """ executor for executing thread tasks
+
+    :param is_leader: only the scheduler leader runs the boot tasks.
+    """
     executor.init_app(app)
 
     if mode != HIVE_MODE_TEST:
         app.config['EXECUTOR_TYPE'] = 'thread'
         app.config['EXECUTOR_MAX_WORKERS'] = 5
 
+    if mode != HIVE_MODE_TEST and is_leader:
         pool.submit(retry_backup_when_reboot_task)
         pool.submit(sync_app_dids_task)
         pool.submit(count_vault_storage_task)
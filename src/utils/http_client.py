@@ -4,12 +4,15 @@
 Http client for backup or other modules.
 """
 import pickle
+import time
 from pathlib import Path
+from urllib.parse import urlparse
 
 import requests
 
 from src.modules.files.local_file import LocalFile
 from src.utils.http_exception import BadRequestException, HiveException
+from src.utils.metrics import HTTP_CLIENT_DURATION
 
 
 class HttpClient:
@@ -27,13 +30,22 @@ class HttpClient:
             raise BadRequestException(f'[HttpClient] Failed to {r.request.method}, ({r.request.url}) '
                                           f'with status code: {r.status_code}, {msg}')
 
+    def __request(self, method, url, **kwargs):
+        start, status = time.perf_counter(), 'error'
+        try:
+            r = requests.request(method, url, **kwargs)
+            status = r.status_code
+            return r
+        finally:
+            HTTP_CLIENT_DURATION.observe(time.perf_counter() - start, method, urlparse(url).netloc, status)
+
     def __raise_http_exception(self, url, method, e):
         raise BadRequestException(f'[HttpClient] Failed to {method}, ({url}) with exception: {str(e)}')
 
-    def get(self, url, access_token, is_body=True, **kwargs):
+    def get(self, url, access_token, is_body=True, timeout=None, **kwargs):
         try:
             headers = {"Content-Type": "application/json", "Authorization": "token " + access_token}
-            r = requests.get(url, headers=headers, timeout=self.timeout, **kwargs)
+            r = self.__request('GET', url, headers=headers, timeout=timeout if timeout is not None else self.timeout, **kwargs)
             self.__check_status_code(r, 200)
             return r.json() if is_body else r
         except HiveException as e:
@@ -45,9 +57,9 @@ class HttpClient:
         r = self.get(url, access_token, is_body=False, stream=True)
         LocalFile.write_file_by_response(r, file_path, use_temp=True)
 
-    def post(self, url, access_token, body, is_json=True, is_body=True, success_code=201, timeout=None, **kwargs):
+    def post(self, url, access_token, body, is_json=True, is_body=True, success_code=201, timeout=None, headers=None, **kwargs):
         try:
-            headers = dict()
+            headers = dict(headers) if headers else dict()
             if access_token:
                 headers["Authorization"] = "token " + access_token
             if is_json:
@@ -55,8 +67,8 @@ class HttpClient:
 
             timeout_ = timeout if timeout is not None else self.timeout
 
-            r = requests.post(url, headers=headers, json=body, timeout=timeout_, **kwargs) \
-                if is_json else requests.post(url, headers=headers, data=body, timeout=self.timeout, **kwargs)
+            r = self.__request('POST', url, headers=headers, json=body, timeout=timeout_, **kwargs) \
+                if is_json else self.__request('POST', url, headers=headers, data=body, timeout=timeout_, **kwargs)
             self.__check_status_code(r, success_code)
             return r.json() if is_body else r
         except HiveException as e:
@@ -75,7 +87,7 @@ class HttpClient:
     def put(self, url, access_token, body, is_body=False):
         try:
             headers = {"Authorization": "token " + access_token}
-            r = requests.put(url, headers=headers, data=body, timeout=self.timeout)
+            r = self.__request('PUT', url, headers=headers, data=body, timeout=self.timeout)
             self.__check_status_code(r, 200)
             return r.json() if is_body else r
         except HiveException as e:
@@ -90,7 +102,7 @@ class HttpClient:
     def delete(self, url, access_token):
         try:
             headers = {"Authorization": "token " + access_token}
-            r = requests.delete(url, headers=headers, timeout=self.timeout)
+            r = self.__request('DELETE', url, headers=headers, timeout=self.timeout)
             self.__check_status_code(r, 204)
         except HiveException as e:
             raise e
@@ -8,7 +8,7 @@ import logging
 import typing as t
 
 from werkzeug.exceptions import HTTPException
-from flask import request, make_response, jsonify
+from flask import request, make_response, jsonify, Response, stream_with_context
 from flask_restful import Api
 from sentry_sdk import capture_exception
 
@@ -64,3 +64,11 @@ def response_stream(f: t.Callable[..., t.Any]) -> t.Callable[..., t.Any]:
         response.headers['content-type'] = 'application/octet-stream'
         return response
     return wrapper
+
+
+def response_json_stream(chunks: t.Iterable[bytes]) -> Response:
+    """ The success response with the JSON body of the chunks, such as the documents from the cursor.
+
+    The chunks are generated in the request context, which is torn down when the response is closed.
+    """
+    return Response(stream_with_context(chunks), status=HiveApi._get_resp_success_code(), mimetype='application/json')
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+"""
+The lease lock of the jobs to make sure one job only runs in one process of the whole deployment.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import typing as t
+import uuid
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from src.modules.database.mongodb_client import MongodbClient
+from src.utils.consts import COL_HIVE_JOBS
+
+JOB_STATE_RUNNING = 'running'
+JOB_STATE_SUCCESS = 'success'
+JOB_STATE_FAILED = 'failed'
+
+_local = threading.local()
+
+
+class JobLease:
+    """ The lease of the job which is kept in the management collection, one document for every job:
+
+        {
+            "_id": <job name>,
+            "state": "running" | "success" | "failed",
+            "owner": <host:pid of the process which holds the lease>,
+            "token": <fencing token, increased by every acquisition>,
+            "lease_until": <timestamp>,
+            "started_at": <timestamp>, "finished_at": <timestamp>, "duration": <seconds>,
+            "last_success_at": <timestamp>,
+            "error": <error message of the last run>
+        }
+
+    The holder renews the lease by the heartbeat, the lease which is not renewed in LEASE_TIMEOUT
+    can be taken by other processes. All writes of the holder are fenced by the token,
+    so the holder which lost the lease can not overwrite the new one.
+    """
+
+    LEASE_TIMEOUT = 60  # seconds
+    HEARTBEAT_INTERVAL = 20
+
+    OWNER = f'{socket.gethostname()}:{os.getpid()}'
+
+    def __init__(self, name, token, started_at):
+        self.name = name
+        self.token = token
+        self.started_at = started_at
+        self.is_lost = False
+        self.stopped = threading.Event()
+        self.heartbeat_thread = threading.Thread(target=self.__heartbeat, daemon=True)
+
+    @staticmethod
+    def acquire(name, min_interval=0) -> t.Optional['JobLease']:
+        """ Get the lease of the job, return None if other process is running the job
+        or the job finished in the min_interval seconds. """
+        now = time.time()
+        filter_ = {'_id': name,
+                   '$and': [{'$or': [{'state': {'$ne': JOB_STATE_RUNNING}}, {'lease_until': {'$lt': now}}]},
+                            {'$or': [{'last_success_at': {'$exists': False}}, {'last_success_at': {'$lt': now - min_interval}}]}]}
+        update = {'$set': {'state': JOB_STATE_RUNNING, 'owner': f'{JobLease.OWNER}:{uuid.uuid4().hex[:8]}',
+                           'lease_until': now + JobLease.LEASE_TIMEOUT, 'started_at': now, 'error': None},
+                  '$inc': {'token': 1}}
+        try:
+            doc = JobLease.__get_collection().col.find_one_and_update(filter_, update, upsert=True, return_document=ReturnDocument.AFTER)
+        except DuplicateKeyError:
+            # the filter does not match the existing document.
+            return None
+
+        lease = JobLease(name, doc['token'], now)
+        lease.heartbeat_thread.start()
+        _local.lease = lease
+        return lease
+
+    def is_valid(self):
+        return not self.is_lost and not self.stopped.is_set()
+
+    def release(self, error: str = None):
+        self.stopped.set()
+        _local.lease = None
+
+        now = time.time()
+        update = {'state': JOB_STATE_FAILED if error else JOB_STATE_SUCCESS, 'lease_until': 0, 'finished_at': now,
+                  'duration': round(now - self.started_at, 3), 'error': error}
+        if not error:
+            update['last_success_at'] = now
+        if not self.__update(update):
+            logging.error(f'[JobLease] The lease of the job {self.name} is taken by other process before finished.')
+
+    def __heartbeat(self):
+        while not self.stopped.wait(JobLease.HEARTBEAT_INTERVAL):
+            try:
+                if not self.__update({'lease_until': time.time() + JobLease.LEASE_TIMEOUT}):
+                    self.is_lost = True
+                    logging.error(f'[JobLease] Lost the lease of the job {self.name}.')
+                    return
+            except Exception as e:
+                logging.error(f'[JobLease] Failed to renew the lease of the job {self.name}: {e}')
+
+    def __update(self, update: dict) -> bool:
+        result = JobLease.__get_collection().update_one({'_id': self.name, 'token': self.token}, {'$set': update}, contains_extra=False)
+        return result['matched_count'] == 1
+
+    @staticmethod
+    def __get_collection():
+        return MongodbClient().get_management_collection(COL_HIVE_JOBS)
+
+
+def get_job_lease() -> t.Optional[JobLease]:
+    """ The lease of the exclusive job which is running on the current thread, the long job can check it before writing. """
+    return getattr(_local, 'lease', None)
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+"""
+The logging pipeline which moves the formatting and the writing of the records out of the request threads.
+
+The handlers configured by config/logging.conf are attached to the queue listeners, and the loggers
+only put the records to the queues. The listener threads write the records to the console and the files.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+_local = threading.local()
+_listeners = list()
+
+
+class TimedQueueHandler(QueueHandler):
+    """ Put the record into the queue and count the time spent on the current thread. """
+
+    def emit(self, record):
+        start = time.perf_counter()
+        super().emit(record)
+        _local.log_time = getattr(_local, 'log_time', 0) + time.perf_counter() - start
+
+
+def reset_log_time():
+    _local.log_time = 0
+
+
+def get_log_time() -> float:
+    """ The seconds spent on putting the records on the current thread since the last reset. """
+    return getattr(_local, 'log_time', 0)
+
+
+def init_log_queue():
+    """ Replace the handlers of the configured loggers by the queue handlers.
+
+    The loggers with the same handlers share one queue and one listener thread.
+    """
+    stop_log_queue()
+
+    loggers = [logging.getLogger()] + [v for v in logging.Logger.manager.loggerDict.values() if isinstance(v, logging.Logger)]
+    queue_handlers = dict()
+    for logger in loggers:
+        handlers = [h for h in logger.handlers if not isinstance(h, QueueHandler)]
+        if not handlers:
+            continue
+
+        key = tuple(handlers)
+        if key not in queue_handlers:
+            q = queue.Queue(-1)
+            listener = QueueListener(q, *handlers, respect_handler_level=True)
+            listener.start()
+            _listeners.append(listener)
+            queue_handlers[key] = TimedQueueHandler(q)
+
+        for h in handlers:
+            logger.removeHandler(h)
+        logger.addHandler(queue_handlers[key])
+
+
+def stop_log_queue():
+    """ Write the remain records and stop the listener threads. """
+    while _listeners:
+        _listeners.pop().stop()
+
+
+def set_log_levels(levels: str):
+    """ Set the levels of the loggers, such as: 'root=INFO,AFTER REQUEST=WARNING,urllib3=WARNING' """
+    for item in levels.split(','):
+        if '=' not in item:
+            continue
+        name, level = [v.strip() for v in item.split('=', 1)]
+        logger = logging.getLogger() if name == 'root' else logging.getLogger(name)
+        try:
+            logger.setLevel(level.upper())
+        except ValueError:
+            logging.getLogger('log_queue').error(f'Invalid log level of the logger {name}: {level}')
+
+
+atexit.register(stop_log_queue)
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+"""
+The metrics of the hive node which are exported in the Prometheus text format by the owner.
+
+The metrics are kept in the memory of the process and every worker process has its own ones,
+so all samples contain the label 'pid'. Every record is only a bisect and a locked add.
+"""
+import bisect
+import functools
+import os
+import threading
+import time
+import typing as t
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_metrics = list()
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = None) -> str:
+    items = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + [f'pid="{os.getpid()}"']
+    if extra:
+        items.append(extra)
+    return '{' + ','.join(items) + '}'
+
+
+class Counter:
+    def __init__(self, name, help_, labels: tuple = ()):
+        self.name, self.help, self.labels = name, help_, labels
+        self.values = dict()
+        self.lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, *label_values, value=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + value
+
+    def render(self) -> t.List[str]:
+        with self.lock:
+            values = list(self.values.items())
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter'] + \
+               [f'{self.name}{_format_labels(self.labels, k)} {v}' for k, v in values]
+
+
+class Histogram:
+    def __init__(self, name, help_, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name, self.help, self.labels = name, help_, labels
+        self.buckets = tuple(buckets)
+        self.values = dict()  # label values: [counts of every bucket and +Inf, sum]
+        self.lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            item = self.values.get(label_values)
+            if item is None:
+                item = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0]
+            item[0][index] += 1
+            item[1] += value
+
+    def time(self, *label_values):
+        """ The decorator to observe the duration of the function. """
+        def decorator(f):
+            @functools.wraps(f)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - start, *label_values)
+            return wrapper
+        return decorator
+
+    def render(self) -> t.List[str]:
+        with self.lock:
+            values = [(k, list(v[0]), v[1]) for k, v in self.values.items()]
+
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for k, counts, sum_ in values:
+            total = 0
+            for bucket, count in zip(self.buckets + ('+Inf', ), counts):
+                total += count
+                le = 'le="' + str(bucket) + '"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, k, le)} {total}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, k)} {sum_}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, k)} {total}')
+        return lines
+
+
+class Gauge:
+    """ The gauge which values are got by the callback when exporting: {label values: value} """
+
+    def __init__(self, name, help_, labels: tuple = (), callback: t.Callable[[], dict] = None):
+        self.name, self.help, self.labels = name, help_, labels
+        self.callback = callback
+        _metrics.append(self)
+
+    def render(self) -> t.List[str]:
+        values = self.callback() if self.callback else dict()
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge'] + \
+               [f'{self.name}{_format_labels(self.labels, k)} {v}' for k, v in values.items()]
+
+
+def render_metrics() -> str:
+    lines = list()
+    for metric in _metrics:
+        try:
+            lines.extend(metric.render())
+        except Exception as e:
+            lines.append(f'# {metric.name}: failed to render: {_escape(e)}')
+    return '\n'.join(lines) + '\n'
+
+
+REQUEST_DURATION = Histogram('hive_http_request_duration_seconds', 'The duration of the requests to the hive node.',
+                             ('endpoint', 'method', 'status'))
+MONGO_DURATION = Histogram('hive_mongo_operation_duration_seconds', 'The duration of the MongoDB operations.', ('operation', ))
+IPFS_DURATION = Histogram('hive_ipfs_operation_duration_seconds', 'The duration of the IPFS operations.', ('operation', ))
+IPFS_BYTES = Counter('hive_ipfs_bytes_total', 'The bytes transferred with the IPFS nodes.', ('operation', 'direction'))
+HTTP_CLIENT_DURATION = Histogram('hive_http_client_duration_seconds', 'The duration of the requests from the hive node, '
+                                 'until the response headers for the streaming ones.', ('method', 'host', 'status'))
+CACHE_REQUESTS = Counter('hive_cache_requests_total', 'The lookups of the caches.', ('cache', 'result'))
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+"""
+The tracer of the MongoDB commands which attributes every command to the request on the current thread.
+
+The listener is registered globally before any MongoClient is created, so the commands of v1 and v2 are traced.
+The commands are counted by the endpoint on the metrics, and the summary of every request is logged
+or added to the response header 'X-Hive-Mongo' (MONGO_TRACE_HEADER) for the tests to find the new round trips.
+For the streamed responses (the documents from the cursor), the trace is finished when the response is closed,
+so the fetching of the body is counted, but the header only contains the commands before the body.
+"""
+import logging
+import threading
+import typing as t
+
+from pymongo import monitoring
+
+from src.utils.metrics import Counter, Histogram
+
+TOP_COMMANDS = 5
+
+MONGO_COMMANDS = Counter('hive_mongo_commands_total', 'The MongoDB commands by the endpoint.', ('endpoint', 'command'))
+MONGO_REQUEST_COMMANDS = Histogram('hive_mongo_commands_per_request', 'The count of the MongoDB commands of every request.',
+                                   ('endpoint', ), buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 200))
+
+_local = threading.local()
+_registered = False
+
+
+class RequestTrace:
+    """ The MongoDB commands of one request. """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0  # microseconds
+        self.commands = dict()  # 'command db.collection': [count, microseconds]
+        self.pending = dict()  # request id: 'command db.collection'
+
+    def add(self, target, duration_micros):
+        self.count += 1
+        self.duration += duration_micros
+        item = self.commands.get(target)
+        if item is None:
+            item = self.commands[target] = [0, 0]
+        item[0] += 1
+        item[1] += duration_micros
+
+    def get_top_commands(self, count=TOP_COMMANDS) -> t.List[tuple]:
+        """ The most frequent commands: [('command db.collection', count, microseconds)] """
+        items = sorted(self.commands.items(), key=lambda i: (i[1][0], i[1][1]), reverse=True)
+        return [(k, v[0], v[1]) for k, v in items[:count]]
+
+    def get_summary(self) -> str:
+        top = ', '.join([f'{k} x{c} {round(d / 1000, 1)}ms' for k, c, d in self.get_top_commands()])
+        return f'count={self.count}; time_ms={round(self.duration / 1000, 1)}; top={top}'
+
+
+class CommandTracer(monitoring.CommandListener):
+    def started(self, event):
+        trace = getattr(_local, 'trace', None)
+        if trace is not None:
+            # the collection name is the value of the command name, but 'collection' of getMore.
+            collection = event.command.get('collection', event.command.get(event.command_name))
+            target = f'{event.command_name} {event.database_name}.{collection}' if isinstance(collection, str) \
+                else f'{event.command_name} {event.database_name}'
+            trace.pending[event.request_id] = target
+
+    def succeeded(self, event):
+        self.__finish(event)
+
+    def failed(self, event):
+        self.__finish(event)
+
+    def __finish(self, event):
+        trace = getattr(_local, 'trace', None)
+        if trace is not None:
+            target = trace.pending.pop(event.request_id, event.command_name)
+            trace.add(target, event.duration_micros)
+
+
+def register_tracer():
+    """ Register the listener, it only takes effect on the MongoClient created after. """
+    global _registered
+    if not _registered:
+        monitoring.register(CommandTracer())
+        _registered = True
+
+
+def start_trace():
+    _local.trace = RequestTrace()
+
+
+def get_trace() -> t.Optional[RequestTrace]:
+    """ The trace of the request on the current thread, which is not finished. """
+    return getattr(_local, 'trace', None)
+
+
+def finish_trace(endpoint: str) -> t.Optional[RequestTrace]:
+    """ Stop tracing on the current thread, and count the commands of the request by the endpoint. """
+    trace = getattr(_local, 'trace', None)
+    _local.trace = None
+    if trace is None:
+        return None
+
+    MONGO_REQUEST_COMMANDS.observe(trace.count, endpoint)
+    for target, (count, _) in trace.commands.items():
+        MONGO_COMMANDS.inc(endpoint, target.split(' ', 1)[0], value=count)
+    if trace.count:
+        logging.getLogger('mongo_tracer').debug(f'{endpoint}: {trace.get_summary()}')
+    return trace
+
+
+def get_commands_report() -> dict:
+    """ The aggregated commands by the endpoint: {endpoint: {command: count}} """
+    report = dict()
+    with MONGO_COMMANDS.lock:
+        values = list(MONGO_COMMANDS.values.items())
+    for (endpoint, command), count in values:
+        report.setdefault(endpoint, dict())[command] = count
+    return report
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+"""
+The statistical stack sampler to profile the live requests and the background jobs on demand.
+
+The owner starts the profiling by the API of the provider (or SIGUSR2 with the default options), then:
+
+- the requests which path matches the pattern, and the jobs which 'job:<name>' matches, are profiled by the rate;
+- the sampler thread takes the stacks of the profiled threads every interval;
+- the profiling stops itself after the max samples or the max seconds,
+  and writes the collapsed stacks to DATA_STORE_PATH/profiles, which can be drawn by flamegraph.pl or speedscope.
+
+Nothing is done on the hot path except a flag check when the profiling is off.
+Every worker process profiles by itself, so the API only controls the worker which handles the request.
+"""
+import logging
+import os
+import random
+import re
+import signal
+import sys
+import threading
+import time
+import typing as t
+from pathlib import Path
+
+from src.settings import hive_setting
+
+MAX_DURATION = 10 * 60  # seconds
+MAX_DEPTH = 128
+
+
+class Profiler:
+    def __init__(self):
+        self.is_active = False
+        self.lock = threading.Lock()
+        self.pattern, self.rate, self.max_samples, self.interval = None, 1.0, 0, 0.01
+        self.started_at, self.samples, self.session = 0, 0, 0
+        self.threads = dict()  # thread id: the name of the request or job
+        self.stacks = dict()  # collapsed stack: count
+        self.last_file = None
+
+    def start(self, pattern: str = None, rate: float = 1.0, max_samples: int = 10000, interval: float = 0.01):
+        """ Start the profiling, the running one is stopped and written first.
+
+        :param pattern: the regex to search in the request path or 'job:<name>', None means all.
+        :param rate: the fraction of the matched requests and jobs to profile.
+        """
+        self.stop()
+        with self.lock:
+            self.pattern = re.compile(pattern) if pattern else None
+            self.rate, self.max_samples, self.interval = rate, max_samples, interval
+            self.started_at, self.samples = time.time(), 0
+            self.threads, self.stacks = dict(), dict()
+            self.is_active = True
+            self.session += 1
+        threading.Thread(target=self.__sample_loop, args=(self.session, ), name='profiler', daemon=True).start()
+        logging.getLogger('profiler').info(f'Profiling started: pattern={pattern}, rate={rate}, '
+                                           f'max_samples={max_samples}, interval={interval}')
+
+    def stop(self, session: int = None) -> t.Optional[str]:
+        """ Stop the profiling and write the samples, return the path of the profile file.
+
+        :param session: only stop the profiling of the session, None means the current one.
+        """
+        with self.lock:
+            if not self.is_active or (session is not None and session != self.session):
+                return None
+            self.is_active = False
+            stacks, self.stacks, self.threads = self.stacks, dict(), dict()
+        self.last_file = self.__write(stacks)
+        logging.getLogger('profiler').info(f'Profiling stopped, {self.samples} samples are written to {self.last_file}')
+        return self.last_file
+
+    def get_state(self) -> dict:
+        return {'is_active': self.is_active,
+                'pattern': self.pattern.pattern if self.pattern else None,
+                'rate': self.rate,
+                'max_samples': self.max_samples,
+                'samples': self.samples,
+                'started_at': int(self.started_at),
+                'last_file': self.last_file}
+
+    def begin(self, name: str) -> bool:
+        """ Profile the current thread if the name matches, return whether it is profiled. """
+        if not self.is_active:
+            return False
+        if self.pattern and not self.pattern.search(name):
+            return False
+        if self.rate < 1 and random.random() >= self.rate:
+            return False
+        self.threads[threading.get_ident()] = name
+        return True
+
+    def end(self):
+        self.threads.pop(threading.get_ident(), None)
+
+    def __sample_loop(self, session):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self.lock:
+                if not self.is_active or session != self.session:
+                    return
+                for tid, name in list(self.threads.items()):
+                    frame = frames.get(tid)
+                    if frame is not None:
+                        stack = Profiler.__collapse(name, frame)
+                        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+                        self.samples += 1
+                is_done = self.samples >= self.max_samples or time.time() - self.started_at > MAX_DURATION
+            if is_done:
+                self.stop(session)
+
+    @staticmethod
+    def __collapse(name, frame) -> str:
+        names = list()
+        while frame is not None and len(names) < MAX_DEPTH:
+            code = frame.f_code
+            names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        names.append(name)
+        return ';'.join(reversed(names)).replace(' ', '_')
+
+    @staticmethod
+    def __write(stacks: dict) -> str:
+        path = Path(hive_setting.DATA_STORE_PATH) / 'profiles'
+        path.mkdir(parents=True, exist_ok=True)
+        file_path = path / f'profile-{os.getpid()}-{time.strftime("%Y%m%d-%H%M%S")}.folded'
+        with file_path.open('w') as f:
+            for stack, count in sorted(stacks.items(), key=lambda i: i[1], reverse=True):
+                f.write(f'{stack} {count}\n')
+        return file_path.as_posix()
+
+
+profiler = Profiler()
+
+
+def register_profiler_signal():
+    """ Start or stop the profiling with the default options by: kill -USR2 <pid of the worker> """
+    if not hasattr(signal, 'SIGUSR2') or threading.current_thread() is not threading.main_thread():
+        return
+
+    def on_sigusr2(signum, frame):
+        # the profiling is started or stopped on a thread, the lock may be held by the interrupted frame.
+        threading.Thread(target=lambda: profiler.stop() if profiler.is_active else profiler.start(), daemon=True).start()
+
+    signal.signal(signal.SIGUSR2, on_sigusr2)
@@ -4,21 +4,31 @@
 Scheduler tasks for the hive node.
 """
 import logging
+import socket
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
 from flask_apscheduler import APScheduler
 
-from src.utils.consts import VAULT_SERVICE_COL, VAULT_SERVICE_DID, VAULT_SERVICE_FILE_USE_STORAGE, VAULT_SERVICE_DB_USE_STORAGE, VAULT_SERVICE_MODIFY_TIME
+from src import hive_setting
+from src.utils.consts import VAULT_SERVICE_COL, VAULT_SERVICE_DID, VAULT_SERVICE_FILE_USE_STORAGE, VAULT_SERVICE_DB_USE_STORAGE, VAULT_SERVICE_MODIFY_TIME, \
+    VAULT_SERVICE_LATEST_ACCESS_TIME, VAULT_SERVICE_STORAGE_COUNT_TIME, VAULT_SERVICE_STORAGE_DRIFT
 from src.utils import hive_job
 from src.modules.auth.user import UserManager
+from src.modules.backup.backup_scrub import BackupScrubber
 from src.modules.database.mongodb_client import MongodbClient
 from src.modules.files.local_file import LocalFile
 from src.modules.subscription.vault import VaultManager
+from src.utils.metrics import Counter, Gauge, Histogram
 
 scheduler = APScheduler()
 
+# the file lock of the process which runs the scheduler.
+_leader_lock = None
+
 
 def scheduler_init(app):
     if not scheduler.running:
@@ -26,38 +36,127 @@ def scheduler_init(app):
         scheduler.start()
 
 
-def count_vault_storage_really():
-    mcli, user_manager, vault_manager = MongodbClient(), UserManager(), VaultManager()
-    now = int(datetime.now().timestamp())
+def acquire_scheduler_leadership() -> bool:
+    """ Only one process of the node runs the schedulers and the boot tasks when serving by multiple workers.
+
+    The leader is the process which holds the file lock in the data directory. The lock is released by the
+    system when the process exits, then the worker started by the prefork server to replace it takes the lock.
+    """
+    global _leader_lock
+    if _leader_lock:
+        return True
+
+    try:
+        import fcntl
+    except ImportError:
+        # not supported by the system, always the leader.
+        return True
+
+    path = Path(hive_setting.DATA_STORE_PATH) / 'scheduler.lock'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    f = path.open('a')
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+
+    _leader_lock = f
+    return True
+
+
+def is_scheduler_leader() -> bool:
+    return _leader_lock is not None
+
+
+# the drifts of the vaults by the last recount, only the drifted ones: {(user_did, usage): drift}
+_vault_storage_drifts = dict()
+_vault_storage_drifts_lock = threading.Lock()
+
+VAULT_STORAGE_COUNT_DURATION = Histogram('hive_vault_storage_count_duration_seconds', 'The duration of recounting the usage of all vaults.',
+                                         buckets=(1, 5, 10, 30, 60, 300, 600, 1800, 3600, 7200))
+VAULT_STORAGE_DRIFT_BYTES = Counter('hive_vault_storage_drift_bytes_total', 'The absolute drift between the recounted usage and the recorded one.',
+                                    ('usage', ))
+Gauge('hive_vault_storage_drift_bytes', 'The drift of the usage of the vault by the last recount, only for the drifted vaults.',
+      ('user_did', 'usage'), callback=lambda: dict(_vault_storage_drifts))
 
-    col = mcli.get_management_collection(VAULT_SERVICE_COL)
-    vault_services = col.find_many({VAULT_SERVICE_DID: {'$exists': True}})  # cursor
 
-    for service in vault_services:
-        user_did = service[VAULT_SERVICE_DID]
+def count_vault_storage_really(is_force=False) -> dict:
+    """ Recount the files and databases usage of the vaults by VAULT_STORAGE_COUNT_WORKERS threads.
 
-        # get files and databases total size
-        app_dids = user_manager.get_apps(user_did)
-        files_size = sum(map(lambda app_did: vault_manager.count_app_files_total_size(user_did, app_did), app_dids))
-        dbs_size = sum(map(lambda app_did: mcli.get_user_database_size(user_did, app_did), app_dids))
+    The vault which is not accessed after the last recount is skipped unless forced.
+    The drift between the recounted usage and the recorded one is kept in the vault.
 
-        # update sizes into the vault information
-        filter_ = {"_id": service["_id"]}
-        update = {"$set": {
-            VAULT_SERVICE_FILE_USE_STORAGE: files_size,
-            VAULT_SERVICE_DB_USE_STORAGE: dbs_size,
-            VAULT_SERVICE_MODIFY_TIME: now}}
-        col.update_one(filter_, update, contains_extra=False)
+    :return: the summary of the recount.
+    """
+    start = time.time()
+
+    col = MongodbClient().get_management_collection(VAULT_SERVICE_COL)
+    vault_services = col.find_many({VAULT_SERVICE_DID: {'$exists': True}},
+                                   projection=[VAULT_SERVICE_DID, VAULT_SERVICE_FILE_USE_STORAGE, VAULT_SERVICE_DB_USE_STORAGE,
+                                               VAULT_SERVICE_LATEST_ACCESS_TIME, VAULT_SERVICE_STORAGE_COUNT_TIME])
+    services = [s for s in vault_services if is_force or is_vault_storage_changed(s)]
+
+    with ThreadPoolExecutor(max_workers=max(hive_setting.VAULT_STORAGE_COUNT_WORKERS, 1)) as pool:
+        drifts = list(pool.map(count_vault_storage_by_service, services))
+
+    VAULT_STORAGE_COUNT_DURATION.observe(time.time() - start)
+    summary = {'duration': round(time.time() - start, 3),
+               'counted': len(services),
+               'skipped': len(vault_services) - len(services),
+               'drifted': len([d for d in drifts if d['files'] or d['databases']]),
+               'drift': sum([abs(d['files']) + abs(d['databases']) for d in drifts])}
+    logging.getLogger('scheduler').info(f'count_vault_storage_really() {summary}')
+    return summary
+
+
+def is_vault_storage_changed(service) -> bool:
+    """ The usage only changes by accessing the vault after the last recount. """
+    count_time = service.get(VAULT_SERVICE_STORAGE_COUNT_TIME)
+    return count_time is None or service.get(VAULT_SERVICE_LATEST_ACCESS_TIME, 0) >= count_time
+
+
+def count_vault_storage_by_service(service) -> dict:
+    """ Recount the usage of one vault and return the drift. """
+    mcli, user_manager, vault_manager = MongodbClient(), UserManager(), VaultManager()
+    user_did, now = service[VAULT_SERVICE_DID], int(datetime.now().timestamp())
+
+    # get files and databases total size
+    app_dids = user_manager.get_apps(user_did)
+    files_size = sum(map(lambda app_did: vault_manager.count_app_files_total_size(user_did, app_did), app_dids))
+    dbs_size = sum(map(lambda app_did: mcli.get_user_database_size(user_did, app_did), app_dids))
+    drift = {'files': files_size - service.get(VAULT_SERVICE_FILE_USE_STORAGE, 0),
+             'databases': dbs_size - service.get(VAULT_SERVICE_DB_USE_STORAGE, 0)}
+
+    # update sizes into the vault information, the count time is the start time to recount the next access.
+    filter_ = {"_id": service["_id"]}
+    update = {"$set": {
+        VAULT_SERVICE_FILE_USE_STORAGE: files_size,
+        VAULT_SERVICE_DB_USE_STORAGE: dbs_size,
+        VAULT_SERVICE_STORAGE_COUNT_TIME: now,
+        VAULT_SERVICE_STORAGE_DRIFT: drift}}
+    with _vault_storage_drifts_lock:
+        for usage, value in drift.items():
+            VAULT_STORAGE_DRIFT_BYTES.inc(usage, value=abs(value))
+            if value:
+                _vault_storage_drifts[(user_did, usage)] = value
+            else:
+                _vault_storage_drifts.pop((user_did, usage), None)
+    if drift['files'] or drift['databases']:
+        update['$set'][VAULT_SERVICE_MODIFY_TIME] = now
+        logging.getLogger('scheduler').info(f'count_vault_storage_by_service() The usage of the vault {user_did} drifted: {drift}')
+    mcli.get_management_collection(VAULT_SERVICE_COL).update_one(filter_, update, contains_extra=False)
+    return drift
 
 
 @scheduler.task(trigger='interval', id='daily_routine_job', days=1)
-@hive_job('count_vault_storage_job')
+@hive_job('count_vault_storage_job', exclusive=True, min_interval=12 * 3600)
 def count_vault_storage_job():
     count_vault_storage_really()
 
 
 @scheduler.task('interval', id='task_clean_temp_files', hours=6)
-@hive_job('clean_temp_files_job')
+@hive_job(f'clean_temp_files_job:{socket.gethostname()}', exclusive=True, min_interval=3 * 3600)  # the temporary files are local
 def clean_temp_files_job():
     """ Delete all temporary files created before 12 hours. """
 
@@ -70,6 +169,13 @@ def clean_temp_files_job():
             logging.getLogger("scheduler").debug(f'clean_temp_files_job() Temporary file {f.as_posix()} removed.')
 
 
+@scheduler.task('interval', id='task_backup_scrub', hours=1)
+@hive_job('backup_scrub_job', exclusive=True, min_interval=30 * 60)
+def backup_scrub_job():
+    """ Check the pins and the content of the backups on the backup node, every backup once BACKUP_SCRUB_INTERVAL hours. """
+    BackupScrubber().scrub()
+
+
 # Shutdown your cron thread if the web process is stopped
 # atexit.register(lambda: scheduler.shutdown(wait=False))
 
@@ -82,3 +188,4 @@ if __name__ == '__main__':
     # sync_app_dids()
     # count_vault_storage_job()
     # clean_temp_files_job()
+    # backup_scrub_job()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+"""
+Token bucket rate limits for the background traffic, such as backup & restore.
+"""
+import collections
+import threading
+import time
+import typing as t
+
+from src import hive_setting
+
+# the directions of the traffic.
+THROTTLE_DOWNLOAD = 'download'  # from the IPFS gateway to the local node or file.
+THROTTLE_UPLOAD = 'upload'  # add the content to the local IPFS node.
+THROTTLE_DATABASE = 'database'  # the data of mongodump & mongorestore.
+
+
+class TokenBucket:
+    """ Thread-safe token bucket which limits the bytes per second, the rate 0 means unlimited.
+
+    The consumer takes the tokens in advance and sleeps until the debt is paid back,
+    so the chunk larger than the capacity also works.
+    """
+
+    def __init__(self, rate: int, capacity: int = None):
+        self.rate = rate
+        self.capacity = capacity if capacity else rate
+        self.tokens = self.capacity
+        self.timestamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount: int):
+        if self.rate <= 0:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.timestamp) * self.rate)
+            self.timestamp = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        if wait > 0:
+            time.sleep(wait)
+
+
+_direction_buckets: t.Dict[str, TokenBucket] = dict()
+_direction_lock = threading.Lock()
+
+
+def get_direction_bucket(direction) -> TokenBucket:
+    """ The bucket shared by all jobs of the node for the direction. """
+    with _direction_lock:
+        if direction not in _direction_buckets:
+            rates = {THROTTLE_DOWNLOAD: hive_setting.BACKUP_RATE_LIMIT_DOWNLOAD,
+                     THROTTLE_UPLOAD: hive_setting.BACKUP_RATE_LIMIT_UPLOAD,
+                     THROTTLE_DATABASE: hive_setting.BACKUP_RATE_LIMIT_DATABASE}
+            _direction_buckets[direction] = TokenBucket(rates.get(direction, 0))
+        return _direction_buckets[direction]
+
+
+class Throttle:
+    """ The rate limits of one job: the job bucket of the direction and the shared bucket of the direction.
+
+    It also measures the throughput of the job over the recent seconds.
+    """
+
+    WINDOW = 5  # seconds
+
+    def __init__(self, job_rate: int = None):
+        self.job_rate = job_rate if job_rate is not None else hive_setting.BACKUP_RATE_LIMIT_JOB
+        self.job_buckets: t.Dict[str, TokenBucket] = dict()
+        self.samples = collections.deque()
+        self.lock = threading.Lock()
+
+    def consume(self, direction, amount: int):
+        with self.lock:
+            if direction not in self.job_buckets:
+                self.job_buckets[direction] = TokenBucket(self.job_rate)
+            bucket = self.job_buckets[direction]
+        bucket.consume(amount)
+        get_direction_bucket(direction).consume(amount)
+
+        with self.lock:
+            now = time.monotonic()
+            self.samples.append((now, amount))
+            while self.samples and self.samples[0][0] < now - Throttle.WINDOW:
+                self.samples.popleft()
+
+    def iterate(self, direction, chunks: t.Iterable[bytes]) -> t.Iterator[bytes]:
+        for chunk in chunks:
+            if chunk:
+                self.consume(direction, len(chunk))
+            yield chunk
+
+    def get_throughput(self) -> int:
+        """ bytes per second of the recent seconds. """
+        with self.lock:
+            now = time.monotonic()
+            while self.samples and self.samples[0][0] < now - Throttle.WINDOW:
+                self.samples.popleft()
+            return int(sum([s[1] for s in self.samples]) / Throttle.WINDOW)
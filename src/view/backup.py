@@ -210,7 +210,9 @@ class ServerInternalState(Resource):
         self.backup_server = BackupServer()
 
     def get(self):
-        return self.backup_server.internal_backup_state()
+        return self.backup_server.internal_backup_state(rqargs.get_int('wait')[0],
+                                                        rqargs.get_str('result')[0],
+                                                        rqargs.get_str('message')[0])
 
 
 class ServerInternalRestore(Resource):
@@ -218,4 +220,5 @@ class ServerInternalRestore(Resource):
         self.backup_server = BackupServer()
 
     def get(self):
-        return self.backup_server.internal_restore(rqargs.get_str('public_key')[0])
+        return self.backup_server.internal_restore(rqargs.get_str('public_key')[0],
+                                                   rqargs.get_bool('is_curve25519_chunked')[0])
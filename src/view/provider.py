@@ -6,6 +6,7 @@ The view of the hive-node and vault management.
 from flask_restful import Resource
 
 from src.modules.provider.provider import Provider
+from src.utils.http_request import params
 
 
 class Vaults(Resource):
@@ -177,3 +178,177 @@ class FilledOrders(Resource):
         """
 
         return self.provider.get_filled_orders()
+
+
+class Metrics(Resource):
+    def __init__(self):
+        self.provider = Provider()
+
+    def get(self):
+        """ Get the metrics of the worker process which handles the request, in the Prometheus text format.
+
+        .. :quickref: 09 Provider; Get Metrics
+
+        **Request**:
+
+        .. sourcecode:: http
+
+            None
+
+        **Response OK**:
+
+        .. sourcecode:: http
+
+            HTTP/1.1 200 OK
+
+        .. code-block:: text
+
+            # HELP hive_http_request_duration_seconds The duration of the requests to the hive node.
+            # TYPE hive_http_request_duration_seconds histogram
+            hive_http_request_duration_seconds_bucket{endpoint="node.version",method="GET",status="200",pid="12",le="0.001"} 3
+            ...
+
+        **Response Error**:
+
+        .. sourcecode:: http
+
+            HTTP/1.1 401 Unauthorized
+
+        .. sourcecode:: http
+
+            HTTP/1.1 403 Forbidden
+
+        """
+
+        return self.provider.get_metrics()
+
+
+class Profiler(Resource):
+    def __init__(self):
+        self.provider = Provider()
+
+    def get(self):
+        """ Get the state of the profiling on the worker process which handles the request.
+
+        .. :quickref: 09 Provider; Get Profiler
+
+        **Request**:
+
+        .. sourcecode:: http
+
+            None
+
+        **Response OK**:
+
+        .. sourcecode:: http
+
+            HTTP/1.1 200 OK
+
+        .. code-block:: json
+
+            {
+                "is_active": true,
+                "pattern": "/api/v2/vault/db",
+                "rate": 0.1,
+                "max_samples": 10000,
+                "samples": 120,
+                "started_at": 1600073834,
+                "last_file": <the path of the last profile file|str>
+            }
+
+        **Response Error**:
+
+        .. sourcecode:: http
+
+            HTTP/1.1 401 Unauthorized
+
+        .. sourcecode:: http
+
+            HTTP/1.1 403 Forbidden
+
+        """
+
+        return self.provider.get_profiler()
+
+    def post(self):
+        """ Start the sampling profiling of the requests and the jobs on the worker process which handles the request.
+
+        The profiling stops after the max samples or 10 minutes, and the collapsed stacks are written
+        to the directory 'profiles' of the data directory, which can be drawn by flamegraph.pl or speedscope.
+
+        .. :quickref: 09 Provider; Start Profiler
+
+        **Request**:
+
+        .. code-block:: json
+
+            {
+                "pattern": <the regex to search in the request path or 'job:<job name>', optional, default all|str>,
+                "rate": <the fraction of the matched requests and jobs to profile, optional, default 1.0|float>,
+                "max_samples": <optional, default 10000|int>,
+                "interval": <the seconds between the samples, optional, default 0.01|float>
+            }
+
+        **Response OK**:
+
+        .. sourcecode:: http
+
+            HTTP/1.1 201 Created
+
+        .. code-block:: json
+
+            {
+                "is_active": true,
+                ...
+            }
+
+        **Response Error**:
+
+        .. sourcecode:: http
+
+            HTTP/1.1 400 Bad Request
+
+        .. sourcecode:: http
+
+            HTTP/1.1 401 Unauthorized
+
+        .. sourcecode:: http
+
+            HTTP/1.1 403 Forbidden
+
+        """
+
+        body, _ = params.get_root()
+        return self.provider.start_profiler(body.get('pattern'), body.get('rate', 1.0),
+                                            body.get('max_samples', 10000), body.get('interval', 0.01))
+
+    def delete(self):
+        """ Stop the profiling and write the profile file, the path of the file is 'last_file' of the state.
+
+        .. :quickref: 09 Provider; Stop Profiler
+
+        **Request**:
+
+        .. sourcecode:: http
+
+            None
+
+        **Response OK**:
+
+        .. sourcecode:: http
+
+            HTTP/1.1 204 No Content
+
+        **Response Error**:
+
+        .. sourcecode:: http
+
+            HTTP/1.1 401 Unauthorized
+
+        .. sourcecode:: http
+
+            HTTP/1.1 403 Forbidden
+
+        """
+
+        return self.provider.stop_profiler()
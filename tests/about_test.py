@@ -8,6 +8,7 @@ import unittest
 
 from src.utils.did.did_wrapper import Presentation
 from tests.utils.http_client import HttpClient
+from tests.utils.resp_asserter import RA
 from tests import init_test
 
 
@@ -26,6 +27,7 @@ class AboutTestCase(unittest.TestCase):
         response = self.cli.get(f'/node/version', need_token=False)
         self.assertEqual(response.status_code, 200)
         self.assertTrue('major' in response.json())
+        RA(response).assert_mongo_commands(0)
 
     def test02_get_commit_id(self):
         response = self.cli.get(f'/about/commit_id', need_token=False)
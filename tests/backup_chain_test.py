@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+"""
+Testing file for the chain of the full & incremental backups on the backup node.
+"""
+import json
+import shutil
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from flask import Flask, g
+
+from src.modules.backup.backup_server import BackupServer
+from src.utils.consts import BKSERVER_REQ_CID, BKSERVER_REQ_SHA256, BKSERVER_REQ_SIZE, BKSERVER_REQ_PUBLIC_KEY, \
+    BKSERVER_REQ_CHAIN, VAULT_BACKUP_SERVICE_MAX_STORAGE
+from src.utils.http_exception import BadRequestException, InsufficientStorageException
+from tests import init_test
+
+USER_DID = 'did:elastos:user0'
+
+
+class FakeBackupManager:
+    def __init__(self):
+        self.backups = {USER_DID: {VAULT_BACKUP_SERVICE_MAX_STORAGE: 1000}}
+
+    def get_backup(self, user_did):
+        return dict(self.backups[user_did])
+
+    def update_backup(self, user_did, update):
+        self.backups[user_did].update(update)
+
+
+class FakeIpfsClient:
+    """ The request metadata of the backups by the CIDs, which are not encrypted. """
+
+    def __init__(self):
+        self.metadata = dict()
+
+    def cid_pin(self, cid):
+        pass
+
+    def download_file(self, cid, file_path, is_proxy=False, sha256=None, size=None):
+        Path(file_path).write_text(json.dumps(self.metadata[cid]))
+
+
+def decrypt_file_with_curve25519(src_full_path, other_side_public_key, is_server):
+    dst_full_path = Path(src_full_path.as_posix() + '.decryption.curve25519')
+    shutil.copyfile(src_full_path, dst_full_path)
+    return dst_full_path
+
+
+def get_database(name, is_full=True):
+    return {'name': name, 'is_full': is_full, 'cid': f'{name}-{"full" if is_full else "incremental"}'}
+
+
+class BackupChainTestCase(unittest.TestCase):
+    def __init__(self, method_name='runTest'):
+        super().__init__(method_name)
+        init_test()
+
+    def setUp(self):
+        self.server = BackupServer()
+        self.server.backup_manager = FakeBackupManager()
+        self.server.ipfs_client = FakeIpfsClient()
+        self.patchers = [mock.patch('src.modules.backup.backup_server.Encryption.decrypt_file_with_curve25519',
+                                    side_effect=decrypt_file_with_curve25519),
+                         mock.patch('src.modules.backup.backup_server.backup_scheduler.submit')]
+        for patcher in self.patchers:
+            patcher.start()
+
+        self.context = Flask(__name__).app_context()
+        self.context.push()
+        g.usr_did = USER_DID
+
+    def tearDown(self):
+        self.context.pop()
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def add_backup(self, cid, metadata):
+        """ The vault sends the backup request and the executor of the backup node handles it. """
+        self.server.ipfs_client.metadata[cid] = metadata
+        self.server.internal_backup(cid, f'{cid}-sha256', 10, True, 'public_key')
+        req = self.server.backup_manager.get_backup(USER_DID)
+        request_metadata = self.server.get_server_request_metadata(USER_DID, req)
+        self.server.update_backup_chain(USER_DID, req, request_metadata)
+        return request_metadata
+
+    def get_chain(self):
+        return [layer[BKSERVER_REQ_CID] for layer in self.server.backup_manager.get_backup(USER_DID)[BKSERVER_REQ_CHAIN]]
+
+    def test_chain(self):
+        self.add_backup('cid0', {'backup_size': 10, 'previous': None})
+        self.assertEqual(self.get_chain(), ['cid0'])
+        self.add_backup('cid1', {'backup_size': 10, 'previous': {'cid': 'cid0'}})
+        self.add_backup('cid2', {'backup_size': 10, 'previous': {'cid': 'cid1'}})
+        self.assertEqual(self.get_chain(), ['cid0', 'cid1', 'cid2'])
+        self.assertEqual([layer for layer, _ in self.server.get_backup_layers(USER_DID, self.server.backup_manager.get_backup(USER_DID))],
+                         self.server.backup_manager.get_backup(USER_DID)[BKSERVER_REQ_CHAIN])
+
+        # the full backup starts a new chain.
+        self.add_backup('cid3', {'backup_size': 10, 'previous': None})
+        self.assertEqual(self.get_chain(), ['cid3'])
+
+    def test_legacy_full_backup(self):
+        # the backup before supporting the incremental backup has no chain.
+        self.server.ipfs_client.metadata['cid0'] = {'backup_size': 10}
+        self.server.backup_manager.update_backup(USER_DID, {BKSERVER_REQ_CID: 'cid0', BKSERVER_REQ_SHA256: 'sha256',
+                                                            BKSERVER_REQ_SIZE: 10, BKSERVER_REQ_PUBLIC_KEY: 'public_key'})
+        self.add_backup('cid1', {'backup_size': 10, 'previous': {'cid': 'cid0'}})
+        self.assertEqual(self.get_chain(), ['cid0', 'cid1'])
+
+    def test_invalid_backup(self):
+        self.add_backup('cid0', {'backup_size': 10, 'previous': None})
+        with self.assertRaises(BadRequestException):
+            self.add_backup('cid1', {'backup_size': 10, 'previous': {'cid': 'other'}})
+        with self.assertRaises(InsufficientStorageException):
+            self.add_backup('cid2', {'backup_size': 2000, 'previous': {'cid': 'cid0'}})
+        self.assertEqual(self.get_chain(), ['cid0'])
+
+    def test_materialized_metadata(self):
+        self.add_backup('cid0', {'backup_size': 10, 'vault_size': 10, 'type': 'full', 'previous': None,
+                                 'encryption': {'secret_key': 'key0'},
+                                 'databases': [get_database('a'), get_database('b'), get_database('removed')],
+                                 'database_markers': {'a': 0, 'b': 0, 'removed': 0}})
+        self.add_backup('cid1', {'backup_size': 10, 'vault_size': 20, 'type': 'incremental', 'previous': {'cid': 'cid0'},
+                                 'encryption': {'secret_key': 'key1'},
+                                 'databases': [get_database('a', is_full=False), get_database('b'), get_database('new')],
+                                 'database_markers': {'a': 1, 'b': 1, 'new': 1}})
+
+        # the dump files of every database from its last full dump, with the secret key of the layer.
+        metadata = self.server.get_server_request_metadata(USER_DID, self.server.backup_manager.get_backup(USER_DID),
+                                                           is_promotion=True, vault_max_size=100)
+        self.assertEqual(metadata['type'], 'full')
+        self.assertIsNone(metadata['previous'])
+        self.assertEqual(metadata['vault_size'], 20)
+        self.assertEqual([(d['cid'], d['encryption']['secret_key']) for d in metadata['databases']],
+                         [('a-full', 'key0'), ('a-incremental', 'key1'), ('b-full', 'key1'), ('new-full', 'key1')])
+
+        with self.assertRaises(InsufficientStorageException):
+            self.server.get_server_request_metadata(USER_DID, self.server.backup_manager.get_backup(USER_DID),
+                                                    is_promotion=True, vault_max_size=10)
+
+
+if __name__ == '__main__':
+    unittest.main()
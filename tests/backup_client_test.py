@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+"""
+Testing file for choosing the full or incremental backup, exporting the archives and restoring the databases on the vault node.
+"""
+import unittest
+from unittest import mock
+
+from src.modules.backup.backup_client import BackupClient
+from src.modules.backup.encryption import Encryption
+from src.settings import hive_setting
+from src.utils.consts import BACKUP_REQUEST_LAST_BACKUP, BACKUP_REQUEST_TARGET_DID
+from src.utils.http_exception import BadRequestException
+
+
+def get_req(increment_index=0, target_did='did:elastos:backup'):
+    return {BACKUP_REQUEST_TARGET_DID: 'did:elastos:backup',
+            BACKUP_REQUEST_LAST_BACKUP: {'target_did': target_did, 'cid': 'cid0', 'sha256': 'sha256', 'size': 10,
+                                         'increment_index': increment_index, 'database_markers': {}, 'databases_size': 10}}
+
+
+class BackupClientTestCase(unittest.TestCase):
+    def patch_settings(self, **kwargs):
+        patcher = mock.patch.dict(hive_setting.__dict__, kwargs)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_last_backup(self):
+        self.patch_settings(BACKUP_FULL_INTERVAL=2, BACKUP_CAR_ENABLED=False)
+        self.assertEqual(BackupClient.get_last_backup(get_req(), True)['cid'], 'cid0')
+        self.assertIsNone(BackupClient.get_last_backup({BACKUP_REQUEST_TARGET_DID: 'did:elastos:backup'}, True))
+        self.assertIsNone(BackupClient.get_last_backup(get_req(target_did='did:elastos:other'), True))
+        self.assertIsNone(BackupClient.get_last_backup(get_req(increment_index=2), True))
+
+    def test_old_backup_node(self):
+        # the backup node without the backup chain takes the incremental backup as the whole one.
+        self.patch_settings(BACKUP_FULL_INTERVAL=2, BACKUP_CAR_ENABLED=False)
+        self.assertIsNone(BackupClient.get_last_backup(get_req(), False))
+
+    def test_full_backup_only(self):
+        self.patch_settings(BACKUP_FULL_INTERVAL=0, BACKUP_CAR_ENABLED=False)
+        self.assertIsNone(BackupClient.get_last_backup(get_req(), True))
+
+    def test_car_archives(self):
+        # the archives contain all content, so they are not combined with the backup chain.
+        self.patch_settings(BACKUP_FULL_INTERVAL=2, BACKUP_CAR_ENABLED=True)
+        self.assertIsNone(BackupClient.get_last_backup(get_req(), True))
+
+
+class RestoreDatabaseTestCase(unittest.TestCase):
+    def setUp(self):
+        encryption = Encryption()
+        self.archive = b''.join(encryption.encrypt_stream([b'archive']))
+        secret_key, nonce = encryption.get_private_key()
+        self.metadata = {'encryption': {'secret_key': secret_key, 'nonce': nonce},
+                         'databases': [{'name': 'database0', 'cid': 'cid0', 'sha256': 'sha256', 'size': len(self.archive)}]}
+        self.client = BackupClient()
+        patcher = mock.patch('src.modules.backup.backup_client.LocalFile.restore_mongodb_from_full_path')
+        self.restore = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_restore(self):
+        self.client.ipfs_client = mock.Mock(download_stream=lambda cid, **kwargs: iter([self.archive]))
+        self.client.restore_database_by_dump_files(self.metadata)
+        self.assertEqual(self.restore.call_count, 1)
+        self.assertFalse(self.restore.call_args[0][0].exists())
+
+    def test_corrupted_dump_file(self):
+        # the collections are not dropped by mongorestore before the dump file is verified.
+        def download_stream(cid, **kwargs):
+            yield self.archive
+            raise BadRequestException(f'Failed to get file content with cid {cid}, sha256')
+
+        self.client.ipfs_client = mock.Mock(download_stream=download_stream)
+        with self.assertRaises(BadRequestException):
+            self.client.restore_database_by_dump_files(self.metadata)
+        self.restore.assert_not_called()
+
+
+class ExportCarsTestCase(unittest.TestCase):
+    def test_export_cids_to_cars(self):
+        client = BackupClient()
+        client.ipfs_client = mock.Mock(make_directory=lambda cids: '-'.join(cids), car_export=lambda root, throttle: (f'car_{root}', 1))
+        files = iter([{'cid': 'cid1', 'size': 6}, {'cid': 'cid2', 'size': 6}, {'cid': 'cid3', 'size': 1}])
+        cars = list()
+        with mock.patch.dict(hive_setting.__dict__, {'BACKUP_CAR_MAX_SIZE': 10}):
+            # the archive is exported when the group is full, and the file entries are passed through.
+            files = client.export_cids_to_cars([{'cid': 'database0', 'size': 4}], files, cars)
+            self.assertEqual(next(files)['cid'], 'cid1')
+            self.assertEqual(next(files)['cid'], 'cid2')
+            self.assertEqual([c['root'] for c in cars], ['database0-cid1'])
+            self.assertEqual([f['cid'] for f in files], ['cid3'])
+        self.assertEqual([c['root'] for c in cars], ['database0-cid1', 'cid2-cid3'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+"""
+Testing file for pinning & unpinning the CIDs of the backup metadata.
+"""
+import unittest
+from unittest import mock
+
+from src.modules.backup.backup_executor import ExecutorBase
+
+
+class FakeIpfsClient:
+    def __init__(self):
+        self.calls = list()
+
+    def car_import(self, car_cid, throttle=None):
+        self.calls.append(('import', car_cid))
+
+    def cid_pinned(self, cid):
+        return False
+
+    def cid_pin(self, cid, throttle=None):
+        self.calls.append(('pin', cid))
+
+    def cid_unpin(self, cid):
+        self.calls.append(('unpin', cid))
+
+
+def get_metadata():
+    return {'databases': [{'name': 'database0', 'cid': 'database0', 'size': 10}],
+            'file_shards': [{'cid': 'shard0', 'sha256': 'sha256', 'size': 10, 'count': 0}],
+            'files_count': 0, 'files_size': 0,
+            'cars': [{'cid': 'car0', 'root': 'root0', 'size': 20}]}
+
+
+class BackupExecutorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.ipfs_client = FakeIpfsClient()
+        self.patchers = [mock.patch('src.modules.backup.backup_executor.IpfsClient', return_value=self.ipfs_client),
+                         mock.patch('src.modules.backup.cid_pipeline.IpfsClient', return_value=self.ipfs_client),
+                         mock.patch('src.modules.backup.backup_executor.iterate_file_batches', return_value=iter([]))]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def test_pin_cars(self):
+        # the databases are pinned by the roots of the archives.
+        ExecutorBase.handle_cids_in_local_ipfs(get_metadata())
+        self.assertEqual(sorted(self.ipfs_client.calls), [('import', 'car0'), ('pin', 'shard0')])
+
+    def test_unpin_cars_of_layer(self):
+        # the layer of the backup chain which files are in the latest layer.
+        ExecutorBase.handle_cids_in_local_ipfs(get_metadata(), root_cid='req0', contain_files=False, is_unpin=True)
+        self.assertEqual(sorted(self.ipfs_client.calls), [('unpin', 'database0'), ('unpin', 'req0'), ('unpin', 'root0'), ('unpin', 'shard0')])
+
+    def test_unpin_cars(self):
+        ExecutorBase.handle_cids_in_local_ipfs(get_metadata(), is_unpin=True)
+        self.assertEqual(sorted(self.ipfs_client.calls), [('unpin', 'database0'), ('unpin', 'root0'), ('unpin', 'shard0')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+"""
+Testing file for the queue of the backup & restore jobs.
+"""
+import threading
+import unittest
+from datetime import datetime
+
+from src.modules.backup.backup_scheduler import BackupScheduler, JOB_SIDE_CLIENT, JOB_STATE_RUNNING, JOB_STATE_WAITING
+from src.modules.database.mongodb_client import MongodbClient
+from src.settings import hive_setting
+from src.utils.consts import USR_DID
+from src.utils.http_exception import BackupIsInProcessingException
+from tests import init_test
+
+COLLECTION = 'test_backup_jobs'
+
+
+class FakeExecutor(threading.Thread):
+    """ The executor which only finishes when the test asks. """
+
+    def __init__(self, user_did, action, is_force):
+        super().__init__(daemon=True)
+        self.user_did, self.action, self.is_force = user_did, action, is_force
+        self.on_finished = None
+        self.is_started = False
+
+    def start(self):
+        self.is_started = True
+
+    def finish(self):
+        self.on_finished()
+
+
+class BackupSchedulerTestCase(unittest.TestCase):
+    def __init__(self, method_name='runTest'):
+        super().__init__(method_name)
+        init_test()
+        self.col = MongodbClient().get_management_collection(COLLECTION)
+
+    def setUp(self):
+        self.col.delete_many({'side': JOB_SIDE_CLIENT})
+        self.executors = list()
+
+    def tearDown(self):
+        self.col.delete_many({'side': JOB_SIDE_CLIENT})
+
+    def create_scheduler(self) -> BackupScheduler:
+        def create_executor(user_did, action, is_force):
+            executor = FakeExecutor(user_did, action, is_force)
+            self.executors.append(executor)
+            return executor
+
+        scheduler = BackupScheduler(collection_name=COLLECTION)
+        scheduler.HEARTBEAT_INTERVAL = 3600  # the heartbeat is kept by the test.
+        scheduler.register(JOB_SIDE_CLIENT, create_executor)
+        return scheduler
+
+    def get_job(self, user_did):
+        return self.col.find_one({USR_DID: user_did})
+
+    def test_submit_and_dispatch(self):
+        scheduler = self.create_scheduler()
+        concurrency = hive_setting.BACKUP_JOB_CONCURRENCY
+        users = [f'did:elastos:user{i}' for i in range(concurrency + 2)]
+        for user_did in users:
+            scheduler.submit(JOB_SIDE_CLIENT, user_did, 'backup')
+
+        # the jobs over the concurrency wait by the order of the submission.
+        self.assertEqual([e.user_did for e in self.executors], users[:concurrency])
+        self.assertTrue(all([e.is_started for e in self.executors]))
+        self.assertEqual(self.get_job(users[concurrency])['state'], JOB_STATE_WAITING)
+        self.assertEqual(scheduler.get_position(JOB_SIDE_CLIENT, users[concurrency]), 1)
+        self.assertEqual(scheduler.get_position(JOB_SIDE_CLIENT, users[concurrency + 1]), 2)
+        self.assertEqual(scheduler.get_position(JOB_SIDE_CLIENT, users[0]), 0)
+
+        # the finished job is removed and the next one runs.
+        self.executors[0].finish()
+        self.assertIsNone(self.get_job(users[0]))
+        self.assertEqual(self.executors[-1].user_did, users[concurrency])
+        self.assertEqual(self.get_job(users[concurrency])['state'], JOB_STATE_RUNNING)
+        self.assertEqual(scheduler.get_position(JOB_SIDE_CLIENT, users[concurrency + 1]), 1)
+
+    def test_submit_replaces_waiting_job(self):
+        scheduler = self.create_scheduler()
+        for i in range(hive_setting.BACKUP_JOB_CONCURRENCY):
+            scheduler.submit(JOB_SIDE_CLIENT, f'did:elastos:user{i}', 'backup')
+
+        user_did = 'did:elastos:waiting'
+        scheduler.submit(JOB_SIDE_CLIENT, user_did, 'backup')
+        scheduler.submit(JOB_SIDE_CLIENT, user_did, 'restore')
+        self.assertEqual(self.col.count({USR_DID: user_did}), 1)
+        self.assertEqual(self.get_job(user_did)['action'], 'restore')
+
+        # the running job is not replaced.
+        self.assertTrue(scheduler.is_running(JOB_SIDE_CLIENT, 'did:elastos:user0'))
+        self.assertFalse(scheduler.is_running(JOB_SIDE_CLIENT, user_did))
+        with self.assertRaises(BackupIsInProcessingException):
+            scheduler.submit(JOB_SIDE_CLIENT, 'did:elastos:user0', 'restore', is_force=True)
+        self.assertEqual(self.get_job('did:elastos:user0')['action'], 'backup')
+
+    def test_heartbeat(self):
+        scheduler = self.create_scheduler()
+        scheduler.submit(JOB_SIDE_CLIENT, 'did:elastos:user0', 'backup')
+        self.col.update_one({USR_DID: 'did:elastos:user0'}, {'$set': {'heartbeat': 0}}, contains_extra=False)
+
+        # the heartbeat of the running job is renewed by the owner.
+        scheduler.keep_heartbeat()
+        job = self.get_job('did:elastos:user0')
+        self.assertEqual(job['state'], JOB_STATE_RUNNING)
+        self.assertGreater(job['heartbeat'], datetime.now().timestamp() - 60)
+        self.assertEqual(len(self.executors), 1)
+
+    def test_crash_then_resubmit(self):
+        # the job of the crashed process is left running without the heartbeat.
+        crashed = self.create_scheduler()
+        user_did = 'did:elastos:user0'
+        crashed.submit(JOB_SIDE_CLIENT, user_did, 'backup')
+        self.col.update_one({USR_DID: user_did}, {'$set': {'heartbeat': 0}}, contains_extra=False)
+
+        # the new process takes the job back when the user submits again.
+        scheduler = self.create_scheduler()
+        scheduler.submit(JOB_SIDE_CLIENT, user_did, 'restore')
+        self.assertIsNotNone(scheduler.heartbeat_thread)
+        job = self.get_job(user_did)
+        self.assertEqual(job['state'], JOB_STATE_RUNNING)
+        self.assertEqual(job['instance_id'], scheduler.instance_id)
+        self.assertEqual(job['action'], 'restore')
+        self.assertEqual([e.action for e in self.executors], ['backup', 'restore'])
+
+        # fencing: the executor of the crashed process can not remove the job of the new one.
+        self.executors[0].finish()
+        self.assertEqual(self.get_job(user_did)['instance_id'], scheduler.instance_id)
+        self.executors[1].finish()
+        self.assertIsNone(self.get_job(user_did))
+
+    def test_dead_job_is_put_back_by_heartbeat(self):
+        crashed = self.create_scheduler()
+        user_did = 'did:elastos:user0'
+        crashed.submit(JOB_SIDE_CLIENT, user_did, 'backup')
+        self.col.update_one({USR_DID: user_did}, {'$set': {'heartbeat': 0}}, contains_extra=False)
+
+        scheduler = self.create_scheduler()
+        scheduler.keep_heartbeat()
+        job = self.get_job(user_did)
+        self.assertEqual(job['state'], JOB_STATE_RUNNING)
+        self.assertEqual(job['instance_id'], scheduler.instance_id)
+        self.assertEqual(len(self.executors), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+"""
+Testing file for scrubbing the backups on the backup node.
+"""
+import unittest
+from unittest import mock
+
+from src.modules.backup.backup_scrub import BackupScrubber, SCRUB_STATE_OK, SCRUB_STATE_BROKEN, SCRUB_STATE_ERROR
+from src.utils.consts import USR_DID, BKSERVER_REQ_CID, BKSERVER_REQ_SCRUB
+from tests import init_test
+
+USER_DID = 'did:elastos:user0'
+
+
+class FakeBackupManager:
+    def __init__(self):
+        self.updates = list()
+
+    def update_backup(self, user_did, update, contains_extra=True):
+        self.updates.append(update)
+
+
+class FakeIpfsClient:
+    """ All CIDs are pinned and not corrupted except the given ones. """
+
+    def __init__(self, not_pinned=(), corrupted=()):
+        self.not_pinned, self.corrupted = set(not_pinned), set(corrupted)
+        self.checked, self.downloaded = list(), list()
+
+    def cids_not_pinned(self, cids):
+        self.checked.extend(cids)
+        return [c for c in cids if c in self.not_pinned]
+
+    def download_stream(self, cid, sha256=None, size=None, throttle=None):
+        self.downloaded.append(cid)
+        if cid in self.corrupted:
+            raise Exception('sha256 does not match')
+        yield b'content'
+
+
+class FakeBackupServer:
+    def __init__(self, layers):
+        self.layers = layers
+
+    def get_backup_layers(self, user_did, backup):
+        if isinstance(self.layers, Exception):
+            raise self.layers
+        return self.layers
+
+
+def get_item(cid):
+    return {'cid': cid, 'sha256': f'{cid}-sha256', 'size': 7}
+
+
+def get_layers(cars=None):
+    """ The full backup and the incremental one, only the latest one contains all files. """
+    return [({BKSERVER_REQ_CID: 'req0'}, {'databases': [get_item('database0')], 'files': [get_item('old-file')]}),
+            ({BKSERVER_REQ_CID: 'req1'}, {'databases': [get_item('database1')], 'files': [get_item('file0'), get_item('file1')],
+                                          **({'cars': cars} if cars else {})})]
+
+
+class BackupScrubTestCase(unittest.TestCase):
+    def __init__(self, method_name='runTest'):
+        super().__init__(method_name)
+        init_test()
+
+    def setUp(self):
+        self.scrubber = BackupScrubber()
+        self.scrubber.backup_manager = FakeBackupManager()
+        # sample all items.
+        self.patcher = mock.patch('src.modules.backup.backup_scrub.random.random', return_value=0)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def scrub(self, layers, ipfs_client):
+        self.scrubber.ipfs_client = ipfs_client
+        self.scrubber.scrub_backup(FakeBackupServer(layers), {USR_DID: USER_DID}, None)
+        return self.scrubber.backup_manager.updates[-1][BKSERVER_REQ_SCRUB]
+
+    def test_ok(self):
+        ipfs_client = FakeIpfsClient()
+        result = self.scrub(get_layers(), ipfs_client)
+        self.assertEqual(result['state'], SCRUB_STATE_OK)
+        self.assertEqual(sorted(ipfs_client.checked), ['database0', 'database1', 'file0', 'file1', 'req0', 'req1'])
+        self.assertEqual(result['cids'], 6)
+        self.assertEqual(result['sampled'], 4)
+        self.assertEqual(sorted(ipfs_client.downloaded), ['database0', 'database1', 'file0', 'file1'])
+
+    def test_broken(self):
+        ipfs_client = FakeIpfsClient(not_pinned=['database0', 'file0'], corrupted=['file1'])
+        result = self.scrub(get_layers(), ipfs_client)
+        self.assertEqual(result['state'], SCRUB_STATE_BROKEN)
+        self.assertEqual((result['not_pinned_count'], sorted(result['not_pinned'])), (2, ['database0', 'file0']))
+        self.assertEqual((result['corrupted_count'], result['corrupted']), (1, ['file1']))
+
+        # the content of the not pinned CIDs is not downloaded.
+        self.assertNotIn('file0', ipfs_client.downloaded)
+
+    def test_cars(self):
+        # the content CIDs are pinned by the roots of the CAR archives.
+        ipfs_client = FakeIpfsClient()
+        result = self.scrub(get_layers(cars=[{'root': 'car0'}]), ipfs_client)
+        self.assertEqual(result['state'], SCRUB_STATE_OK)
+        self.assertEqual(sorted(ipfs_client.checked), ['car0', 'database0', 'req0', 'req1'])
+        self.assertIn('file0', ipfs_client.downloaded)
+
+    def test_error(self):
+        result = self.scrub(Exception('failed to get the request metadata'), FakeIpfsClient())
+        self.assertEqual(result['state'], SCRUB_STATE_ERROR)
+        self.assertEqual(result['message'], 'failed to get the request metadata')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+"""
+Testing file for the long poll of the backup state on the backup node.
+"""
+import threading
+import time
+import unittest
+from unittest import mock
+
+from flask import Flask, g
+
+from src.modules.backup.backup_server import BackupServer
+from src.utils.consts import BKSERVER_REQ_STATE, BKSERVER_REQ_STATE_MSG, BKSERVER_REQ_ACTION, BACKUP_REQUEST_STATE_PROCESS, \
+    BACKUP_REQUEST_ACTION_BACKUP, BACKUP_REQUEST_STATE_SUCCESS
+from tests import init_test
+
+USER_DID = 'did:elastos:user0'
+
+
+class FakeBackupManager:
+    """ The backup requests in memory. """
+
+    def __init__(self):
+        self.backups = {USER_DID: {BKSERVER_REQ_ACTION: BACKUP_REQUEST_ACTION_BACKUP,
+                                   BKSERVER_REQ_STATE: BACKUP_REQUEST_STATE_PROCESS,
+                                   BKSERVER_REQ_STATE_MSG: '50'}}
+
+    def get_backup(self, user_did):
+        return dict(self.backups[user_did])
+
+    def update_backup(self, user_did, update):
+        self.backups[user_did].update(update)
+
+
+class BackupStateTestCase(unittest.TestCase):
+    def __init__(self, method_name='runTest'):
+        super().__init__(method_name)
+        init_test()
+
+    def setUp(self):
+        self.server = BackupServer()
+        self.server.backup_manager = FakeBackupManager()
+        self.patchers = [mock.patch('src.modules.backup.backup_server.Encryption.get_service_did_public_key', return_value='public_key'),
+                         mock.patch('src.modules.backup.backup_server.backup_scheduler.get_position', return_value=0)]
+        for patcher in self.patchers:
+            patcher.start()
+
+        self.context = Flask(__name__).app_context()
+        self.context.push()
+        g.usr_did = USER_DID
+
+    def tearDown(self):
+        self.context.pop()
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def get_state(self, wait, message='50'):
+        start = time.monotonic()
+        state = self.server.internal_backup_state(wait=wait, result=BACKUP_REQUEST_STATE_PROCESS, message=message)
+        return state, time.monotonic() - start
+
+    def test_changed_state(self):
+        # the client has the old state, so no wait.
+        state, duration = self.get_state(10, message='40')
+        self.assertEqual(state['message'], '50')
+        self.assertLess(duration, 0.1)
+        self.assertTrue(state['is_long_poll'] and state['is_backup_chain'])
+        self.assertEqual(state['transferred_bytes'], 0)
+
+    def test_wake_up(self):
+        # the long poll returns at once when the state is updated by the executor in this process.
+        timer = threading.Timer(0.3, lambda: self.server.update_request_state(USER_DID, BACKUP_REQUEST_STATE_PROCESS, '60'))
+        timer.start()
+        state, duration = self.get_state(10)
+        timer.join()
+        self.assertEqual(state['result'], BACKUP_REQUEST_STATE_PROCESS)
+        self.assertEqual(state['message'], '60')
+        self.assertLess(duration, 0.6)
+
+        timer = threading.Timer(0.3, lambda: self.server.update_request_state(USER_DID, BACKUP_REQUEST_STATE_SUCCESS, '100'))
+        timer.start()
+        state, duration = self.get_state(10, message='60')
+        timer.join()
+        self.assertEqual(state['result'], BACKUP_REQUEST_STATE_SUCCESS)
+        self.assertLess(duration, 0.6)
+
+    def test_changed_by_other_process(self):
+        # the change without the notification is checked every second.
+        timer = threading.Timer(0.3, lambda: self.server.backup_manager.update_backup(USER_DID, {BKSERVER_REQ_STATE_MSG: '60'}))
+        timer.start()
+        state, duration = self.get_state(10)
+        timer.join()
+        self.assertEqual(state['message'], '60')
+        self.assertLess(duration, 1.5)
+
+    def test_timeout(self):
+        state, duration = self.get_state(1)
+        self.assertEqual(state['message'], '50')
+        self.assertGreaterEqual(duration, 1)
+        self.assertLess(duration, 1.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
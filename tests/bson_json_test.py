@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+"""
+Testing file for the fast encoder of the MongoDB documents.
+"""
+import json
+import re
+import unittest
+import uuid
+from datetime import datetime
+
+import bson
+from bson import ObjectId, Int64, Decimal128, Binary, Regex, Timestamp, MinKey, MaxKey, DBRef, SON, json_util
+from bson.raw_bson import RawBSONDocument
+
+from src.utils import bson_json
+from src.utils.bson_json import dumps, to_json_value, iter_json_items
+
+
+def get_document(i=0):
+    return {'_id': ObjectId(),
+            'name': f'document{i}',
+            'count': i,
+            'ratio': i / 3,
+            'is_valid': True,
+            'empty': None,
+            'created': datetime(2022, 1, 2, 3, 4, 5, 678000),
+            'before_epoch': datetime(1960, 1, 1),
+            'int64': Int64(1 << 40),
+            'decimal': Decimal128('1.5'),
+            'binary': Binary(b'binary', 4),
+            'bytes': b'bytes',
+            'uuid': Binary.from_uuid(uuid.uuid4()),
+            'regex': Regex('^hive', 'i'),
+            'pattern': re.compile('^vault'),
+            'timestamp': Timestamp(1, 2),
+            'min': MinKey(),
+            'max': MaxKey(),
+            'ref': DBRef('collection', ObjectId()),
+            'son': SON([('z', 1), ('a', 2)]),
+            'tuple': (1, 2),
+            'nested': [{'list': [1.5, None, 'é', {'_id': ObjectId()}]}]}
+
+
+class BsonJsonTestCase(unittest.TestCase):
+    def assert_same_as_json_util(self, value):
+        self.assertEqual(json.loads(dumps(value)), json.loads(json_util.dumps(value)))
+        self.assertEqual(to_json_value(value), json.loads(json_util.dumps(value)))
+
+    def test_dumps(self):
+        self.assert_same_as_json_util(get_document())
+        self.assert_same_as_json_util([get_document(i) for i in range(10)])
+        self.assert_same_as_json_util({'nan': float('nan'), 'values': [float('inf'), float('-inf')]})
+        self.assert_same_as_json_util(RawBSONDocument(bson.encode({'_id': ObjectId(), 'sub': {'created': datetime(2022, 1, 1)}})))
+
+    def test_dumps_keeps_order(self):
+        doc = SON([('z', 1), ('a', ObjectId()), ('m', datetime(2022, 1, 1))])
+        self.assertEqual(list(json.loads(dumps(doc)).keys()), ['z', 'a', 'm'])
+
+    def test_iter_json_items(self):
+        docs = [get_document(i) for i in range(1000)]
+        chunks = list(iter_json_items(iter(docs)))
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all([len(c) < bson_json.STREAM_CHUNK_SIZE * 2 for c in chunks]))
+        self.assertEqual(json.loads(b''.join(chunks)), {'items': json.loads(json_util.dumps(docs))})
+
+        self.assertEqual(json.loads(b''.join(iter_json_items(iter([])))), {'items': []})
+        self.assertEqual(json.loads(b''.join(iter_json_items(iter(docs[:1]), name='docs'))), {'docs': json.loads(json_util.dumps(docs[:1]))})
+
+    def test_iter_json_items_errors(self):
+        def failed_at(index):
+            for i in range(index):
+                yield get_document(i)
+            raise ValueError('cursor failed')
+
+        # the error of the first batch is raised before the response starts.
+        with self.assertRaises(ValueError):
+            iter_json_items(failed_at(0))
+
+        # the later error aborts the chunks instead of completing the JSON.
+        chunks = iter_json_items(failed_at(5000))
+        with self.assertRaises(ValueError):
+            for _ in chunks:
+                pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+"""
+Testing file for the checkpoint to resume the backup & restore.
+"""
+import copy
+import time
+import unittest
+from unittest import mock
+
+from src.modules.backup.checkpoint import Checkpoint
+from src.modules.database.mongodb_client import MongodbClient
+from src.utils.consts import COL_BACKUP_CHECKPOINT_ITEMS, USR_DID
+from tests import init_test
+
+USER_DID = 'did:elastos:checkpoint'
+
+
+class CheckpointTestCase(unittest.TestCase):
+    def __init__(self, method_name='runTest'):
+        super().__init__(method_name)
+        init_test()
+
+    def setUp(self):
+        self.saved = list()
+        self.col = MongodbClient().get_management_collection(COL_BACKUP_CHECKPOINT_ITEMS)
+
+    def tearDown(self):
+        self.col.delete_many({USR_DID: USER_DID})
+
+    def save(self, data):
+        self.saved.append(copy.deepcopy(data))
+
+    def create(self, data=None):
+        return Checkpoint(USER_DID, 'backup_client', self.save, data)
+
+    def count_items(self):
+        return self.col.count({USR_DID: USER_DID, 'name': 'backup_client'})
+
+    def test_stages(self):
+        checkpoint = self.create()
+        self.assertFalse(checkpoint.is_resumed())
+
+        checkpoint.finish_item('cid0', size=10)
+        checkpoint.flush()
+        self.assertEqual(self.count_items(), 1)
+        checkpoint.finish_stage('pin', {'count': 1})
+        self.assertTrue(checkpoint.is_stage_done('pin'))
+        self.assertEqual(checkpoint.get_stage('pin'), {'count': 1})
+        self.assertFalse(checkpoint.is_stage_done('database'))
+
+        # the items of the done stage are cleared and the stage is saved at once.
+        self.assertFalse(checkpoint.is_item_done('cid0'))
+        self.assertEqual(self.count_items(), 0)
+        self.assertEqual(self.saved[-1]['stages'], {'pin': {'count': 1}})
+        self.assertFalse('items' in self.saved[-1])
+        self.assertEqual(self.saved[-1]['transferred_bytes'], 10)
+
+    def test_items_saved_in_batch(self):
+        checkpoint = self.create()
+        for i in range(Checkpoint.SAVE_COUNT - 1):
+            checkpoint.finish_item(f'cid{i}', result=i, size=1)
+        self.assertFalse(self.saved)
+        self.assertEqual(checkpoint.get_item('cid1'), 1)
+
+        checkpoint.finish_item('last', size=1)
+        self.assertEqual(len(self.saved), 1)
+        self.assertEqual(self.count_items(), Checkpoint.SAVE_COUNT)
+        self.assertEqual(self.saved[0]['transferred_bytes'], Checkpoint.SAVE_COUNT)
+
+        checkpoint.finish_item('after', size=1)
+        self.assertEqual(len(self.saved), 1)
+        checkpoint.flush()
+        self.assertEqual(self.count_items(), Checkpoint.SAVE_COUNT + 1)
+
+        # the items are removed when the request finished.
+        checkpoint.clear()
+        self.assertEqual(self.count_items(), 0)
+
+    def test_items_saved_by_interval(self):
+        checkpoint = self.create()
+        with mock.patch('src.modules.backup.checkpoint.time.time', return_value=time.time() + Checkpoint.SAVE_INTERVAL):
+            checkpoint.finish_item('cid0')
+        self.assertEqual(len(self.saved), 1)
+        self.assertEqual(self.count_items(), 1)
+
+    def test_resume(self):
+        checkpoint = self.create()
+        checkpoint.finish_stage('pin')
+        checkpoint.finish_item('database0', result={'cid': 'cid0'}, size=100)
+        checkpoint.flush()
+
+        # the executor after rebooting continues from the saved data.
+        resumed = self.create(self.saved[-1])
+        self.assertTrue(resumed.is_resumed())
+        self.assertTrue(resumed.is_stage_done('pin'))
+        self.assertTrue(resumed.is_item_done('database0'))
+        self.assertEqual(resumed.get_item('database0'), {'cid': 'cid0'})
+        self.assertFalse(resumed.is_item_done('database1'))
+        resumed.skip_item(size=100)
+        resumed.finish_item('database1', size=50)
+        resumed.flush()
+        self.assertEqual(resumed.resumed_bytes, 100)
+        self.assertEqual(self.saved[-1]['resumed_bytes'], 100)
+        self.assertEqual(self.saved[-1]['transferred_bytes'], 150)
+
+        # the new request does not take the items of the last one.
+        self.assertFalse(self.create().is_item_done('database0'))
+        self.assertEqual(self.count_items(), 0)
+
+    def test_old_version(self):
+        # the items in the request document are moved to the collection.
+        resumed = self.create({'stages': {'pin': None}, 'items': {'cid0': None}, 'resumed_bytes': 0, 'transferred_bytes': 10})
+        self.assertTrue(resumed.is_item_done('cid0'))
+        self.assertEqual(self.count_items(), 1)
+        self.assertFalse('items' in self.saved[-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
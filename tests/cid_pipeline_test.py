@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+"""
+Testing file for pinning & unpinning the CIDs of the backup concurrently.
+"""
+import threading
+import unittest
+from unittest import mock
+
+from src.modules.backup.cid_pipeline import CidPipeline
+from src.utils.http_exception import BadRequestException
+
+
+class FakeIpfsClient:
+    """ The IPFS node in memory, the CIDs in 'failures' fail for the times. """
+
+    def __init__(self, pinned=None, failures=None):
+        self.pinned = set(pinned or [])
+        self.failures = dict(failures or {})
+        self.calls = list()
+        self.lock = threading.Lock()
+
+    def __call(self, name, cid):
+        with self.lock:
+            self.calls.append((name, cid))
+            if self.failures.get(cid, 0) > 0:
+                self.failures[cid] -= 1
+                raise Exception(f'failed to {name} {cid}')
+
+    def cid_pinned(self, cid):
+        self.__call('pinned', cid)
+        return cid in self.pinned
+
+    def cid_pin(self, cid, throttle=None):
+        self.__call('pin', cid)
+        self.pinned.add(cid)
+
+    def cid_unpin(self, cid):
+        self.__call('unpin', cid)
+        self.pinned.discard(cid)
+
+
+class CidPipelineTestCase(unittest.TestCase):
+    def create_pipeline(self, ipfs_client, is_unpin=False, retry_times=3):
+        pipeline = CidPipeline(is_unpin=is_unpin, workers=4, retry_times=retry_times)
+        pipeline.ipfs_client = ipfs_client
+        return pipeline
+
+    def test_pin(self):
+        client = FakeIpfsClient(pinned=['cid0'])
+        finished, processes = list(), list()
+        skipped = self.create_pipeline(client).run(['cid0', 'cid1', 'cid2', 'cid1'],
+                                                   on_finished=finished.append,
+                                                   process_callback=lambda f, t: processes.append((f, t)))
+
+        # the duplicated CID is handled once and the pinned one is skipped.
+        self.assertEqual(skipped, 1)
+        self.assertEqual(client.pinned, {'cid0', 'cid1', 'cid2'})
+        self.assertEqual(sorted([c for n, c in client.calls if n == 'pin']), ['cid1', 'cid2'])
+        self.assertEqual(sorted(finished), ['cid0', 'cid1', 'cid2'])
+        self.assertEqual(processes, [(1, 3), (2, 3), (3, 3)])
+
+    def test_unpin(self):
+        client = FakeIpfsClient(pinned=['cid0', 'cid1'])
+        self.assertEqual(self.create_pipeline(client, is_unpin=True).run(['cid0', 'cid1']), 0)
+        self.assertEqual(client.pinned, set())
+        self.assertFalse([c for n, c in client.calls if n == 'pinned'])
+
+    def test_empty(self):
+        client = FakeIpfsClient()
+        self.assertEqual(self.create_pipeline(client).run([]), 0)
+        self.assertFalse(client.calls)
+
+    @mock.patch('src.modules.backup.cid_pipeline.time.sleep')
+    def test_retry(self, sleep):
+        client = FakeIpfsClient(failures={'cid1': 2})
+        self.assertEqual(self.create_pipeline(client).run(['cid0', 'cid1']), 0)
+        self.assertEqual(client.pinned, {'cid0', 'cid1'})
+        self.assertEqual([c[0][0] for c in sleep.call_args_list], [1, 2])
+
+    @mock.patch('src.modules.backup.cid_pipeline.time.sleep')
+    def test_failed(self, sleep):
+        client = FakeIpfsClient(failures={'cid1': 3})
+        finished = list()
+        with self.assertRaises(BadRequestException):
+            self.create_pipeline(client).run(['cid0', 'cid1'], on_finished=finished.append)
+        self.assertNotIn('cid1', finished)
+        self.assertEqual(len([c for n, c in client.calls if c == 'cid1']), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,6 +3,8 @@
 """
 Testing file for the about module.
 """
+import os
+import time
 import unittest
 
 import base58
@@ -13,8 +15,9 @@ from src.modules.backup.encryption import Encryption
 from src.modules.files.local_file import LocalFile
 from src.utils.did.did_wrapper import DIDDocument, Cipher, CipherDecryptionStream, CipherEncryptionStream
 from src.settings import hive_setting
+from src.utils.http_exception import BadRequestException
 from tests.utils.http_client import HttpClient
-from tests import init_test
+from tests import init_test, test_log
 
 
 class CipherTestCase(unittest.TestCase):
@@ -81,6 +84,31 @@ class CipherTestCase(unittest.TestCase):
 
         self.assertEqual(message, plain_data)
 
+    @unittest.skip
+    def test_curve25519_throughput(self):
+        """ Compare the throughput of the legacy chunk size and the bigger ones. """
+        size = 32 * 1024 * 1024
+        tmp_file = LocalFile.generate_tmp_file_path()
+        with open(tmp_file, 'wb') as f:
+            f.write(os.urandom(size))
+
+        pk = Encryption.get_service_did_public_key(False)
+        for chunk_size in (Encryption.TRUNK_SIZE, 64 * 1024, 256 * 1024, 1024 * 1024):
+            start = time.perf_counter()
+            cipher_path = Encryption.encrypt_file_with_curve25519(tmp_file, pk, True, chunk_size=chunk_size)
+            encrypt_elapsed = time.perf_counter() - start
+
+            start = time.perf_counter()
+            plain_path = Encryption.decrypt_file_with_curve25519(cipher_path, pk, False)
+            decrypt_elapsed = time.perf_counter() - start
+
+            test_log(f'chunk size {chunk_size}: encrypt {size / encrypt_elapsed / 1024 / 1024:.1f} MB/s, '
+                     f'decrypt {size / decrypt_elapsed / 1024 / 1024:.1f} MB/s')
+            self.assertEqual(LocalFile.get_sha256(tmp_file.as_posix()), LocalFile.get_sha256(plain_path.as_posix()))
+            cipher_path.unlink()
+            plain_path.unlink()
+        tmp_file.unlink()
+
     @unittest.skip
     def test_pynacl(self):
         message = b"The president will be exiting through the lower levels"
@@ -102,3 +130,33 @@ class CipherTestCase(unittest.TestCase):
         decode_data = base58.b58decode(bytes(encode_data, 'utf8'))
         print(data, encode_data, decode_data)
         self.assertEqual(data, decode_data)
+
+
+class EncryptionStreamTestCase(unittest.TestCase):
+    def __init__(self, method_name='runTest'):
+        super().__init__(method_name)
+        self.encryption = Encryption()
+        self.secret_key, self.nonce = self.encryption.get_private_key()
+
+    @staticmethod
+    def __split(data, size):
+        return [data[i:i + size] for i in range(0, len(data), size)]
+
+    def test01_stream_round_trip(self):
+        for length in (0, 1, Encryption.STREAM_CHUNK_SIZE - 1, Encryption.STREAM_CHUNK_SIZE, Encryption.STREAM_CHUNK_SIZE * 3 + 7):
+            data = os.urandom(length)
+            cipher_data = b''.join(self.encryption.encrypt_stream(self.__split(data, 1000)))
+            self.assertTrue(cipher_data.startswith(Encryption.MAGIC))
+            plain_data = b''.join(Encryption(self.secret_key, self.nonce).decrypt_stream(self.__split(cipher_data, 777)))
+            self.assertEqual(data, plain_data)
+
+    def test02_decrypt_legacy_message(self):
+        data = b'hello world' * 1000
+        cipher_data = self.encryption.box.encrypt(data, self.encryption.nonce).ciphertext
+        plain_data = b''.join(Encryption(self.secret_key, self.nonce).decrypt_stream(self.__split(cipher_data, 1000)))
+        self.assertEqual(data, plain_data)
+
+    def test03_truncated_stream(self):
+        cipher_data = b''.join(self.encryption.encrypt_stream([os.urandom(Encryption.STREAM_CHUNK_SIZE * 2)]))
+        with self.assertRaises(BadRequestException):
+            b''.join(self.encryption.decrypt_stream([cipher_data[:Encryption.STREAM_CHUNK_SIZE + 100]]))
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+"""
+Testing file for the file metadata of the backup.
+"""
+import unittest
+from unittest import mock
+
+from src.modules.files.file_metadata import FileMetadataManager
+from src.modules.database.mongodb_client import MongodbClient
+from src.utils.consts import USR_DID, APP_DID, COL_IPFS_FILES, COL_IPFS_FILES_PATH, COL_IPFS_FILES_SHA256, SIZE, COL_IPFS_FILES_IPFS_CID
+from tests import init_test
+
+USER_DID = 'did:elastos:metadata'
+APP_DIDS = ['did:elastos:app0', 'did:elastos:app1']
+
+
+class FileMetadataTestCase(unittest.TestCase):
+    def __init__(self, method_name='runTest'):
+        super().__init__(method_name)
+        init_test()
+
+    def setUp(self):
+        self.mcli = MongodbClient()
+        self.manager = FileMetadataManager()
+        self.manager.user_manager = mock.Mock(get_apps=lambda user_did: APP_DIDS)
+
+    def tearDown(self):
+        for app_did in APP_DIDS:
+            self.get_col(app_did).delete_many({USR_DID: USER_DID})
+
+    def get_col(self, app_did):
+        return self.mcli.get_user_collection(USER_DID, app_did, COL_IPFS_FILES, create_on_absence=True)
+
+    def add_files(self, app_did, cids):
+        self.get_col(app_did).insert_many([{USR_DID: USER_DID, APP_DID: app_did, COL_IPFS_FILES_PATH: f'file{i}',
+                                            COL_IPFS_FILES_SHA256: f'sha256_{cid}', SIZE: 10, COL_IPFS_FILES_IPFS_CID: cid}
+                                           for i, cid in enumerate(cids)])
+
+    def test_iterate_backup_file_metadatas(self):
+        # the same CID in the applications is merged while streaming.
+        self.add_files(APP_DIDS[0], ['cid3', 'cid1', 'cid1'])
+        self.add_files(APP_DIDS[1], ['cid2', 'cid1'])
+
+        files = list(self.manager.iterate_backup_file_metadatas(USER_DID))
+        self.assertEqual([f['cid'] for f in files], ['cid1', 'cid2', 'cid3'])
+        self.assertEqual(files[0], {'cid': 'cid1', 'sha256': 'sha256_cid1', 'size': 10, 'count': 3, 'total_size': 30})
+        self.assertEqual(sum([f['total_size'] for f in files]), 50)
+
+    def test_no_files(self):
+        self.assertEqual(list(self.manager.iterate_backup_file_metadatas(USER_DID)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+"""
+Testing file for the lease lock of the jobs.
+"""
+import time
+import unittest
+from unittest import mock
+
+from src.modules.database.mongodb_client import MongodbClient
+from src.utils.consts import COL_HIVE_JOBS
+from src.utils.job_lock import JobLease, get_job_lease, JOB_STATE_RUNNING, JOB_STATE_SUCCESS, JOB_STATE_FAILED
+from tests import init_test
+
+JOB_NAME = 'test_job_lease'
+
+
+class JobLeaseTestCase(unittest.TestCase):
+    def __init__(self, method_name='runTest'):
+        super().__init__(method_name)
+        init_test()
+        self.col = MongodbClient().get_management_collection(COL_HIVE_JOBS)
+
+    def setUp(self):
+        self.col.delete_many({'_id': JOB_NAME})
+        self.leases = list()
+
+    def tearDown(self):
+        for lease in self.leases:
+            lease.stopped.set()
+        self.col.delete_many({'_id': JOB_NAME})
+
+    def acquire(self, min_interval=0):
+        lease = JobLease.acquire(JOB_NAME, min_interval=min_interval)
+        if lease:
+            self.leases.append(lease)
+        return lease
+
+    def get_job(self):
+        return self.col.find_one({'_id': JOB_NAME})
+
+    def expire(self):
+        self.col.update_one({'_id': JOB_NAME}, {'$set': {'lease_until': 0}}, contains_extra=False)
+
+    def test_acquire_and_release(self):
+        lease = self.acquire()
+        self.assertIsNotNone(lease)
+        self.assertTrue(lease.is_valid())
+        self.assertIs(get_job_lease(), lease)
+        self.assertEqual(self.get_job()['state'], JOB_STATE_RUNNING)
+
+        # the running job can not be acquired again.
+        self.assertIsNone(self.acquire())
+
+        lease.release()
+        self.assertFalse(lease.is_valid())
+        self.assertIsNone(get_job_lease())
+        job = self.get_job()
+        self.assertEqual(job['state'], JOB_STATE_SUCCESS)
+        self.assertIsNotNone(job['last_success_at'])
+
+        # the token increases by every acquisition.
+        self.assertEqual(self.acquire().token, lease.token + 1)
+
+    def test_release_with_error(self):
+        self.acquire().release(error='failed')
+        job = self.get_job()
+        self.assertEqual(job['state'], JOB_STATE_FAILED)
+        self.assertEqual(job['error'], 'failed')
+        self.assertNotIn('last_success_at', job)
+
+        # the failed job is not limited by the min interval.
+        self.assertIsNotNone(self.acquire(min_interval=3600))
+
+    def test_min_interval(self):
+        self.acquire().release()
+        self.assertIsNone(self.acquire(min_interval=3600))
+        self.assertIsNotNone(self.acquire())
+
+    def test_expired_lease_is_taken(self):
+        old = self.acquire()
+        self.expire()
+        new = self.acquire()
+        self.assertIsNotNone(new)
+        self.assertEqual(new.token, old.token + 1)
+
+        # fencing: the release of the old holder does not overwrite the new one.
+        old.release()
+        job = self.get_job()
+        self.assertEqual(job['state'], JOB_STATE_RUNNING)
+        self.assertEqual(job['token'], new.token)
+
+    def test_heartbeat(self):
+        with mock.patch.object(JobLease, 'HEARTBEAT_INTERVAL', 0.05):
+            old = self.acquire()
+            lease_until = self.get_job()['lease_until']
+            time.sleep(0.2)
+            self.assertGreater(self.get_job()['lease_until'], lease_until)
+
+            # the holder finds the lease lost by the heartbeat.
+            self.expire()
+            self.acquire()
+            time.sleep(0.2)
+            self.assertTrue(old.is_lost)
+            self.assertFalse(old.is_valid())
+
+
+if __name__ == '__main__':
+    unittest.main()
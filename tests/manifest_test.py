@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+"""
+Testing file for the file entries of the backup request metadata.
+"""
+import hashlib
+import unittest
+from unittest import mock
+
+from src.modules.backup import manifest
+from src.modules.backup.encryption import Encryption
+from src.modules.backup.manifest import ManifestShardWriter, MANIFEST_VERSION_SHARDED
+
+
+class FakeIpfsClient:
+    """ The IPFS node in memory. """
+
+    def __init__(self):
+        self.contents = dict()
+
+    def upload_file(self, file_path, throttle=None):
+        data = file_path.read_bytes()
+        cid = f'cid{len(self.contents)}'
+        self.contents[cid] = data
+        return cid
+
+    def download_stream(self, cid, is_proxy=False, sha256=None, size=None, throttle=None):
+        data = self.contents[cid]
+        assert hashlib.sha256(data).hexdigest() == sha256 and len(data) == size
+        # the small chunks which split the lines.
+        for i in range(0, len(data), 7):
+            yield data[i:i + 7]
+
+
+def get_entry(i):
+    return {'path': f'folder/file{i}.txt', 'name': f'file{i}.txt', 'cid': f'file-cid{i}', 'sha256': 'é' * i, 'size': i}
+
+
+class ManifestTestCase(unittest.TestCase):
+    def setUp(self):
+        self.ipfs_client = FakeIpfsClient()
+        self.patcher = mock.patch('src.modules.backup.manifest.IpfsClient', return_value=self.ipfs_client)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def test_sharded(self):
+        encryption = Encryption()
+        writer = ManifestShardWriter(encryption, shard_size=4)
+        entries = [get_entry(i) for i in range(10)]
+        for entry in entries:
+            writer.add(entry)
+        shards = writer.close()
+
+        self.assertEqual([s['count'] for s in shards], [4, 4, 2])
+        self.assertEqual(writer.files_count, 10)
+        self.assertEqual(writer.files_size, sum(range(10)))
+        # the shards are encrypted.
+        self.assertTrue(all([b'file0' not in d for d in self.ipfs_client.contents.values()]))
+
+        secret_key, nonce = encryption.get_private_key()
+        request_metadata = {'version': MANIFEST_VERSION_SHARDED,
+                            'encryption': {'secret_key': secret_key, 'nonce': nonce},
+                            'file_shards': shards,
+                            'files_count': writer.files_count,
+                            'files_size': writer.files_size}
+        self.assertTrue(manifest.is_sharded(request_metadata))
+        self.assertEqual(manifest.get_files_count(request_metadata), 10)
+        self.assertEqual(manifest.get_files_size(request_metadata), sum(range(10)))
+        self.assertEqual(list(map(len, manifest.iterate_file_batches(request_metadata))), [4, 4, 2])
+        self.assertEqual(list(manifest.iterate_files(request_metadata)), entries)
+
+    def test_empty(self):
+        writer = ManifestShardWriter(Encryption(), shard_size=4)
+        self.assertEqual(writer.close(), [])
+        self.assertFalse(self.ipfs_client.contents)
+
+    def test_not_sharded(self):
+        entries = [get_entry(i) for i in range(5)]
+        request_metadata = {'files': entries}
+        self.assertFalse(manifest.is_sharded(request_metadata))
+        self.assertEqual(manifest.get_files_count(request_metadata), 5)
+        self.assertEqual(manifest.get_files_size(request_metadata), sum(range(5)))
+        self.assertEqual(list(manifest.iterate_file_batches(request_metadata, batch_size=2)), [entries[0:2], entries[2:4], entries[4:]])
+        self.assertEqual(list(manifest.iterate_files(request_metadata)), entries)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+"""
+Testing file for the metrics in the Prometheus text format.
+"""
+import os
+import unittest
+from unittest import mock
+
+from src.utils import metrics
+from src.utils.metrics import Counter, Histogram, Gauge, render_metrics
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        # the metrics of the tests are not registered to the ones of the node.
+        self.patcher = mock.patch.object(metrics, '_metrics', list())
+        self.patcher.start()
+        self.pid = f'pid="{os.getpid()}"'
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def test_counter(self):
+        counter = Counter('test_total', 'The test counter.', ('operation', ))
+        counter.inc('get')
+        counter.inc('get', value=2)
+        counter.inc('a"b\\c\nd')
+        self.assertEqual(counter.render(), ['# HELP test_total The test counter.',
+                                            '# TYPE test_total counter',
+                                            f'test_total{{operation="get",{self.pid}}} 3',
+                                            f'test_total{{operation="a\\"b\\\\c\\nd",{self.pid}}} 1'])
+
+    def test_histogram(self):
+        histogram = Histogram('test_seconds', 'The test histogram.', ('operation', ), buckets=(0.1, 1))
+        histogram.observe(0.05, 'find')
+        histogram.observe(0.1, 'find')
+        histogram.observe(0.5, 'find')
+        histogram.observe(5, 'find')
+        labels = f'operation="find",{self.pid}'
+        self.assertEqual(histogram.render(), ['# HELP test_seconds The test histogram.',
+                                              '# TYPE test_seconds histogram',
+                                              f'test_seconds_bucket{{{labels},le="0.1"}} 2',
+                                              f'test_seconds_bucket{{{labels},le="1"}} 3',
+                                              f'test_seconds_bucket{{{labels},le="+Inf"}} 4',
+                                              f'test_seconds_sum{{{labels}}} 5.65',
+                                              f'test_seconds_count{{{labels}}} 4'])
+
+    def test_histogram_time(self):
+        histogram = Histogram('test_seconds', 'The test histogram.', ('operation', ))
+
+        @histogram.time('raise')
+        def failed():
+            raise ValueError('failed')
+
+        with self.assertRaises(ValueError):
+            failed()
+        self.assertEqual(histogram.values[('raise', )][0][0], 1)
+
+    def test_gauge(self):
+        gauge = Gauge('test_jobs', 'The test gauge.', ('state', ), callback=lambda: {('running', ): 2})
+        self.assertEqual(gauge.render(), ['# HELP test_jobs The test gauge.',
+                                          '# TYPE test_jobs gauge',
+                                          f'test_jobs{{state="running",{self.pid}}} 2'])
+
+    def test_render_metrics(self):
+        Counter('test_total', 'The test counter.').inc()
+
+        def failed():
+            raise Exception('no database')
+        Gauge('test_jobs', 'The test gauge.', callback=failed)
+
+        # the failed metric does not break the others.
+        self.assertEqual(render_metrics(), '\n'.join(['# HELP test_total The test counter.',
+                                                      '# TYPE test_total counter',
+                                                      f'test_total{{{self.pid}}} 1',
+                                                      '# test_jobs: failed to render: no database']) + '\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+"""
+Testing file for recounting the usage of the vaults by the scheduler.
+"""
+import unittest
+from unittest import mock
+
+from src.modules.database.mongodb_client import MongodbClient
+from src.utils import scheduler
+from src.utils.consts import VAULT_SERVICE_COL, VAULT_SERVICE_DID, VAULT_SERVICE_FILE_USE_STORAGE, VAULT_SERVICE_DB_USE_STORAGE
+from tests import init_test
+
+USER_DIDS = ['did:elastos:recount0', 'did:elastos:recount1']
+
+
+class CountVaultStorageTestCase(unittest.TestCase):
+    def __init__(self, method_name='runTest'):
+        super().__init__(method_name)
+        init_test()
+
+    def setUp(self):
+        self.col = MongodbClient().get_management_collection(VAULT_SERVICE_COL)
+        self.col.insert_many([{VAULT_SERVICE_DID: user_did, VAULT_SERVICE_FILE_USE_STORAGE: 100, VAULT_SERVICE_DB_USE_STORAGE: 50}
+                              for user_did in USER_DIDS], contains_extra=False)
+
+        # the first vault has 20 bytes more files than the recorded usage.
+        vault_manager = mock.Mock(count_app_files_total_size=lambda user_did, app_did: 120 if user_did == USER_DIDS[0] else 100)
+        self.patchers = [mock.patch.object(scheduler, 'UserManager', return_value=mock.Mock(get_apps=lambda user_did: ['did:elastos:app'])),
+                         mock.patch.object(scheduler, 'VaultManager', return_value=vault_manager),
+                         mock.patch.object(scheduler.MongodbClient, 'get_user_database_size', return_value=50),
+                         mock.patch.object(scheduler, 'VAULT_STORAGE_COUNT_DURATION'),
+                         mock.patch.object(scheduler, 'VAULT_STORAGE_DRIFT_BYTES'),
+                         mock.patch.dict(scheduler._vault_storage_drifts, clear=True)]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        self.col.delete_many({VAULT_SERVICE_DID: {'$in': USER_DIDS}})
+
+    def test_metrics(self):
+        summary = scheduler.count_vault_storage_really(is_force=True)
+        self.assertEqual(summary['drifted'], 1)
+
+        # the duration and the drift of every vault are published.
+        scheduler.VAULT_STORAGE_COUNT_DURATION.observe.assert_called_once()
+        scheduler.VAULT_STORAGE_DRIFT_BYTES.inc.assert_any_call('files', value=20)
+        self.assertEqual(scheduler._vault_storage_drifts, {(USER_DIDS[0], 'files'): 20})
+
+        # the gauge keeps the drift of the last recount.
+        self.col.update_one({VAULT_SERVICE_DID: USER_DIDS[0]}, {'$set': {VAULT_SERVICE_FILE_USE_STORAGE: 0}}, contains_extra=False)
+        scheduler.count_vault_storage_really(is_force=True)
+        self.assertEqual(scheduler._vault_storage_drifts, {(USER_DIDS[0], 'files'): 120})
+
+        # the vault is removed from the gauge when the usage is right.
+        self.col.update_one({VAULT_SERVICE_DID: USER_DIDS[0]}, {'$set': {VAULT_SERVICE_FILE_USE_STORAGE: 120}}, contains_extra=False)
+        scheduler.count_vault_storage_really(is_force=True)
+        self.assertEqual(scheduler._vault_storage_drifts, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
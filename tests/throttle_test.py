@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+"""
+Testing file for the rate limits of the backup traffic.
+"""
+import time
+import unittest
+from unittest import mock
+
+from src.utils import throttle
+from src.utils.throttle import TokenBucket, Throttle, THROTTLE_DOWNLOAD, THROTTLE_UPLOAD
+
+
+class ThrottleTestCase(unittest.TestCase):
+    def setUp(self):
+        # the shared buckets of the directions are unlimited.
+        self.patcher = mock.patch.dict(throttle._direction_buckets, {THROTTLE_DOWNLOAD: TokenBucket(0), THROTTLE_UPLOAD: TokenBucket(0)})
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def test_unlimited(self):
+        bucket = TokenBucket(0)
+        start = time.monotonic()
+        for _ in range(1000):
+            bucket.consume(1024 * 1024)
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_token_bucket(self):
+        # the burst of the capacity passes, then the debt of 50KB is paid by 0.5 second.
+        bucket = TokenBucket(100 * 1024)
+        start = time.monotonic()
+        bucket.consume(100 * 1024)
+        self.assertLess(time.monotonic() - start, 0.1)
+        bucket.consume(50 * 1024)
+        self.assertAlmostEqual(time.monotonic() - start, 0.5, delta=0.15)
+
+    def test_chunk_larger_than_capacity(self):
+        bucket = TokenBucket(100 * 1024, capacity=10 * 1024)
+        start = time.monotonic()
+        bucket.consume(40 * 1024)
+        self.assertAlmostEqual(time.monotonic() - start, 0.3, delta=0.15)
+
+    def test_job_rate(self):
+        # the buckets of the directions of the job are separated.
+        job = Throttle(job_rate=100 * 1024)
+        start = time.monotonic()
+        job.consume(THROTTLE_DOWNLOAD, 100 * 1024)
+        job.consume(THROTTLE_UPLOAD, 100 * 1024)
+        self.assertLess(time.monotonic() - start, 0.1)
+        job.consume(THROTTLE_UPLOAD, 30 * 1024)
+        self.assertAlmostEqual(time.monotonic() - start, 0.3, delta=0.15)
+
+    def test_iterate_and_throughput(self):
+        job = Throttle(job_rate=0)
+        chunks = [b'a' * 1024, b'', b'b' * 2048]
+        self.assertEqual(list(job.iterate(THROTTLE_DOWNLOAD, chunks)), chunks)
+        self.assertEqual(job.get_throughput(), 3 * 1024 // Throttle.WINDOW)
+
+        # the samples out of the window are not counted.
+        with mock.patch('src.utils.throttle.time.monotonic', return_value=time.monotonic() + Throttle.WINDOW + 1):
+            self.assertEqual(job.get_throughput(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
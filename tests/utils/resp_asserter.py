@@ -67,6 +67,7 @@ class RA(unittest.TestCase):
 
         RA(response).assert_status(200)
         RA(response).assert_status(200, 455)
+        RA(response).assert_mongo_commands(3)
 
         RA(response).body().get('executable_find')
         RA(response).body().get('inserted_ids', list)
@@ -90,6 +91,15 @@ class RA(unittest.TestCase):
         self.assertIsInstance(self.response.json(), dict)
         return DictAsserter(**self.response.json())
 
+    def assert_mongo_commands(self, max_count):
+        """ Check the count of the MongoDB commands of the request by the header 'X-Hive-Mongo',
+        the header only exists when MONGO_TRACE_HEADER is enabled on the hive node. """
+        summary = self.response.headers.get('X-Hive-Mongo')
+        if summary is None:
+            return
+        count = int(summary.split(';')[0].split('=')[1])
+        self.assertLessEqual(count, max_count, f'Too many MongoDB commands: {summary}')
+
     def text_equal(self, dst_value):
         self.assertIsInstance(dst_value, str)
         self.assertEqual(self.response.text, dst_value)
@@ -0,0 +1,10 @@
+"""
+The WSGI entry point of the prefork server, such as gunicorn:
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+The development server is still started by: python manage.py runserver
+"""
+from src import create_app
+
+application = create_app()